@@ -27,13 +27,26 @@ Searches the filesystem for the biggest files.
 """
 
 import argparse
+import array
 import bisect
 import collections
+import concurrent.futures
+import csv
+import errno
+import fnmatch
 import glob
+import heapq
 import itertools
+import json
 import os
+import pathlib
+import queue
+import re
 import sqlite3
 import sys
+import threading
+import time
+from stat import S_ISREG
 
 ################################################################################
 
@@ -111,6 +124,14 @@ class BigFilesArgumentParser(argparse.ArgumentParser):
                 "instead of individual files, non-recursively"
         )
 
+        self.add_argument(
+            "-c", "--cumulative",
+            action="store_true",
+            default=False,
+            help="With --directories, consider the size of files within " +
+                "directories recursively, like the \"du\" command"
+        )
+
         self.add_argument(
             "-e", "--ignore-errors",
             action="store_true",
@@ -118,6 +139,136 @@ class BigFilesArgumentParser(argparse.ArgumentParser):
             help="Ignore errors accessing files"
         )
 
+        self.add_argument(
+            "--size-mode",
+            choices=("apparent", "allocated"),
+            default="apparent",
+            help="Whether the size of a file is its apparent size or the " +
+                "disk space allocated for it, which is smaller for sparse " +
+                "files (default %(default)s)"
+        )
+
+        self.add_argument(
+            "--dedup-hardlinks",
+            action="store_true",
+            default=False,
+            help="Count a file with multiple hard links only once, the first " +
+                "time one of its links is found; with --processes, links " +
+                "are only de-duplicated within each worker"
+        )
+
+        self.add_argument(
+            "-j", "--jobs",
+            type=self.type_positive_integer,
+            default=1,
+            help="The number of threads to use to scan directories " +
+                "concurrently (default %(default)i)"
+        )
+
+        self.add_argument(
+            "-P", "--processes",
+            type=self.type_positive_integer,
+            default=1,
+            help="The number of worker processes with which to search the " +
+                "paths concurrently; each directory is searched by one " +
+                "worker, and the results of the workers are merged; cannot " +
+                "be used with --save (default %(default)i)"
+        )
+
+        self.add_argument(
+            "--shard-subdirs",
+            action="store_true",
+            default=False,
+            help="With --processes, search each subdirectory of each " +
+                "directory in its own worker instead of each directory"
+        )
+
+        # Arguments for filtering
+
+        self.add_argument(
+            "--include",
+            action="append",
+            default=[],
+            metavar="GLOB",
+            help="Only search files matching this wildcard pattern; may be " +
+                "specified more than once; patterns containing a path " +
+                "separator are matched against the whole path and others " +
+                "against the file name"
+        )
+
+        self.add_argument(
+            "--exclude",
+            action="append",
+            default=[],
+            metavar="GLOB",
+            help="Do not search files, or descend into directories, " +
+                "matching this wildcard pattern; may be specified more than " +
+                "once; matched like --include"
+        )
+
+        self.add_argument(
+            "--min-size",
+            type=self.type_size,
+            help="Only search files at least this big, in bytes or with a " +
+                "unit from --list-size-units (eg. 1GiB)"
+        )
+
+        self.add_argument(
+            "--max-size",
+            type=self.type_size,
+            help="Only search files at most this big; see --min-size"
+        )
+
+        self.add_argument(
+            "--min-age",
+            type=self.type_days,
+            metavar="DAYS",
+            help="Only search files last modified at least this many days ago"
+        )
+
+        self.add_argument(
+            "--max-age",
+            type=self.type_days,
+            metavar="DAYS",
+            help="Only search files last modified at most this many days ago"
+        )
+
+        self.add_argument(
+            "-x", "--one-file-system",
+            action="store_true",
+            default=False,
+            help="Do not descend into directories on other file systems"
+        )
+
+        # Arguments for progress reporting
+
+        self.add_argument(
+            "--progress",
+            action="store_true",
+            default=False,
+            help="Periodically print a line to standard error with the " +
+                "number of files, or of directories with --directories, " +
+                "found per second, the bytes seen, except with " +
+                "--cumulative, the number of directories pending, the " +
+                "number of errors and the current top size"
+        )
+
+        self.add_argument(
+            "--progress-interval",
+            type=float,
+            default=5.0,
+            metavar="SECONDS",
+            help="The number of seconds between the lines printed by " +
+                "--progress (default %(default)g)"
+        )
+
+        self.add_argument(
+            "--stats-json",
+            dest="stats_json_path",
+            help="Write statistics about the search to this file, in JSON " +
+                "format, when it completes"
+        )
+
         # Arguments for size formatting
 
         self.add_argument(
@@ -143,6 +294,27 @@ class BigFilesArgumentParser(argparse.ArgumentParser):
                 "Binary base 2 units instead of SI Decimal base 10"
         )
 
+        # Arguments for output
+
+        self.add_argument(
+            "--output-format",
+            choices=sorted(RESULT_WRITER_TYPES),
+            default="text",
+            help="The format in which to print the results: lines of text, " +
+                "newline-delimited JSON objects, a JSON array or CSV " +
+                "(default %(default)s)"
+        )
+
+        self.add_argument(
+            "--stream",
+            action="store_true",
+            default=False,
+            help="Print every file as soon as it is found, in the order in " +
+                "which they are found, instead of the largest files when " +
+                "the search completes; --num-results, --invert, " +
+                "--reverse-order and --no-padding are ignored"
+        )
+
         class ListSizeUnitsAction(argparse.Action):
             def __call__(self, parser, namespace, values, option_string=None):
                 parser.list_sizes()
@@ -164,13 +336,54 @@ class BigFilesArgumentParser(argparse.ArgumentParser):
                 "an SQLite database with the given name"
         )
 
+        self.add_argument(
+            "--save-batch-size",
+            type=self.type_positive_integer,
+            default=10000,
+            help="The number of files to buffer before writing them to the " +
+                "--save database (default %(default)i)"
+        )
+
+        self.add_argument(
+            "--save-commit-interval",
+            type=self.type_positive_integer,
+            default=1000000,
+            help="Commit the --save database after every this many files, " +
+                "so that a crash does not lose the entire scan; 0 commits " +
+                "only at the end (default %(default)i)"
+        )
+
+        self.add_argument(
+            "--incremental",
+            action="store_true",
+            default=False,
+            help="Reuse the files recorded by a previous --save into the " +
+                "same database for directories whose modification time has " +
+                "not changed, instead of scanning them again; the database " +
+                "should always be saved with the same paths, and the sizes " +
+                "of files modified in place are not updated until their " +
+                "directory changes; requires --save"
+        )
+
         self.add_argument(
             "--load",
             type=self.type_file_exists,
             dest="db_load_path",
             help="Load paths and file sizes from this file, which must be " +
                 "an SQLite database created with --save, in addition to " +
-                "the paths specified in the positional parameters"
+                "the paths specified in the positional parameters; the " +
+                "filters, such as --exclude, are not applied to it"
+        )
+
+        self.add_argument(
+            "--diff",
+            type=self.type_file_exists,
+            nargs=2,
+            metavar=("OLD_DB", "NEW_DB"),
+            dest="diff_paths",
+            help="Instead of searching, print the largest files and " +
+                "directories added, removed and grown between two " +
+                "SQLite databases created with --save"
         )
 
     def parse_args(self, *args, **kwargs):
@@ -180,6 +393,44 @@ class BigFilesArgumentParser(argparse.ArgumentParser):
         with the given parameters, and then tweaks the return value.
         """
         result = argparse.ArgumentParser.parse_args(self, *args, **kwargs)
+        if result.diff_paths is not None:
+            if result.paths or result.db_save_path is not None or \
+                    result.db_load_path is not None:
+                self.error("--diff cannot be used with paths, --save or " +
+                    "--load")
+            elif result.stream or result.output_format != "text":
+                self.error("--diff cannot be used with --stream or " +
+                    "--output-format")
+            return result
+
+        if result.incremental:
+            if result.db_save_path is None:
+                self.error("--incremental requires --save")
+            elif result.directories:
+                self.error("--incremental cannot be used with --directories")
+            elif result.size_mode != "apparent" or result.dedup_hardlinks:
+                self.error("--incremental cannot be used with --size-mode " +
+                    "or --dedup-hardlinks")
+            elif (result.include or result.exclude or
+                    result.min_size is not None or
+                    result.max_size is not None or
+                    result.min_age is not None or
+                    result.max_age is not None or result.one_file_system):
+                self.error("--incremental cannot be used with filters")
+        if result.processes > 1 and result.db_save_path is not None:
+            self.error("--processes cannot be used with --save")
+        if result.stream and (result.processes > 1 or
+                result.db_load_path is not None):
+            self.error("--stream cannot be used with --processes or --load, " +
+                "which only produce the largest files")
+        if result.cumulative:
+            if not result.directories:
+                self.error("--cumulative requires --directories")
+            elif result.db_load_path is not None:
+                self.error("--cumulative cannot be used with --load")
+        if result.shard_subdirs and result.directories:
+            self.error("--shard-subdirs cannot be used with --directories")
+
         if len(result.paths) == 0 and result.db_load_path is None:
             if result.directories:
                 result.paths.append(".")
@@ -213,6 +464,46 @@ class BigFilesArgumentParser(argparse.ArgumentParser):
 
         return value_int
 
+    @staticmethod
+    def type_size(value):
+        """
+        Converts a string to a size, in bytes.
+        The *value* parameter must be a string whose value is a number,
+        optionally followed by the name of a unit from UNIT_TABLE_SI_DECIMAL or
+        UNIT_TABLE_IEC_BINARY, such as "1.5GB" or "100MiB"; unit names are not
+        case-sensitive.
+        If the conversion fails then argparse.ArgumentTypeError is raised.
+        Returns the integer to which the given value was converted.
+        """
+        units = {"b": 1}
+        for unit in UNIT_TABLE_SI_DECIMAL + UNIT_TABLE_IEC_BINARY:
+            units[unit.name.lower()] = unit.size
+
+        match = re.match(r"^\s*([0-9]*\.?[0-9]+)\s*([a-zA-Z]*)\s*$", value)
+        if match is None or match.group(2).lower() not in units \
+                and match.group(2) != "":
+            raise argparse.ArgumentTypeError("invalid size: %s" % value)
+
+        multiplier = units.get(match.group(2).lower(), 1)
+        return int(float(match.group(1)) * multiplier)
+
+    @staticmethod
+    def type_days(value):
+        """
+        Converts a string to a non-negative number of days.
+        If the conversion fails then argparse.ArgumentTypeError is raised.
+        Returns the float to which the given value was converted.
+        """
+        try:
+            value_float = float(value)
+        except ValueError:
+            raise argparse.ArgumentTypeError("invalid number: %s" % value)
+
+        if value_float < 0:
+            raise argparse.ArgumentTypeError("invalid value: %s" % value)
+
+        return value_float
+
     @staticmethod
     def type_path_wildcard(value):
         """
@@ -288,6 +579,8 @@ class BigFilesArgumentParser(argparse.ArgumentParser):
 class BigFilesSearchEngine(object):
     """
     Searches a set of paths for the largest files.
+    The results are kept in a sorted list, which makes each accepted file cost
+    O(N) in the number of results; see BigFilesHeapSearchEngine for large N.
     """
 
     def __init__(self, max_results, invert):
@@ -296,6 +589,9 @@ class BigFilesSearchEngine(object):
         self.sizes = []
         self.paths = []
 
+        # the index in self.sizes of the result to be evicted when full
+        self.worst_index = -1 if invert else 0
+
     def add_file(self, path, size):
         """
         Updates this object by searching the file with the given path.
@@ -303,17 +599,21 @@ class BigFilesSearchEngine(object):
         file whose size to update this search engine with.
         The *size* parameter must be an integer whose value is the size of the
         given file.
+        When sizes are tied, the file that was added first is kept.
         """
-        if len(self.sizes) < self.max_results or \
-                self.cmp_sizes(size, self.sizes[0]) > 0:
+        if len(self.sizes) < self.max_results or (self.max_results > 0 and
+                self.cmp_sizes(size, self.sizes[self.worst_index]) > 0):
 
-            index = bisect.bisect_left(self.sizes, size)
+            if self.invert:
+                index = bisect.bisect_right(self.sizes, size)
+            else:
+                index = bisect.bisect_left(self.sizes, size)
             self.sizes.insert(index, size)
             self.paths.insert(index, path)
 
             if len(self.sizes) > self.max_results:
-                del self.sizes[0]
-                del self.paths[0]
+                del self.sizes[self.worst_index]
+                del self.paths[self.worst_index]
 
     def results(self):
         """
@@ -321,6 +621,7 @@ class BigFilesSearchEngine(object):
         Returns an iterable that yields (size, path) tuples where *path* is
         a string whose value is the path of the file and *size* is an integer
         whose value is the size of the size of the file.
+        The results are yielded in ascending order of size.
         """
         return zip(self.sizes, self.paths)
 
@@ -340,25 +641,181 @@ class BigFilesSearchEngine(object):
 
 ################################################################################
 
+class BigFilesHeapSearchEngine(object):
+    """
+    Searches a set of paths for the largest files.
+    This class has the same interface and results as BigFilesSearchEngine but
+    keeps its results in a bounded heap, making each accepted file cost
+    O(log N) in the number of results.
+    """
+
+    def __init__(self, max_results, invert):
+        self.max_results = max_results
+        self.invert = invert
+
+        # a min-heap of (key, -sequence_number, path) tuples, where key is the
+        # size, or the negated size if inverted, so that heap[0] is always the
+        # result to be evicted next
+        self.heap = []
+        self.sequence_numbers = itertools.count()
+
+    def add_file(self, path, size):
+        """
+        Updates this object by searching the file with the given path.
+        See BigFilesSearchEngine.add_file() for details.
+        """
+        key = -size if self.invert else size
+        heap = self.heap
+        if len(heap) < self.max_results:
+            heapq.heappush(heap, (key, -next(self.sequence_numbers), path))
+        elif self.max_results > 0 and key > heap[0][0]:
+            heapq.heapreplace(heap, (key, -next(self.sequence_numbers), path))
+
+    def results(self):
+        """
+        Returns the results of the search.
+        See BigFilesSearchEngine.results() for details.
+        """
+        if self.invert:
+            entries = sorted(self.heap, reverse=True)
+            return ((-key, path) for (key, _, path) in entries)
+        else:
+            entries = sorted(self.heap)
+            return ((key, path) for (key, _, path) in entries)
+
+################################################################################
+
+HEAP_SEARCH_ENGINE_THRESHOLD = 1000
+"""
+The maximum number of results at and above which create_search_engine() uses
+BigFilesHeapSearchEngine; determined by the "engine" benchmark in
+bigfiles_benchmark.py.
+"""
+
+def create_search_engine(max_results, invert):
+    """
+    Creates the search engine best suited to the given number of results.
+    The *max_results* and *invert* parameters are the same as those of
+    BigFilesSearchEngine.
+    Returns a BigFilesSearchEngine or BigFilesHeapSearchEngine.
+    """
+    if max_results >= HEAP_SEARCH_ENGINE_THRESHOLD:
+        engine_type = BigFilesHeapSearchEngine
+    else:
+        engine_type = BigFilesSearchEngine
+    return engine_type(max_results=max_results, invert=invert)
+
+################################################################################
+
 class Database(object):
 
-    def __init__(self, path):
+    SCHEMA_VERSION = 2
+    """
+    The version of the database schema, stored in the "user_version" pragma.
+    Version 0 is the original schema, with only the "files" table; version 1
+    adds the "directories" table used by --incremental; version 2 makes the
+    paths of the "files" table unique and indexes their sizes.
+    """
+
+    def __init__(self, path, batch_size=1, commit_interval=None,
+            read_only=False):
+        """
+        Initializes a new instance of Database.
+        The *path* parameter must be a string whose value is the path of the
+        SQLite database file to open.
+        If *read_only* is True then the database is opened read-only, as with
+        --load and --diff, so that the snapshot is never modified; it must
+        already exist.
+        The *batch_size* parameter must be an integer whose value is the number
+        of rows given to add_file() that are buffered before they are written
+        to the database with a single executemany().
+        The *commit_interval* parameter must be an integer whose value is the
+        number of rows written after which the changes are committed, so that
+        they survive a crash; may be None to only commit when commit() is
+        invoked.
+        """
         self.path = path
-        self.con = sqlite3.connect(path)
+        self.read_only = read_only
+        if read_only:
+            self.uri = pathlib.Path(os.path.abspath(path)).as_uri() + "?mode=ro"
+            self.con = sqlite3.connect(self.uri, uri=True)
+        else:
+            self.uri = path
+            self.con = sqlite3.connect(path)
+        self.batch_size = batch_size
+        self.commit_interval = commit_interval
+
+        self.pending_rows = []
+        self.num_rows_since_commit = 0
+
+        self.schema_version = None
+        """
+        The schema version of the database, as found by initialize(); see
+        SCHEMA_VERSION.
+        """
+
+        self.num_rows_written = 0
+        """
+        The number of rows written by add_file(); see also write_seconds.
+        """
+
+        self.write_seconds = 0.0
+        """
+        The number of seconds spent writing rows given to add_file() and
+        committing them.
+        """
 
     def initialize(self):
         """
         Initializes this connection and prepares it for use.
-        This method sets up the connection and creates any required tables.
+        This method sets up the connection and creates any required tables,
+        upgrading the schema of databases created by older versions.
+        A read-only database is never upgraded; the "files" table of every
+        schema version has the "path" and "size" columns that the queries of
+        --load need, just without the indexes of the current version.
+        Raises sqlite3.Error on error, including if a read-only database does
+        not contain a snapshot or was saved by a newer version.
         """
         cur = self.con.cursor()
+        cur.execute("PRAGMA user_version")
+        (version,) = cur.fetchone()
+        self.schema_version = version
+
+        if self.read_only:
+            if version > self.SCHEMA_VERSION:
+                raise sqlite3.DatabaseError("database was saved by a newer "
+                    "version of this application (schema version %i)" % version)
+            cur.execute("""
+                SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'files'
+            """)
+            if cur.fetchone() is None:
+                raise sqlite3.DatabaseError("database does not contain a "
+                    "snapshot saved with --save")
+            return
+
+        # create the tables if they do not already exist, or upgrade them; this
+        # is done in a transaction, with the journal still enabled, so that an
+        # interrupted upgrade leaves the database as it was
+        if version < self.SCHEMA_VERSION:
+            cur.execute("BEGIN")
+            if version < 1:
+                self.upgrade_to_version_1(cur)
+            if version < 2:
+                self.upgrade_to_version_2(cur)
+            cur.execute("PRAGMA user_version = %i" % self.SCHEMA_VERSION)
+            self.con.commit()
 
         # set some pragmas to increase performance
         cur.execute("PRAGMA fullfsync = off")
         cur.execute("PRAGMA journal_mode = off")
         cur.execute("PRAGMA synchronous = off")
 
-        # create the table if it does not already exist
+    @staticmethod
+    def upgrade_to_version_1(cur):
+        """
+        Upgrades a database from schema version 0 to version 1.
+        The *cur* parameter must be a cursor with which to execute statements.
+        """
         cur.execute("""
             CREATE TABLE IF NOT EXISTS files (
                 path TEXT,
@@ -366,30 +823,117 @@ class Database(object):
             )
         """)
 
-        self.commit()
+        cur.execute("PRAGMA table_info(files)")
+        column_names = [row[1] for row in cur.fetchall()]
+        if "dir_id" not in column_names:
+            cur.execute("ALTER TABLE files ADD COLUMN dir_id INTEGER")
+
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS directories (
+                id INTEGER PRIMARY KEY,
+                path TEXT UNIQUE NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                subdirs TEXT NOT NULL,
+                generation INTEGER NOT NULL
+            )
+        """)
+
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS files_dir_id ON files (dir_id)
+        """)
+
+    @staticmethod
+    def upgrade_to_version_2(cur):
+        """
+        Upgrades a database from schema version 1 to version 2.
+        The "files" table is rebuilt with a unique path and an index on size;
+        if a path occurs more than once, as could happen by saving into the
+        same database more than once, then the most recently added row wins.
+        The *cur* parameter must be a cursor with which to execute statements.
+        """
+        cur.execute("ALTER TABLE files RENAME TO files_version_1")
+        cur.execute("DROP INDEX IF EXISTS files_dir_id")
+
+        cur.execute("""
+            CREATE TABLE files (
+                id INTEGER PRIMARY KEY,
+                path TEXT UNIQUE NOT NULL,
+                size INTEGER NOT NULL,
+                dir_id INTEGER
+            )
+        """)
+
+        cur.execute("""
+            INSERT OR REPLACE INTO files (path, size, dir_id)
+            SELECT path, size, dir_id FROM files_version_1
+            WHERE path IS NOT NULL AND size IS NOT NULL
+            ORDER BY rowid
+        """)
+        cur.execute("DROP TABLE files_version_1")
+
+        cur.execute("CREATE INDEX files_size ON files (size)")
+        cur.execute("CREATE INDEX files_dir_id ON files (dir_id)")
 
     def close(self):
         """
         Closes this connection from use.
+        Rows buffered by add_file() that have not been flushed are discarded;
+        invoke commit() first to keep them.
         """
         self.con.close()
 
     def commit(self):
         """
-        Commits all changes since the last commit.
+        Commits all changes since the last commit, including the rows buffered
+        by add_file().
         """
+        self.flush()
+        start_time = time.perf_counter()
         self.con.commit()
+        self.num_rows_since_commit = 0
+        self.write_seconds += time.perf_counter() - start_time
 
-    def add_file(self, path, size):
+    def flush(self):
+        """
+        Writes the rows buffered by add_file() to the database, committing if
+        the commit interval given to __init__() has been reached.
+        """
+        if not self.pending_rows:
+            return
+
+        start_time = time.perf_counter()
+        self.con.executemany("""
+            INSERT OR REPLACE INTO files (path, size, dir_id) VALUES (?, ?, ?)
+        """, self.pending_rows)
+        self.num_rows_written += len(self.pending_rows)
+        self.num_rows_since_commit += len(self.pending_rows)
+        self.pending_rows = []
+
+        if self.commit_interval is not None and \
+                self.num_rows_since_commit >= self.commit_interval:
+            self.con.commit()
+            self.num_rows_since_commit = 0
+
+        self.write_seconds += time.perf_counter() - start_time
+
+    def add_file(self, path, size, dir_id=None):
         """
         Adds a file with the given path and size.
         The *path* parameter must be the string whose value is the path of a
         file whose size to update this search engine with.
         The *size* parameter must be an integer whose value is the size of the
         given file.
+        The *dir_id* parameter is the id of the row in the "directories" table
+        of the directory containing the file, or None if the file is not part
+        of an incremental snapshot.
+        The file replaces any existing file with the same path.  The row is
+        buffered and written when the batch size given to __init__() is
+        reached, or by flush() or commit().
         """
-        self.con.execute("INSERT INTO files (path, size) VALUES (?, ?)",
-            (path, size))
+        self.pending_rows.append((path, size, dir_id))
+        if len(self.pending_rows) >= self.batch_size:
+            self.flush()
 
     def __iter__(self):
         """
@@ -398,111 +942,1291 @@ class Database(object):
         path of a file in the filesystem and *size* is an integer whose value is
         the size of that file.  Raises sqlite3.Error on error.
         """
+        self.flush()
         cur = self.con.cursor()
         cur.execute("SELECT path, size FROM files")
         for result in cur:
             yield result
 
-################################################################################
+    def top_files(self, limit, ascending):
+        """
+        Returns an iterator over the (path, size) tuples of the largest files,
+        or the smallest if *ascending* is True, using the index on size.
+        The *limit* parameter must be an integer whose value is the maximum
+        number of files to return.  Raises sqlite3.Error on error.
+        """
+        self.flush()
+        cur = self.con.cursor()
+        cur.execute("""
+            SELECT path, size FROM files
+            ORDER BY size %s
+            LIMIT ?
+        """ % ("ASC" if ascending else "DESC"), (limit,))
+        return cur
+
+    def top_directories(self, limit, ascending):
+        """
+        Returns an iterator over the (dir_path, size) tuples of the directories
+        whose files have the largest sum of sizes, or smallest if *ascending*
+        is True.
+        Each *dir_path* is the path of a file up to and including its last
+        os.sep, and is the empty string for relative paths without one.
+        The *limit* parameter must be an integer whose value is the maximum
+        number of directories to return.  Raises sqlite3.Error on error.
+        """
+        self.flush()
+        cur = self.con.cursor()
+        # rtrim() removes the trailing characters that are not os.sep, which
+        # leaves the directory of the path
+        cur.execute("""
+            SELECT dir_path, SUM(size) AS total_size FROM (
+                SELECT rtrim(path, replace(path, :sep, '')) AS dir_path, size
+                FROM files
+            )
+            GROUP BY dir_path
+            ORDER BY total_size %s
+            LIMIT :limit
+        """ % ("ASC" if ascending else "DESC"), {"sep": os.sep, "limit": limit})
+        return cur
 
-UnitEntry = collections.namedtuple("UnitEntry", "size, name")
+    def directories(self):
+        """
+        Returns an iterator over the directories recorded by --incremental.
+        Yields (id, path, mtime_ns, inode, subdirs) tuples where *subdirs* is
+        a list of the names of the directory's subdirectories.
+        Raises sqlite3.Error on error.
+        """
+        cur = self.con.cursor()
+        cur.execute("SELECT id, path, mtime_ns, inode, subdirs FROM directories")
+        for (dir_id, path, mtime_ns, inode, subdirs) in cur:
+            subdir_names = subdirs.split("/") if subdirs else []
+            yield (dir_id, path, mtime_ns, inode, subdir_names)
 
-# Tables created from http://en.wikipedia.org/wiki/Template:Quantities_of_bytes
+    def directory_files(self, dir_id):
+        """
+        Returns an iterator over the (path, size) tuples of the files recorded
+        in the directory with the given id.  Raises sqlite3.Error on error.
+        """
+        cur = self.con.cursor()
+        cur.execute("SELECT path, size FROM files WHERE dir_id = ?", (dir_id,))
+        return cur
 
-UNIT_TABLE_SI_DECIMAL = (
-    UnitEntry(10 ** 24, "YB"),
-    UnitEntry(10 ** 21, "ZB"),
-    UnitEntry(10 ** 18, "EB"),
-    UnitEntry(10 ** 15, "PB"),
-    UnitEntry(10 ** 12, "TB"),
-    UnitEntry(10 ** 9, "GB"),
-    UnitEntry(10 ** 6, "MB"),
-    UnitEntry(10 ** 3, "kB"),
-)
+    def max_generation(self):
+        """
+        Returns the greatest generation number of the recorded directories, or
+        0 if there are none.
+        """
+        cur = self.con.cursor()
+        cur.execute("SELECT MAX(generation) FROM directories")
+        (generation,) = cur.fetchone()
+        return generation if generation is not None else 0
 
-UNIT_TABLE_IEC_BINARY = (
-    UnitEntry(2 ** 80, "YiB"),
-    UnitEntry(2 ** 70, "ZiB"),
-    UnitEntry(2 ** 60, "EiB"),
-    UnitEntry(2 ** 50, "PiB"),
-    UnitEntry(2 ** 40, "TiB"),
-    UnitEntry(2 ** 30, "GiB"),
-    UnitEntry(2 ** 20, "MiB"),
-    UnitEntry(2 ** 10, "KiB"),
-)
+    def replace_directory(self, path, mtime_ns, inode, subdir_names,
+            generation):
+        """
+        Records a directory, replacing any existing record for it along with
+        the files that were recorded in it.
+        Returns the id of the new row in the "directories" table.
+        """
+        cur = self.con.cursor()
+        cur.execute("""
+            DELETE FROM files WHERE dir_id IN
+            (SELECT id FROM directories WHERE path = ?)
+        """, (path,))
+        cur.execute("""
+            INSERT OR REPLACE INTO directories
+            (path, mtime_ns, inode, subdirs, generation)
+            VALUES (?, ?, ?, ?, ?)
+        """, (path, mtime_ns, inode, "/".join(subdir_names), generation))
+        return cur.lastrowid
 
-def format_file_size(size, table):
-    """
-    Converts a size to a human-readable string.
-    The *size* parameter must be an integer to convert.
-    The *table* parameter must be a tuple; TABLE_SI_DECIMAL and TABLE_IEC_BINARY
-    are two examples of tables.
-    Returns a string whose value is the given size converted to a string that
-    is more human readable, such as 1.25kB instead of 125000.
-    """
-    unit = None
-    for unit in table:
-        if size > unit.size:
-            break
+    def touch_directory(self, dir_id, generation):
+        """
+        Sets the generation of the directory with the given id, marking it as
+        visited during the scan with that generation.
+        """
+        self.con.execute("UPDATE directories SET generation = ? WHERE id = ?",
+            (generation, dir_id))
+
+    def delete_stale_directories(self, generation):
+        """
+        Deletes the directories, and their files, that were not visited during
+        the scan with the given generation.
+        """
+        self.flush()
+        cur = self.con.cursor()
+        cur.execute("""
+            DELETE FROM files WHERE dir_id IN
+            (SELECT id FROM directories WHERE generation < ?)
+        """, (generation,))
+        cur.execute("DELETE FROM directories WHERE generation < ?",
+            (generation,))
 
-    value = float(size) / float(unit.size)
-    return "{size:.2f}{name}".format(size=value, name=unit.name)
+    def delete_loose_files(self):
+        """
+        Deletes the files that do not belong to a recorded directory.
+        """
+        self.flush()
+        self.con.execute("DELETE FROM files WHERE dir_id IS NULL")
 
 ################################################################################
 
-def print_results(search, format_size_units, no_padding, reverse_order):
+CachedFileStat = collections.namedtuple("CachedFileStat", "st_size")
+"""
+A stand-in for os.stat_result for files whose size was loaded from an
+IncrementalSnapshot instead of being stat'ed.
+"""
+
+DirectorySnapshot = collections.namedtuple("DirectorySnapshot",
+    "id, mtime_ns, inode, subdirs")
+
+class IncrementalSnapshot(object):
     """
-    Prints search results to standard output.
-    *search* must be an instance of BigFilesSearchEngine whose results to print.
-    *format_size_units* is the unit table used to format sizes for output; if
-    None then the integer sizes will be printed without formatting; the
-    predefined units are UNIT_TABLE_SI_DECIMAL and UNIT_TABLE_IEC_BINARY.
-    If *no_padding* evaluates to True, then the left padding of the sizes is
-    not done.
+    The state of a previous scan, stored in a Database, used to skip the
+    directories that have not changed since then.
+    A directory is considered unchanged if its inode and modification time are
+    the same as when it was recorded.  Note that modifying a file in place does
+    not change the modification time of its directory, so the recorded size of
+    such a file is reused until an entry of its directory is added, removed or
+    renamed.
+    """
+
+    RACY_MTIME_NS = 2 * 10 ** 9
+    """
+    Directories modified less than this many nanoseconds before the scan
+    started are always scanned again in the next run, since they may still be
+    modified within the granularity of the filesystem's timestamps.
+    """
+
+    def __init__(self, db):
+        """
+        Initializes a new instance of IncrementalSnapshot.
+        The *db* parameter must be the Database in which the snapshot is
+        stored; begin() must be invoked after it is initialized.
+        """
+        self.db = db
+        self.generation = None
+        self.directories = None
+        self.start_time_ns = None
+
+    def begin(self):
+        """
+        Loads the recorded directories and starts a new scan.
+        Raises sqlite3.Error on error.
+        """
+        self.generation = self.db.max_generation() + 1
+        self.start_time_ns = time.time_ns()
+        self.directories = {}
+        for (dir_id, path, mtime_ns, inode, subdir_names) in \
+                self.db.directories():
+            subdirs = [os.path.join(path, name) for name in subdir_names]
+            self.directories[path] = DirectorySnapshot(dir_id, mtime_ns, inode,
+                subdirs)
+        self.db.delete_loose_files()
+
+    def finish(self):
+        """
+        Finishes the scan, deleting the directories that were not visited.
+        Raises sqlite3.Error on error.
+        """
+        self.db.delete_stale_directories(self.generation)
+
+    def unchanged_subdirs(self, path, stat):
+        """
+        Returns the paths of the subdirectories of the given directory if it is
+        unchanged since it was recorded, or None if it must be scanned again.
+        The *stat* parameter must be the os.stat_result of the directory.
+        This method only reads the state loaded by begin() and may be invoked
+        from a worker thread of DirectoryWalker.
+        """
+        snapshot = self.directories.get(path)
+        if snapshot is None or snapshot.mtime_ns != stat.st_mtime_ns or \
+                snapshot.inode != stat.st_ino:
+            return None
+        return snapshot.subdirs
+
+    def reuse_directory(self, path):
+        """
+        Marks an unchanged directory as visited.
+        Returns an iterator over the (path, CachedFileStat) tuples of the files
+        recorded in it.  Raises sqlite3.Error on error.
+        """
+        snapshot = self.directories[path]
+        self.db.touch_directory(snapshot.id, self.generation)
+        for (file_path, size) in self.db.directory_files(snapshot.id):
+            yield (file_path, CachedFileStat(size))
+
+    def record_directory(self, scanned):
+        """
+        Records a directory that was scanned, and the files in it.
+        The *scanned* parameter must be a ScannedDirectory.
+        If the directory could not be listed then it is not recorded; if the
+        sizes of some of its files could not be determined, or it was modified
+        too recently, then it is recorded such that it will be scanned again
+        in the next run.  Raises sqlite3.Error on error.
+        """
+        if scanned.error is not None or scanned.stat is None:
+            return
+
+        mtime_ns = scanned.stat.st_mtime_ns
+        if scanned.errors or \
+                mtime_ns > self.start_time_ns - self.RACY_MTIME_NS:
+            mtime_ns = -1
+
+        subdir_names = [os.path.basename(x) for x in scanned.subdirs]
+        dir_id = self.db.replace_directory(scanned.path, mtime_ns,
+            scanned.stat.st_ino, subdir_names, self.generation)
+        for (file_path, stat) in scanned.files:
+            self.db.add_file(file_path, stat.st_size, dir_id)
+
+    def record_loose_file(self, path, size):
+        """
+        Records a file that was specified directly rather than found in a
+        directory.  Raises sqlite3.Error on error.
+        """
+        self.db.add_file(path, size)
+
+################################################################################
+
+class SnapshotDiff(object):
+    """
+    Compares two databases saved with --save.
+    Each comparison is a single SQL query that walks one snapshot in order of
+    size and probes the other by its unique path index, or that aggregates the
+    directories in SQLite's own temporary storage, so neither snapshot is
+    loaded into memory.
+    """
+
+    def __init__(self, old_db, new_db):
+        """
+        Initializes a new instance of SnapshotDiff.
+        The *old_db* and *new_db* parameters must be the initialized Database
+        objects of the older and newer snapshots, respectively; the older one
+        is attached to the connection of the newer one.  Neither is modified;
+        both should be opened read-only.
+        Raises sqlite3.Error on error.
+        """
+        self.old_db = old_db
+        self.new_db = new_db
+        self.con = new_db.con
+        self.con.execute("ATTACH DATABASE ? AS old", (old_db.uri,))
+        self.directories_created = False
+
+    def added_files(self, limit):
+        """
+        Returns an iterator over the (path, size) tuples of the largest files
+        in the newer snapshot that are not in the older one.
+        """
+        return self.con.execute("""
+            SELECT n.path, n.size FROM main.files AS n
+            WHERE NOT EXISTS (SELECT 1 FROM old.files AS o WHERE o.path = n.path)
+            ORDER BY n.size DESC
+            LIMIT ?
+        """, (limit,))
+
+    def removed_files(self, limit):
+        """
+        Returns an iterator over the (path, size) tuples of the largest files
+        in the older snapshot that are not in the newer one.
+        """
+        return self.con.execute("""
+            SELECT o.path, o.size FROM old.files AS o
+            WHERE NOT EXISTS (SELECT 1 FROM main.files AS n WHERE n.path = o.path)
+            ORDER BY o.size DESC
+            LIMIT ?
+        """, (limit,))
+
+    def grown_files(self, limit):
+        """
+        Returns an iterator over the (path, growth) tuples of the files in both
+        snapshots whose size increased the most.
+        """
+        return self.con.execute("""
+            SELECT n.path, n.size - o.size AS growth
+            FROM main.files AS n JOIN old.files AS o ON o.path = n.path
+            WHERE n.size > o.size
+            ORDER BY growth DESC
+            LIMIT ?
+        """, (limit,))
+
+    def create_directories(self):
+        """
+        Creates the temporary "directory_diff" table, with the total size and
+        number of files directly in each directory in each snapshot, if it has
+        not already been created.
+        """
+        if self.directories_created:
+            return
+
+        # rtrim() removes the trailing characters that are not os.sep, which
+        # leaves the directory of the path; see Database.top_directories()
+        self.con.execute("""
+            CREATE TEMP TABLE directory_diff AS
+            SELECT dir_path,
+                SUM(new_size) AS new_size, SUM(old_size) AS old_size,
+                SUM(new_count) AS new_count, SUM(old_count) AS old_count
+            FROM (
+                SELECT rtrim(path, replace(path, :sep, '')) AS dir_path,
+                    size AS new_size, 0 AS old_size,
+                    1 AS new_count, 0 AS old_count
+                FROM main.files
+                UNION ALL
+                SELECT rtrim(path, replace(path, :sep, '')) AS dir_path,
+                    0 AS new_size, size AS old_size,
+                    0 AS new_count, 1 AS old_count
+                FROM old.files
+            )
+            GROUP BY dir_path
+        """, {"sep": os.sep})
+        self.directories_created = True
+
+    def query_directories(self, sql, limit):
+        self.create_directories()
+        cur = self.con.execute(sql, (limit,))
+        for (dir_path, size) in cur:
+            yield (DatabaseSizeProducer.normalize_dir_path(dir_path), size)
+
+    def added_directories(self, limit):
+        """
+        Returns an iterator over the (path, size) tuples of the directories
+        with the largest total size of files that have files in the newer
+        snapshot but not in the older one.
+        """
+        return self.query_directories("""
+            SELECT dir_path, new_size FROM temp.directory_diff
+            WHERE old_count = 0
+            ORDER BY new_size DESC
+            LIMIT ?
+        """, limit)
+
+    def removed_directories(self, limit):
+        """
+        Returns an iterator over the (path, size) tuples of the directories
+        with the largest total size of files that have files in the older
+        snapshot but not in the newer one.
+        """
+        return self.query_directories("""
+            SELECT dir_path, old_size FROM temp.directory_diff
+            WHERE new_count = 0
+            ORDER BY old_size DESC
+            LIMIT ?
+        """, limit)
+
+    def grown_directories(self, limit):
+        """
+        Returns an iterator over the (path, growth) tuples of the directories
+        with files in both snapshots whose total size of files directly in
+        them increased the most.
+        """
+        return self.query_directories("""
+            SELECT dir_path, new_size - old_size AS growth
+            FROM temp.directory_diff
+            WHERE new_count > 0 AND old_count > 0 AND new_size > old_size
+            ORDER BY growth DESC
+            LIMIT ?
+        """, limit)
+
+################################################################################
+
+UnitEntry = collections.namedtuple("UnitEntry", "size, name")
+
+# Tables created from http://en.wikipedia.org/wiki/Template:Quantities_of_bytes
+
+UNIT_TABLE_SI_DECIMAL = (
+    UnitEntry(10 ** 24, "YB"),
+    UnitEntry(10 ** 21, "ZB"),
+    UnitEntry(10 ** 18, "EB"),
+    UnitEntry(10 ** 15, "PB"),
+    UnitEntry(10 ** 12, "TB"),
+    UnitEntry(10 ** 9, "GB"),
+    UnitEntry(10 ** 6, "MB"),
+    UnitEntry(10 ** 3, "kB"),
+)
+
+UNIT_TABLE_IEC_BINARY = (
+    UnitEntry(2 ** 80, "YiB"),
+    UnitEntry(2 ** 70, "ZiB"),
+    UnitEntry(2 ** 60, "EiB"),
+    UnitEntry(2 ** 50, "PiB"),
+    UnitEntry(2 ** 40, "TiB"),
+    UnitEntry(2 ** 30, "GiB"),
+    UnitEntry(2 ** 20, "MiB"),
+    UnitEntry(2 ** 10, "KiB"),
+)
+
+def format_file_size(size, table):
+    """
+    Converts a size to a human-readable string.
+    The *size* parameter must be an integer to convert.
+    The *table* parameter must be a tuple; TABLE_SI_DECIMAL and TABLE_IEC_BINARY
+    are two examples of tables.
+    Returns a string whose value is the given size converted to a string that
+    is more human readable, such as 1.25kB instead of 125000.
+    """
+    try:
+        lookup = FORMAT_FILE_SIZE_LOOKUPS[table]
+    except KeyError:
+        lookup = FORMAT_FILE_SIZE_LOOKUPS[table] = create_unit_lookup(table)
+
+    if size > 0:
+        (candidates, unit) = lookup[min(size.bit_length(), len(lookup) - 1)]
+    else:
+        (candidates, unit) = lookup[0]
+    for candidate in candidates:
+        if size > candidate.size:
+            unit = candidate
+            break
+
+    return "%.2f%s" % (size / unit.size, unit.name)
+
+def create_unit_lookup(table):
+    """
+    Creates the lookup table with which format_file_size() selects a unit
+    without scanning a unit table from the largest unit on every call.
+    The *table* parameter must be a unit table, such as UNIT_TABLE_SI_DECIMAL.
+    Returns a list indexed by the bit length of a size, up to that of the
+    largest unit plus one.  Each element is a tuple (candidates, fallback):
+    *candidates* are the units, largest first, whose sizes have that bit
+    length, and so must still be compared to the size, and *fallback* is the
+    unit to use if none of them is smaller than the size; it is the largest
+    unit smaller than every size with that bit length or, as before, the
+    smallest unit of the table if there is no such unit.
+    """
+    max_bit_length = max(unit.size.bit_length() for unit in table) + 1
+    lookup = []
+    for bit_length in range(max_bit_length + 1):
+        min_size = (1 << (bit_length - 1)) if bit_length > 0 else 0
+        candidates = tuple(unit for unit in table
+            if unit.size.bit_length() == bit_length)
+        for fallback in table:
+            if fallback.size < min_size:
+                break
+        else:
+            fallback = table[-1]
+        lookup.append((candidates, fallback))
+    return lookup
+
+FORMAT_FILE_SIZE_LOOKUPS = {}
+"""
+The lookup tables created by create_unit_lookup(), keyed by unit table.
+"""
+
+################################################################################
+
+class ResultWriter(object):
+    """
+    Writes (size, path) search results to a stream in some output format.
+    Rows are buffered and written to the stream in batches, which is much
+    faster than printing each one; close() must be invoked to write the last
+    batch.
+    This class writes nothing itself; subclasses implement format_row() and,
+    if needed, write_header() and write_footer().
+    """
+
+    BUFFER_SIZE = 1000
+    """
+    The number of rows to buffer before writing them to the stream.
+    """
+
+    def __init__(self, stream, format_size_units):
+        """
+        Initializes a new instance of ResultWriter.
+        The *stream* parameter must be the text stream to which to write.
+        *format_size_units* is the unit table used to format sizes for output;
+        if None then the sizes are not formatted.
+        """
+        self.stream = stream
+        self.format_size_units = format_size_units
+        self.buffer = []
+        self.header_written = False
+
+    def format_size(self, size):
+        """
+        Returns the given size formatted with the unit table given to __init__,
+        or None if sizes are not formatted.
+        """
+        if self.format_size_units is None:
+            return None
+        return format_file_size(size, self.format_size_units)
+
+    def write(self, size, path):
+        """
+        Writes a result.
+        """
+        self.write_row(size, self.format_size(size), path)
+
+    def write_row(self, size, size_str, path):
+        """
+        Writes a result whose size was already formatted by format_size().
+        """
+        if not self.header_written:
+            self.header_written = True
+            self.write_header()
+        self.buffer.append(self.format_row(size, size_str, path))
+        if len(self.buffer) >= self.BUFFER_SIZE:
+            self.flush()
+
+    def format_row(self, size, size_str, path):
+        """
+        Returns the given result formatted as it is to be written by
+        write_rows().
+        """
+        raise NotImplementedError()
+
+    def write_header(self):
+        """
+        Writes whatever precedes the first result; does nothing by default.
+        """
+        pass
+
+    def write_footer(self):
+        """
+        Writes whatever follows the last result; does nothing by default.
+        """
+        pass
+
+    def write_rows(self, rows):
+        """
+        Writes rows returned by format_row() to the stream.  By default the rows
+        must be strings, which are concatenated.
+        """
+        self.stream.write("".join(rows))
+
+    def flush(self):
+        """
+        Writes the buffered rows to the stream, and flushes the stream.
+        """
+        if self.buffer:
+            self.write_rows(self.buffer)
+            self.buffer = []
+        self.stream.flush()
+
+    def close(self):
+        """
+        Writes the buffered rows and the footer, and flushes the stream.  The
+        stream itself is not closed.
+        """
+        if not self.header_written:
+            self.header_written = True
+            self.write_header()
+        self.flush()
+        self.write_footer()
+        self.stream.flush()
+
+class TextResultWriter(ResultWriter):
+    """
+    Writes results as lines of the size, left-padded to a fixed width, followed
+    by the path.
+    """
+
+    def __init__(self, stream, format_size_units, width=0):
+        """
+        Initializes a new instance of TextResultWriter.
+        The *width* parameter is the minimum width to which sizes are padded;
+        all other parameters are the same as those of ResultWriter.
+        """
+        ResultWriter.__init__(self, stream, format_size_units)
+        self.width = width
+
+    def format_size(self, size):
+        if self.format_size_units is None:
+            return str(size)
+        return format_file_size(size, self.format_size_units)
+
+    def format_row(self, size, size_str, path):
+        return "%*s %s\n" % (self.width, size_str, path)
+
+class NdjsonResultWriter(ResultWriter):
+    """
+    Writes results as JSON objects, one per line.  Each object has the integer
+    "size" and the "path" of a result and, if sizes are formatted, its
+    "formatted_size".
+    """
+
+    def format_row(self, size, size_str, path):
+        return json.dumps(self.to_json_dict(size, size_str, path)) + "\n"
+
+    @staticmethod
+    def to_json_dict(size, size_str, path):
+        """
+        Returns the dict to encode as the JSON object of a result.
+        """
+        result = {"size": size, "path": path}
+        if size_str is not None:
+            result["formatted_size"] = size_str
+        return result
+
+class JsonResultWriter(NdjsonResultWriter):
+    """
+    Writes results as a single JSON array of the objects written by
+    NdjsonResultWriter, one per line.
+    """
+
+    def __init__(self, *args, **kwargs):
+        NdjsonResultWriter.__init__(self, *args, **kwargs)
+        self.separator = "\n"
+
+    def format_row(self, size, size_str, path):
+        row = self.separator + json.dumps(self.to_json_dict(size, size_str,
+            path))
+        self.separator = ",\n"
+        return row
+
+    def write_header(self):
+        self.stream.write("[")
+
+    def write_footer(self):
+        self.stream.write("\n]\n")
+
+class CsvResultWriter(ResultWriter):
+    """
+    Writes results as CSV, with a header row, in the columns "size" and "path"
+    and, if sizes are formatted, "formatted_size".
+    """
+
+    def __init__(self, *args, **kwargs):
+        ResultWriter.__init__(self, *args, **kwargs)
+        self.csv_writer = csv.writer(self.stream, lineterminator="\n")
+
+    def format_row(self, size, size_str, path):
+        if size_str is None:
+            return (size, path)
+        return (size, path, size_str)
+
+    def write_header(self):
+        if self.format_size_units is None:
+            self.csv_writer.writerow(("size", "path"))
+        else:
+            self.csv_writer.writerow(("size", "path", "formatted_size"))
+
+    def write_rows(self, rows):
+        self.csv_writer.writerows(rows)
+
+RESULT_WRITER_TYPES = {
+    "text": TextResultWriter,
+    "ndjson": NdjsonResultWriter,
+    "json": JsonResultWriter,
+    "csv": CsvResultWriter,
+}
+"""
+The ResultWriter subclasses, keyed by the values of --output-format.
+"""
+
+class StreamingSearchEngine(object):
+    """
+    A search engine that does not search at all: it writes every file added to
+    it to a ResultWriter immediately, in the order in which they are found.
+    The writer is flushed after every file, since the files may be found
+    slowly; the time to write them is small next to the time to find them.
+    """
+
+    def __init__(self, writer):
+        """
+        Initializes a new instance of StreamingSearchEngine.
+        The *writer* parameter must be the ResultWriter to which to write the
+        files.
+        """
+        self.writer = writer
+
+    def add_file(self, path, size):
+        self.writer.write(size, path)
+        self.writer.flush()
+
+################################################################################
+
+def print_results(search, format_size_units, no_padding, reverse_order,
+        output_format="text"):
+    """
+    Prints search results to standard output.
+    *search* must be an instance of BigFilesSearchEngine whose results to print.
+    *format_size_units* is the unit table used to format sizes for output; if
+    None then the integer sizes will be printed without formatting; the
+    predefined units are UNIT_TABLE_SI_DECIMAL and UNIT_TABLE_IEC_BINARY.
+    If *no_padding* evaluates to True, then the left padding of the sizes is
+    not done.
     If *reverse* evaluates to True, then the order in which the search results
     are printed is reversed.
+    *output_format* is the key in RESULT_WRITER_TYPES of the output format.
     """
 
-    results = list(search.results())
-    if reverse_order:
-        results.reverse()
+    results = list(search.results())
+    if reverse_order:
+        results.reverse()
+    print_result_rows(results, format_size_units, no_padding, output_format)
+
+def print_result_rows(results, format_size_units, no_padding,
+        output_format="text"):
+    """
+    Prints (size, path) tuples to standard output, in the given order.
+    *results* must be a list of the (size, path) tuples to print.
+    *format_size_units*, *no_padding* and *output_format* are the same as for
+    print_results().
+    """
+    writer = RESULT_WRITER_TYPES[output_format](sys.stdout, format_size_units)
+
+    # format each size once, and use the formatted sizes to compute the padding
+    size_strs = [writer.format_size(size) for (size, path) in results]
+    if output_format == "text" and not no_padding and size_strs:
+        writer.width = max(len(x) for x in size_strs)
+
+    for (size_str, (size, path)) in zip(size_strs, results):
+        writer.write_row(size, size_str, path)
+    writer.close()
+
+def print_diff(diff, max_results, format_size_units, no_padding,
+        reverse_order):
+    """
+    Prints the differences between two snapshots to standard output.
+    *diff* must be the SnapshotDiff whose differences to print.
+    *max_results* is the maximum number of results to print in each section.
+    *format_size_units* and *no_padding* are the same as for print_results().
+    If *reverse_order* evaluates to True, then the results in each section are
+    printed in ascending order instead of descending order.
+    Raises sqlite3.Error on error.
+    """
+    sections = (
+        ("Added files", diff.added_files),
+        ("Removed files", diff.removed_files),
+        ("Grown files", diff.grown_files),
+        ("Added directories", diff.added_directories),
+        ("Removed directories", diff.removed_directories),
+        ("Grown directories", diff.grown_directories),
+    )
+
+    for (index, (title, query)) in enumerate(sections):
+        if index > 0:
+            print()
+        print(title)
+        print("=" * len(title))
+
+        results = [(size, path) for (path, size) in query(max_results)]
+        if reverse_order:
+            results.reverse()
+        print_result_rows(results, format_size_units, no_padding)
+
+def print_save_statistics(db):
+    """
+    Prints the number of rows written to a Database and the rate at which they
+    were inserted to standard error.
+    *db* must be the Database whose statistics to print.
+    """
+    if db.write_seconds > 0:
+        rate = db.num_rows_written / db.write_seconds
+    else:
+        rate = 0
+    print("Saved {rows:,d} files to {path} in {seconds:.2f}s "
+        "({rate:,.0f} rows/sec)".format(rows=db.num_rows_written, path=db.path,
+        seconds=db.write_seconds, rate=rate), file=sys.stderr)
+
+################################################################################
+
+def file_size(path):
+    """
+    Returns the size of a file.
+    The "path" parameter must be a string whose value is the path of the file
+    whose size to return.
+    Raises OSError if the size of the file with the given path cannot be
+    determined, such as if the path does not exist, is a directory, or
+    permission is denied.
+    """
+    stat_info = os.stat(path)
+    size = stat_info.st_size
+    return size
+
+################################################################################
+
+class SizeAccounting(object):
+    """
+    Determines the size that a file contributes to the search results from its
+    os.stat_result.
+    """
+
+    def __init__(self, allocated=False, dedup_hardlinks=False):
+        """
+        Initializes a new instance of SizeAccounting.
+        If the *allocated* parameter is True then the size of a file is the
+        number of bytes allocated for it on disk (st_blocks), which is smaller
+        than its apparent size (st_size) for sparse files; otherwise, the
+        apparent size is used.
+        If the *dedup_hardlinks* parameter is True then a file with multiple
+        hard links is only counted the first time that one of its links is
+        seen.
+        """
+        self.allocated = allocated
+        self.dedup_hardlinks = dedup_hardlinks
+
+        # the (st_dev, st_ino) of each file with multiple hard links that has
+        # been seen, combined into a single int to use less memory than a
+        # tuple; files with only one link are never seen again, so they are
+        # not added
+        self.seen_inodes = set()
+
+    def size_of(self, stat):
+        """
+        Returns the size of a file.
+        The *stat* parameter must be the os.stat_result of the file.
+        Returns an integer whose value is the size of the file, or None if it
+        is a hard link to a file that was already counted.
+        """
+        if self.dedup_hardlinks and stat.st_nlink > 1:
+            key = (stat.st_dev << 64) | stat.st_ino
+            if key in self.seen_inodes:
+                return None
+            self.seen_inodes.add(key)
+
+        if self.allocated:
+            try:
+                return stat.st_blocks * 512
+            except AttributeError:
+                # st_blocks is not available on all platforms, such as Windows
+                pass
+
+        return stat.st_size
+
+################################################################################
+
+class GlobMatcher(object):
+    """
+    Matches names and paths against a list of wildcard patterns, like those of
+    fnmatch, with a single precompiled regular expression so that the cost of
+    a match does not grow with the number of patterns.
+    Patterns that contain a path separator are matched against the whole path
+    and all other patterns are matched against the name alone.
+    """
+
+    def __init__(self, patterns):
+        """
+        Initializes a new instance of GlobMatcher.
+        The *patterns* parameter must be an iterable of strings whose values
+        are the wildcard patterns to match.
+        """
+        name_patterns = []
+        path_patterns = []
+        for pattern in patterns:
+            pattern = os.path.normcase(pattern)
+            if os.sep in pattern or (os.altsep and os.altsep in pattern):
+                path_patterns.append(pattern)
+            else:
+                name_patterns.append(pattern)
+
+        self.name_regex = self.compile(name_patterns)
+        self.path_regex = self.compile(path_patterns)
+
+    @staticmethod
+    def compile(patterns):
+        """
+        Returns a compiled regular expression that matches any of the given
+        wildcard patterns, or None if there are none.
+        """
+        if not patterns:
+            return None
+        regex = "|".join(fnmatch.translate(x) for x in patterns)
+        return re.compile(regex)
+
+    def matches(self, path, name):
+        """
+        Returns True if any pattern matches the given path or its name, which
+        must be the last component of the path; otherwise, returns False.
+        """
+        if self.name_regex is not None and \
+                self.name_regex.match(os.path.normcase(name)) is not None:
+            return True
+        if self.path_regex is not None and \
+                self.path_regex.match(os.path.normcase(path)) is not None:
+            return True
+        return False
+
+class ScanFilter(object):
+    """
+    Decides which files are searched and which directories are descended into.
+    DirectoryWalker applies the filters as it scans each directory, so that
+    excluded subtrees are never listed and excluded files are rejected before
+    reaching a search engine; files excluded by name are not even stat'ed.
+    """
+
+    def __init__(self, include=(), exclude=(), min_size=None, max_size=None,
+            min_mtime=None, max_mtime=None, one_file_system=False):
+        """
+        Initializes a new instance of ScanFilter.
+        The *include* parameter must be an iterable of wildcard patterns; if
+        not empty then only the files matching at least one of them are
+        searched.  The *exclude* parameter must be an iterable of wildcard
+        patterns of the files and directories to exclude.  See GlobMatcher
+        for how the patterns are matched.
+        The *min_size* and *max_size* parameters are the inclusive bounds of
+        the apparent sizes of files to search, and *min_mtime* and *max_mtime*
+        are the inclusive bounds of their modification times, in seconds since
+        the epoch; any of them may be None for no bound.
+        If *one_file_system* is True then directories on a different file
+        system than their parent are not descended into.
+        """
+        include = list(include)
+        self.include_matcher = GlobMatcher(include) if include else None
+        exclude = list(exclude)
+        self.exclude_matcher = GlobMatcher(exclude) if exclude else None
+        self.min_size = min_size
+        self.max_size = max_size
+        self.min_mtime = min_mtime
+        self.max_mtime = max_mtime
+        self.one_file_system = one_file_system
+
+    def is_empty(self):
+        """
+        Returns True if this filter accepts everything, in which case it need
+        not be applied at all.
+        """
+        return (self.include_matcher is None and self.exclude_matcher is None
+            and self.min_size is None and self.max_size is None
+            and self.min_mtime is None and self.max_mtime is None
+            and not self.one_file_system)
+
+    def accepts_directory(self, entry, parent_stat):
+        """
+        Returns whether to descend into a subdirectory.
+        The *entry* parameter must be the os.DirEntry of the subdirectory and
+        *parent_stat* must be the os.stat_result of its parent directory, or
+        None if it is not known.
+        Raises OSError if the subdirectory must be stat'ed and that fails.
+        """
+        if self.exclude_matcher is not None and \
+                self.exclude_matcher.matches(entry.path, entry.name):
+            return False
+        if self.one_file_system and parent_stat is not None and \
+                entry.stat(follow_symlinks=False).st_dev != parent_stat.st_dev:
+            return False
+        return True
+
+    def accepts_name(self, path, name):
+        """
+        Returns whether to search a file, based only on its path and name.
+        """
+        if self.exclude_matcher is not None and \
+                self.exclude_matcher.matches(path, name):
+            return False
+        if self.include_matcher is not None and \
+                not self.include_matcher.matches(path, name):
+            return False
+        return True
+
+    def accepts_stat(self, stat):
+        """
+        Returns whether to search a file, based on its os.stat_result.
+        """
+        if self.min_size is not None and stat.st_size < self.min_size:
+            return False
+        if self.max_size is not None and stat.st_size > self.max_size:
+            return False
+        if self.min_mtime is not None and stat.st_mtime < self.min_mtime:
+            return False
+        if self.max_mtime is not None and stat.st_mtime > self.max_mtime:
+            return False
+        return True
+
+################################################################################
+
+ScannedDirectory = collections.namedtuple("ScannedDirectory",
+    "path, stat, files, subdirs, errors, error")
+"""
+The result of scanning a single directory with DirectoryWalker.
+*path* is the path of the directory and *stat* is its os.stat_result, or None
+if it could not be determined.
+*files* is a list of (path, stat_result) tuples for the non-directory entries.
+*subdirs* is a list of the paths of the subdirectories to be walked.
+*errors* is a list of (path, OSError) tuples for entries whose size could not
+be determined and *error* is an error message if the directory could not be
+listed at all, or None otherwise.
+*files* is None if the directory was not listed because it is unchanged since
+it was recorded in the IncrementalSnapshot given to DirectoryWalker.
+"""
+
+class DirectoryWalker(object):
+    """
+    Walks directory trees using os.scandir(), reusing the information from each
+    DirEntry so that each file is stat'ed exactly once.
+    Multiple directories may be scanned concurrently in a pool of threads.
+    """
+
+    def __init__(self, num_jobs=1, snapshot=None, scan_filter=None):
+        """
+        Initializes a new instance of DirectoryWalker.
+        The *num_jobs* parameter must be an integer whose value is the number of
+        threads with which to scan directories; if less than or equal to 1 then
+        directories are scanned in the calling thread.
+        The *snapshot* parameter may be an IncrementalSnapshot whose unchanged
+        directories are not listed, but whose recorded subdirectories are still
+        walked; may be None to list every directory.
+        The *scan_filter* parameter may be a ScanFilter with which to prune
+        subdirectories and reject files; may be None to accept everything.
+        """
+        self.num_jobs = num_jobs
+        self.snapshot = snapshot
+        if scan_filter is not None and scan_filter.is_empty():
+            scan_filter = None
+        self.scan_filter = scan_filter
+
+        self.num_pending = 0
+        """
+        The number of directories that have been discovered but not yet
+        yielded by the current walk; used for progress reporting.
+        """
+
+    def walk(self, path):
+        """
+        Walks the directory tree rooted at the given path.
+        The *path* parameter must be a string whose value is the path of the
+        directory to walk.
+        Returns an iterator that yields a ScannedDirectory for each directory
+        in the tree; when scanning concurrently the directories are yielded in
+        the order in which their scans complete.
+        Symbolic links to directories are not followed, just like os.walk().
+        """
+        if self.num_jobs <= 1:
+            return self._walk_serial(path)
+        else:
+            return self._walk_concurrent(path)
+
+    def _walk_serial(self, path):
+        pending = [path]
+        while pending:
+            scanned = self.scan_directory(pending.pop())
+            pending.extend(reversed(scanned.subdirs))
+            self.num_pending = len(pending)
+            yield scanned
+
+    def _walk_concurrent(self, path):
+        executor = concurrent.futures.ThreadPoolExecutor(self.num_jobs)
+        completed = queue.SimpleQueue()
+
+        def submit(dir_path):
+            future = executor.submit(self.scan_directory, dir_path)
+            future.add_done_callback(completed.put)
+
+        try:
+            submit(path)
+            self.num_pending = 1
+            while self.num_pending > 0:
+                scanned = completed.get().result()
+                self.num_pending -= 1
+                for subdir in scanned.subdirs:
+                    submit(subdir)
+                    self.num_pending += 1
+                yield scanned
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def scan_directory(self, path):
+        """
+        Scans the entries of a single directory.
+        The *path* parameter must be a string whose value is the path of the
+        directory to scan.
+        Returns a ScannedDirectory; errors are recorded in the returned object
+        rather than raised, since this method may be invoked in a worker
+        thread.
+        """
+        files = []
+        subdirs = []
+        errors = []
+
+        try:
+            stat = os.stat(path)
+        except OSError:
+            stat = None
+
+        if stat is not None and self.snapshot is not None:
+            unchanged_subdirs = self.snapshot.unchanged_subdirs(path, stat)
+            if unchanged_subdirs is not None:
+                return ScannedDirectory(path, stat, None, unchanged_subdirs,
+                    errors, None)
+
+        scan_filter = self.scan_filter
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir():
+                            if not entry.is_symlink() and (scan_filter is None
+                                    or scan_filter.accepts_directory(entry,
+                                    stat)):
+                                subdirs.append(entry.path)
+                            continue
+                        if scan_filter is None:
+                            files.append((entry.path, entry.stat()))
+                        elif scan_filter.accepts_name(entry.path, entry.name):
+                            entry_stat = entry.stat()
+                            if scan_filter.accepts_stat(entry_stat):
+                                files.append((entry.path, entry_stat))
+                    except OSError as e:
+                        errors.append((entry.path, e))
+        except OSError as e:
+            error = "unable to list directory: %s (%s)" % (path, e.strerror)
+        else:
+            error = None
+
+        return ScannedDirectory(path, stat, files, subdirs, errors, error)
+
+################################################################################
+
+class SizeProducerError(Exception):
+    pass
+
+################################################################################
+
+class ScanStatistics(object):
+    """
+    Collects statistics about the (name, size) pairs yielded by SizeProducer
+    objects, optionally printing a progress line to standard error
+    periodically.
+    The progress lines are printed by a background thread between start() and
+    stop(), rather than as pairs are recorded, since a SizeProducer may not
+    yield anything for a long time, such as while a cumulative directory walk
+    or a worker process is still running.
+    """
+
+    def __init__(self, invert, progress_interval=None, stream=None,
+            directories=False, cumulative=False):
+        """
+        Initializes a new instance of ScanStatistics.
+        The *invert* parameter must be the same value given to the search
+        engine, and determines whether the top size is the largest or the
+        smallest.
+        The *progress_interval* parameter must be a number whose value is the
+        number of seconds between progress lines, or None to not print them.
+        The *stream* parameter is the file to which to print progress lines;
+        if None then sys.stderr is used.
+        The *directories* and *cumulative* parameters must be the values of
+        --directories and --cumulative; the pairs are counted as directories
+        rather than files if *directories* is True, and their sizes are not
+        added up if *cumulative* is True, since the cumulative size of a
+        directory includes those of its subdirectories.
+        """
+        self.invert = invert
+        self.progress_interval = progress_interval
+        self.stream = stream if stream is not None else sys.stderr
+        self.unit_name = "directories" if directories else "files"
+        self.count_bytes = not cumulative
+
+        self.num_files = 0
+        self.num_bytes = 0
+        self.num_errors = 0
+        self.top_size = None
+        self.top_name = None
+
+        self.producer = None
+        self.start_time = time.monotonic()
+
+        self.stop_event = threading.Event()
+        self.progress_thread = None
+
+    def start(self):
+        """
+        Starts the thread that prints a progress line every progress_interval
+        seconds until stop() is invoked, if progress lines were requested.
+        """
+        if self.progress_interval is None or self.progress_thread is not None:
+            return
+        self.stop_event.clear()
+        self.progress_thread = threading.Thread(target=self.print_progress_loop,
+            name="ScanStatistics", daemon=True)
+        self.progress_thread.start()
+
+    def stop(self):
+        """
+        Stops the thread started by start(), if any, and waits for it to exit.
+        """
+        if self.progress_thread is None:
+            return
+        self.stop_event.set()
+        self.progress_thread.join()
+        self.progress_thread = None
+
+    def print_progress_loop(self):
+        while not self.stop_event.wait(self.progress_interval):
+            self.print_progress()
+
+    def record(self, name, size):
+        """
+        Records a (name, size) pair yielded from a SizeProducer.
+        """
+        self.num_files += 1
+        if self.count_bytes:
+            self.num_bytes += size
 
-    if format_size_units is not None:
-        size_formatter = lambda x: format_file_size(x, format_size_units)
-    else:
-        size_formatter = str
+        top_size = self.top_size
+        if top_size is None or (size < top_size if self.invert
+                else size > top_size):
+            self.top_size = size
+            self.top_name = name
 
-    if no_padding or len(results) == 0:
-        max_size_str_len = 0
-    else:
-        max_size_str_len = max(len(size_formatter(x[0])) for x in results)
+    def record_errors(self, num_errors=1):
+        """
+        Records errors that were not given to the "on_error" function of a
+        SizeProducer, such as those ignored by a walker or a worker process.
+        """
+        self.num_errors += num_errors
 
-    output_template = "{size:>" + str(max_size_str_len) + "} {path}"
+    def counting_errors(self, on_error):
+        """
+        Returns a function that counts an error and then invokes the given
+        "on_error" function of a SizeProducer.
+        """
+        def counting_on_error(message):
+            self.num_errors += 1
+            return on_error(message)
+        return counting_on_error
 
-    for (size, path) in results:
-        size_str = size_formatter(size)
-        formatted_line = output_template.format(size=size_str, path=path)
-        print(formatted_line)
+    def elapsed_seconds(self):
+        return time.monotonic() - self.start_time
 
-################################################################################
+    def progress_line(self):
+        """
+        Returns a string whose value is a line describing the current progress.
+        """
+        elapsed_seconds = self.elapsed_seconds()
+        files_per_second = self.num_files / elapsed_seconds \
+            if elapsed_seconds > 0 else 0
+        if self.producer is not None:
+            num_pending = self.producer.num_pending_directories()
+        else:
+            num_pending = 0
+        if self.top_size is not None:
+            top = format_file_size(self.top_size, UNIT_TABLE_SI_DECIMAL)
+        else:
+            top = "-"
 
-def file_size(path):
-    """
-    Returns the size of a file.
-    The "path" parameter must be a string whose value is the path of the file
-    whose size to return.
-    Raises OSError if the size of the file with the given path cannot be
-    determined, such as if the path does not exist, is a directory, or
-    permission is denied.
-    """
-    stat_info = os.stat(path)
-    size = stat_info.st_size
-    return size
+        if self.count_bytes:
+            bytes_seen = "%s seen, " % format_file_size(self.num_bytes,
+                UNIT_TABLE_SI_DECIMAL)
+        else:
+            bytes_seen = ""
 
-################################################################################
+        return ("{files:,d} {unit} ({rate:,.0f}/s), {bytes_seen}" +
+            "{pending:,d} directories pending, {errors:,d} errors, " +
+            "top {top}").format(files=self.num_files, unit=self.unit_name,
+            rate=files_per_second, bytes_seen=bytes_seen, pending=num_pending,
+            errors=self.num_errors, top=top)
 
-class SizeProducerError(Exception):
-    pass
+    def print_progress(self):
+        """
+        Prints a progress line to self.stream.
+        """
+        print(self.progress_line(), file=self.stream)
+        self.stream.flush()
+
+    def to_json_dict(self):
+        """
+        Returns a dict of the collected statistics suitable for json.dump().
+        """
+        elapsed_seconds = self.elapsed_seconds()
+        return {
+            self.unit_name: self.num_files,
+            "bytes": self.num_bytes if self.count_bytes else None,
+            "errors": self.num_errors,
+            "elapsed_seconds": elapsed_seconds,
+            self.unit_name + "_per_second": (self.num_files / elapsed_seconds
+                if elapsed_seconds > 0 else 0),
+            "top_size": self.top_size,
+            "top_path": self.top_name,
+        }
 
 ################################################################################
 
@@ -513,7 +2237,7 @@ class SizeProducer:
     size_from_value() methods.
     """
 
-    def __init__(self, on_error):
+    def __init__(self, on_error, statistics=None):
         """
         Initializes a new SizeProducer object.
         The "on_error" parameter must be a function that will be called when
@@ -523,14 +2247,24 @@ class SizeProducer:
         to indicate that the error should cease iteration, or it may simply
         return, in which case the error should be ignored and progress should
         continue. 
+        The "statistics" parameter may be a ScanStatistics in which to record
+        each yielded pair and each error; may be None to not record them.
         """
 
+        if statistics is not None:
+            on_error = statistics.counting_errors(on_error)
+
         self.on_error = on_error
         """
         The function to be called when an error occurs in a subclass; set to the
         "on_error" parameter given to __init__().
         """
 
+        self.statistics = statistics
+        """
+        The ScanStatistics given to __init__(), or None.
+        """
+
     def __iter__(self):
         """
         Returns an iterator that yield (name, size) tuples.
@@ -545,16 +2279,41 @@ class SizeProducer:
         self.size_from_value().  If either of these methods return None, which
         they should if an error occurs and self.on_error() does not raise an
         exception, then the value is discarded.
-        """
-        for value in self.values():
-            name = self.name_from_value(value)
-            if name is None:
-                continue
-            size = self.size_from_value(value)
-            if size is None:
-                continue
+        If self.statistics is not None then each yielded pair is recorded in
+        it; otherwise, no additional work is done per value.
+        """
+        statistics = self.statistics
+        if statistics is None:
+            for value in self.values():
+                name = self.name_from_value(value)
+                if name is None:
+                    continue
+                size = self.size_from_value(value)
+                if size is None:
+                    continue
+
+                yield (name, size)
+        else:
+            statistics.producer = self
+            for value in self.values():
+                name = self.name_from_value(value)
+                if name is None:
+                    continue
+                size = self.size_from_value(value)
+                if size is None:
+                    continue
+
+                statistics.record(name, size)
+                yield (name, size)
 
-            yield (name, size)
+    def num_pending_directories(self):
+        """
+        Returns the number of directories that have been discovered but not
+        yet scanned, for progress reporting.
+        Subclasses that walk directories should override this method; this
+        implementation returns 0.
+        """
+        return 0
 
     def values(self):
         """
@@ -592,53 +2351,225 @@ class FileSizeProducer(SizeProducer):
     An implementation of SizeProducer that returns the sizes of files.
     """
 
-    def __init__(self, paths, *args, **kwargs):
+    def __init__(self, paths, *args, num_jobs=1, accounting=None,
+            scan_filter=None, **kwargs):
         """
         Initializes a new instance of FileSizeProducer.
         The "paths" parameter must be an iterable that returns strings whose
         values are the paths to iterate over in values().
+        The "num_jobs" parameter must be an integer whose value is the number
+        of threads with which to scan directories; see DirectoryWalker.
+        The "accounting" parameter must be the SizeAccounting with which to
+        determine the sizes of files; if None, their apparent sizes are used.
+        The "scan_filter" parameter may be a ScanFilter that decides which
+        files are searched; may be None to search all files.
         All other positional and keyword arguments are given to the __init__()
         method of the superclass. 
         """
         SizeProducer.__init__(self, *args, **kwargs)
         self.paths = paths
+        self.walker = DirectoryWalker(num_jobs, scan_filter=scan_filter)
+        self.scan_filter = self.walker.scan_filter
+        self.accounting = accounting if accounting is not None \
+            else SizeAccounting()
 
     def values(self):
         """
         Iterates over the paths in self.paths.
         If an element is a directory then that directory is walked, recursively,
-        and the path of each file is returned.  Otherwise, the path is returned.
+        and a (path, stat_result) tuple is returned for each file.  Otherwise,
+        the tuple (path, None) is returned.
+        Directories that cannot be listed are silently skipped, as os.walk()
+        does, but are counted in self.statistics; errors determining the size
+        of a file are given to self.on_error().
         """
+        statistics = self.statistics
         for path in self.paths:
             if os.path.isdir(path):
-                for (dirpath, dirnames, filenames) in os.walk(path):
-                    for filename in filenames:
-                        cur_path = os.path.join(dirpath, filename)
-                        yield cur_path
-            else:
-                yield path
+                for scanned in self.walker.walk(path):
+                    if scanned.error is not None and statistics is not None:
+                        statistics.record_errors()
+                    for (error_path, e) in scanned.errors:
+                        self.on_error("unable to determine file size: %s (%s)"
+                            % (error_path, e.strerror))
+                    yield from scanned.files
+            elif self.scan_filter is None or self.scan_filter.accepts_name(
+                    path, os.path.basename(path)):
+                yield (path, None)
+
+    def num_pending_directories(self):
+        """
+        Returns the number of directories pending in self.walker.
+        """
+        return self.walker.num_pending
 
     def name_from_value(self, value):
         """
-        Returns exactly the given "value".
+        Returns the path component of a value yielded from values().
         """
-        return value
+        return value[0]
 
-    def size_from_value(self, path):
+    def size_from_value(self, value):
         """
-        Returns the size of the file with the given path.
-        The "path" parameter must be a string whose value is the path of the
-        file whose size to return.
+        Returns the size of the file of a value yielded from values(), as
+        determined by self.accounting.
+        If the value already contains the file's stat_result then it is used
+        without accessing the filesystem again; otherwise, the file is stat'ed.
         If an error occurs then self.on_error() is invoked with a message,
         and if no exception is raised then None is returned.
-        Returns an integer whose value is the size of the file with the given
-        path.
+        Returns an integer whose value is the size of the file, or None if it
+        is a hard link to a file that was already counted.
+        """
+        (path, stat) = value
+        if stat is None:
+            try:
+                stat = os.stat(path)
+            except OSError as e:
+                self.on_error("unable to determine file size: %s (%s)" %
+                    (path, e.strerror))
+                return None
+            if self.scan_filter is not None and \
+                    not self.scan_filter.accepts_stat(stat):
+                return None
+
+        return self.accounting.size_of(stat)
+
+################################################################################
+
+class IncrementalFileSizeProducer(FileSizeProducer):
+    """
+    An implementation of FileSizeProducer that records the files it finds in an
+    IncrementalSnapshot and reuses the recorded files of the directories that
+    have not changed since the previous scan.
+    """
+
+    def __init__(self, paths, snapshot, *args, num_jobs=1, **kwargs):
+        """
+        Initializes a new instance of IncrementalFileSizeProducer.
+        The "snapshot" parameter must be the IncrementalSnapshot to use, whose
+        begin() method must be invoked before iterating over this object.
+        All other arguments are the same as those of FileSizeProducer.
+        """
+        FileSizeProducer.__init__(self, paths, *args, num_jobs=num_jobs,
+            **kwargs)
+        self.snapshot = snapshot
+        self.walker = DirectoryWalker(num_jobs, snapshot=snapshot)
+
+    def values(self):
+        """
+        Iterates over the paths in self.paths, like FileSizeProducer.values(),
+        but yields the recorded files of unchanged directories instead of
+        listing them and records the files of the directories that are listed.
+        If a database access error occurs then SizeProducerError is raised.
         """
         try:
-            return file_size(path)
-        except OSError as e:
-            self.on_error("unable to determine file size: %s (%s)" %
-                (path, e.strerror))
+            for path in self.paths:
+                if os.path.isdir(path):
+                    for scanned in self.walker.walk(path):
+                        if scanned.error is not None and \
+                                self.statistics is not None:
+                            self.statistics.record_errors()
+                        for (error_path, e) in scanned.errors:
+                            self.on_error(
+                                "unable to determine file size: %s (%s)" %
+                                (error_path, e.strerror))
+                        if scanned.files is None:
+                            yield from self.snapshot.reuse_directory(
+                                scanned.path)
+                        else:
+                            self.snapshot.record_directory(scanned)
+                            yield from scanned.files
+                else:
+                    yield (path, None)
+        except sqlite3.Error as e:
+            raise SizeProducerError("unable to update database: %s (%s)" %
+                (self.snapshot.db.path, e))
+
+    def size_from_value(self, value):
+        """
+        Returns the size of the file of a value yielded from values(), like
+        FileSizeProducer.size_from_value(), recording it in the snapshot if it
+        was specified directly rather than found in a directory.
+        """
+        size = FileSizeProducer.size_from_value(self, value)
+        if size is not None and value[1] is None:
+            try:
+                self.snapshot.record_loose_file(value[0], size)
+            except sqlite3.Error as e:
+                raise SizeProducerError("unable to update database: %s (%s)" %
+                    (self.snapshot.db.path, e))
+        return size
+
+################################################################################
+
+class DirectoryTotals(object):
+    """
+    Accumulates the shallow and cumulative sizes of the directories of a tree
+    as it is walked, in any order, by DirectoryWalker.
+    The accumulators are kept in arrays indexed by the order in which the
+    directories are discovered; since a directory is always discovered after
+    its parent, the cumulative sizes are computed bottom-up in a single
+    reverse pass over the arrays once the walk is complete.
+    """
+
+    def __init__(self):
+        self.paths = []
+        self.parents = array.array("q")
+        self.shallow_sizes = array.array("q")
+        self.listed = array.array("b")
+
+        # the indexes of discovered directories that have not been added yet
+        self.pending_indexes = {}
+
+    def discover(self, path, parent_index):
+        """
+        Allocates the accumulators of a newly-discovered directory.
+        The *parent_index* parameter must be the index of the directory's
+        parent, or -1 if it is the root of a tree.
+        """
+        self.pending_indexes[path] = len(self.paths)
+        self.paths.append(path)
+        self.parents.append(parent_index)
+        self.shallow_sizes.append(0)
+        self.listed.append(0)
+
+    def add(self, scanned, shallow_size):
+        """
+        Records the shallow size of a scanned directory and discovers its
+        subdirectories.
+        The *scanned* parameter must be a ScannedDirectory whose path was
+        given to discover() and the *shallow_size* parameter must be the sum
+        of the sizes of the files directly in it.
+        """
+        index = self.pending_indexes.pop(scanned.path)
+        self.shallow_sizes[index] = shallow_size
+        self.listed[index] = 1
+        for subdir in scanned.subdirs:
+            self.discover(subdir, index)
+
+    def cumulative_sizes(self):
+        """
+        Returns an array of the cumulative sizes of the directories; that is,
+        the shallow sizes plus the cumulative sizes of their subdirectories.
+        """
+        cumulative_sizes = array.array("q", self.shallow_sizes)
+        parents = self.parents
+        for index in range(len(cumulative_sizes) - 1, -1, -1):
+            parent_index = parents[index]
+            if parent_index >= 0:
+                cumulative_sizes[parent_index] += cumulative_sizes[index]
+        return cumulative_sizes
+
+    def __iter__(self):
+        """
+        Returns an iterator over (path, shallow_size, cumulative_size) tuples
+        of the directories that were successfully listed.
+        """
+        cumulative_sizes = self.cumulative_sizes()
+        for index in range(len(self.paths)):
+            if self.listed[index]:
+                yield (self.paths[index], self.shallow_sizes[index],
+                    cumulative_sizes[index])
 
 ################################################################################
 
@@ -648,103 +2579,153 @@ class DirSizeProducer(SizeProducer):
     in a directory.
     """
 
-    def __init__(self, paths, *args, **kwargs):
+    def __init__(self, paths, *args, num_jobs=1, cumulative=False,
+            accounting=None, scan_filter=None, **kwargs):
         """
         Initializes a new instance of DirSizeProducer.
         The "paths" parameter must be an iterable that returns strings whose
         values are the paths of the directories to iterate over in values().
+        The "num_jobs" parameter must be an integer whose value is the number
+        of threads with which to scan directories; see DirectoryWalker.
+        If the "cumulative" parameter is True then the size of each directory
+        also includes the sizes of all of its subdirectories, recursively, like
+        the "du" command; otherwise, only the files directly in the directory
+        are included.
+        The "accounting" parameter must be the SizeAccounting with which to
+        determine the sizes of files; if None, their apparent sizes are used.
+        The "scan_filter" parameter may be a ScanFilter that decides which
+        files are counted and which subdirectories are walked; may be None to
+        count all files.
         All other positional and keyword arguments are given to the __init__()
         method of the superclass. 
         """
         SizeProducer.__init__(self, *args, **kwargs)
         self.paths = paths
+        self.walker = DirectoryWalker(num_jobs, scan_filter=scan_filter)
+        self.cumulative = cumulative
+        self.accounting = accounting if accounting is not None \
+            else SizeAccounting()
 
     def values(self):
         """
-        Iterates over the paths in self.paths.
-        If an element is a directory then that directory is walked, recursively,
-        and the path of each directory is returned.  Otherwise, the path is
-        returned.
+        Walks each of the paths in self.paths, recursively, and yields a
+        (path, size) tuple for each directory.
+        Every file is stat'ed exactly once.  If not cumulative, each directory
+        is yielded as soon as it is scanned; otherwise, the directories are
+        yielded after each tree is walked completely.
+        If a directory cannot be listed, which includes paths that are not
+        directories, then self.on_error() is invoked with an error message,
+        and if it returns, then the directory is not yielded.
+        If an error occurs getting the size of one of the files then
+        self.on_error() is invoked with an error message; if on_error() does
+        not raise an exception then the size of that file is simply ignored in
+        the total.  Dangling symbolic links are silently ignored.
         """
         for path in self.paths:
-            if os.path.isdir(path):
-                for (dirpath, dirnames, filenames) in os.walk(path):
-                    yield dirpath
-            else:
-                yield path
+            totals = DirectoryTotals()
+            totals.discover(path, -1)
+
+            for scanned in self.walker.walk(path):
+                if scanned.error is not None:
+                    self.on_error(scanned.error)
+                    continue
+
+                for (error_path, e) in scanned.errors:
+                    if e.errno != errno.ENOENT:
+                        self.on_error("unable to determine file size: %s (%s)"
+                            % (error_path, e.strerror))
+
+                size = 0
+                size_of = self.accounting.size_of
+                for (file_path, stat) in scanned.files:
+                    if S_ISREG(stat.st_mode):
+                        size += size_of(stat) or 0
+
+                if self.cumulative:
+                    totals.add(scanned, size)
+                else:
+                    yield (scanned.path, size)
 
-    def name_from_value(self, value):
+            if self.cumulative:
+                for (dir_path, shallow_size, cumulative_size) in totals:
+                    yield (dir_path, cumulative_size)
+
+    def num_pending_directories(self):
         """
-        Returns exactly the given "value".
+        Returns the number of directories pending in self.walker.
         """
-        return value
+        return self.walker.num_pending
 
-    def size_from_value(self, path):
+    def name_from_value(self, value):
         """
-        Returns the sum of the sizes of all files in the given directory.
-        The "path" parameter must be a string whose value is the path of the
-        directory whose sum of file sizes to return.
-        If the entries in the given directory cannot be listed then
-        self.on_error() is invoked with an error message, and if it returns,
-        then None is returned.
-        Otherwise, the sum of the sizes of all files in the given directory
-        is returned as an int.
-        If an error occurs getting the size of one of the files then
-        self.on_error() is inovked with an error message; if on_error() does
-        not raise an exception then the size of that file is simply ignored in
-        the returned total. 
+        Returns the path component of a value yielded from values().
         """
-        try:
-            dir_entries = os.listdir(path)
-        except OSError as e:
-            self.on_error("unable to list directory: %s (%s)" %
-                (path, e.strerror))
-        else:
-            size = 0
-            for entry in dir_entries:
-                cur_path = os.path.join(path, entry)
-                if os.path.isfile(cur_path):
-                    try:
-                        cur_size = file_size(cur_path)
-                    except OSError as e:
-                        self.on_error("unable to determine file size: %s (%s)" %
-                            (path, e.strerror))
-                    else:
-                        size += cur_size
+        return value[0]
 
-            return size
+    def size_from_value(self, value):
+        """
+        Returns the size component of a value yielded from values().
+        """
+        return value[1]
 
 ################################################################################
 
 class DatabaseSizeProducer(SizeProducer):
     """
-    An implementation of SizeProducer that returns the (name, size) of all
-    entries in a Database.
+    An implementation of SizeProducer that returns the (name, size) of the
+    entries in a Database that could be among the search results.
+    The search is pushed down into SQL so that only the top entries are loaded
+    from the database, rather than every row.
     """
 
-    def __init__(self, db, *args, **kwargs):
+    def __init__(self, db, max_results, invert, directories, *args, **kwargs):
         """
         Initializes a new instance of DatabaseSizeProducer.
         The "db" parameter must be an instance of Database whose elements to
         iterate over in values().
+        The "max_results" and "invert" parameters must be the same values given
+        to the search engine; only the "max_results" largest entries, or
+        smallest if "invert" is True, are yielded.
+        If the "directories" parameter is True then the yielded entries are the
+        directories of the files in the database, with the sum of the sizes of
+        the files directly in them, like DirSizeProducer; directories without
+        any files are not recorded in the database and are never yielded.
         All other positional and keyword arguments are given to the __init__()
         method of the superclass. 
         """
         SizeProducer.__init__(self, *args, **kwargs)
         self.db = db
+        self.max_results = max_results
+        self.invert = invert
+        self.directories = directories
 
     def values(self):
         """
-        Yields each record from self.db.
+        Yields each matching record from self.db.
         If a database access error occurs then SizeProducerError is raised.
         """
         try:
-            for record in self.db:
-                yield record
-        except sqlite3.error as e:
+            if self.directories:
+                records = self.db.top_directories(self.max_results,
+                    self.invert)
+                for (dir_path, size) in records:
+                    yield (self.normalize_dir_path(dir_path), size)
+            else:
+                yield from self.db.top_files(self.max_results, self.invert)
+        except sqlite3.Error as e:
             raise SizeProducerError(("unable to load record from database: " +
                 "%s (%s)") % (self.db.path, e))
 
+    @staticmethod
+    def normalize_dir_path(dir_path):
+        """
+        Converts a directory path computed by Database.top_directories(), which
+        retains the trailing separator, to the form used by DirSizeProducer.
+        """
+        if not dir_path:
+            return os.curdir
+        return dir_path.rstrip(os.sep) or os.sep
+
     def name_from_value(self, value):
         """
         Returns the "name" component of a record yielded from "values".
@@ -761,6 +2742,267 @@ class DatabaseSizeProducer(SizeProducer):
 
 ################################################################################
 
+def create_shards(path_groups, split_subdirs, scan_filter=None):
+    """
+    Divides the paths to search into shards for ShardedSizeProducer.
+    The *path_groups* parameter must be an iterable of iterables of strings,
+    like the "paths" attribute of the parsed command-line arguments.
+    Each directory becomes its own shard; if *split_subdirs* is True then each
+    subdirectory of each directory becomes its own shard instead.  All other
+    paths, such as files, are put together into one last shard.
+    The *scan_filter* parameter may be the ScanFilter given to the workers;
+    since DirectoryWalker never filters the root that it is given, the
+    subdirectories that it would not descend into, such as excluded ones or
+    ones on another file system, are dropped here rather than becoming
+    shards.  The directories given by the user are always searched, just like
+    without sharding.
+    Returns a list of lists of strings whose values are paths.
+    """
+    if scan_filter is not None and scan_filter.is_empty():
+        scan_filter = None
+
+    shards = []
+    loose_paths = []
+    for paths in path_groups:
+        for path in paths:
+            if not os.path.isdir(path):
+                loose_paths.append(path)
+                continue
+            elif not split_subdirs:
+                shards.append([path])
+                continue
+
+            try:
+                stat = os.stat(path)
+                with os.scandir(path) as entries:
+                    entries = list(entries)
+            except OSError:
+                # let the worker report the error, if any
+                shards.append([path])
+                continue
+
+            for entry in entries:
+                try:
+                    if not entry.is_dir() or entry.is_symlink():
+                        loose_paths.append(entry.path)
+                    elif scan_filter is None or \
+                            scan_filter.accepts_directory(entry, stat):
+                        shards.append([entry.path])
+                except OSError:
+                    # let the worker report the error
+                    loose_paths.append(entry.path)
+
+    if loose_paths:
+        shards.append(loose_paths)
+
+    return shards
+
+def search_shard(paths, directories, cumulative, num_jobs, size_mode,
+        dedup_hardlinks, scan_filter, max_results, invert, ignore_errors):
+    """
+    Searches one shard of the paths given to ShardedSizeProducer.
+    This function is invoked in a worker process; its parameters have the same
+    meanings as the command-line arguments with the same names.
+    Errors are printed to standard error if *ignore_errors* is True; otherwise,
+    the search stops at the first error.
+    Returns a tuple (results, error, num_errors) where *results* is a list of
+    the (size, path) results of the search of the shard, *error* is the error
+    message that stopped the search, or None if it completed, and *num_errors*
+    is the number of other errors, which were printed or ignored.
+    """
+    if ignore_errors:
+        def on_error(message):
+            print(message, file=sys.stderr)
+    else:
+        def on_error(message):
+            raise SizeProducerError(message)
+
+    # the statistics only count the errors, to return them to the main process
+    statistics = ScanStatistics(invert=invert)
+    accounting = SizeAccounting(allocated=(size_mode == "allocated"),
+        dedup_hardlinks=dedup_hardlinks)
+    if directories:
+        size_producer = DirSizeProducer(paths=paths, on_error=on_error,
+            num_jobs=num_jobs, cumulative=cumulative, accounting=accounting,
+            scan_filter=scan_filter, statistics=statistics)
+    else:
+        size_producer = FileSizeProducer(paths=paths, on_error=on_error,
+            num_jobs=num_jobs, accounting=accounting, scan_filter=scan_filter,
+            statistics=statistics)
+
+    search = create_search_engine(max_results=max_results, invert=invert)
+    try:
+        for (name, size) in size_producer:
+            search.add_file(name, size)
+    except SizeProducerError as e:
+        # the error that stopped the search was counted too
+        return (list(search.results()), str(e), statistics.num_errors - 1)
+
+    return (list(search.results()), None, statistics.num_errors)
+
+class ShardedSizeProducer(SizeProducer):
+    """
+    An implementation of SizeProducer that searches shards of paths
+    concurrently in a pool of worker processes.
+    Each worker keeps its own top results, and only those are yielded, so the
+    results of a search engine with the same max_results and invert are the
+    same as if every path had been searched in this process.
+    """
+
+    def __init__(self, shards, num_processes, search_shard_kwargs, *args,
+            **kwargs):
+        """
+        Initializes a new instance of ShardedSizeProducer.
+        The "shards" parameter must be a list of lists of paths, as returned
+        from create_shards(), each of which is searched by one worker.
+        The "num_processes" parameter must be an integer whose value is the
+        maximum number of worker processes.
+        The "search_shard_kwargs" parameter must be a dict of the keyword
+        arguments, other than "paths", to give to search_shard().
+        All other positional and keyword arguments are given to the __init__()
+        method of the superclass.
+        """
+        SizeProducer.__init__(self, *args, **kwargs)
+        self.shards = shards
+        self.num_processes = num_processes
+        self.search_shard_kwargs = search_shard_kwargs
+        self.num_pending_shards = 0
+
+    def values(self):
+        """
+        Yields the (size, path) results of each shard as it completes.
+        An error that stopped the search of a shard is given to
+        self.on_error(); if it returns then the results of the shard up to the
+        error are still yielded.
+        If a worker process fails then SizeProducerError is raised.
+        """
+        executor = concurrent.futures.ProcessPoolExecutor(self.num_processes)
+        try:
+            futures = [
+                executor.submit(search_shard, paths=paths,
+                    **self.search_shard_kwargs)
+                for paths in self.shards
+            ]
+            self.num_pending_shards = len(futures)
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    (results, error, num_errors) = future.result()
+                except concurrent.futures.process.BrokenProcessPool as e:
+                    raise SizeProducerError("worker process failed: %s" % e)
+                self.num_pending_shards -= 1
+                if self.statistics is not None:
+                    self.statistics.record_errors(num_errors)
+                if error is not None:
+                    self.on_error(error)
+                yield from results
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def num_pending_directories(self):
+        """
+        Returns the number of shards whose search has not completed, each of
+        which is usually one directory.
+        """
+        return self.num_pending_shards
+
+    def name_from_value(self, value):
+        """
+        Returns the path component of a (size, path) result.
+        """
+        return value[1]
+
+    def size_from_value(self, value):
+        """
+        Returns the size component of a (size, path) result.
+        """
+        return value[0]
+
+################################################################################
+
+def write_statistics_json(path, statistics, save_db):
+    """
+    Writes the statistics of a search to a file in JSON format.
+    The *path* parameter must be a string whose value is the path of the file
+    to write, *statistics* must be the ScanStatistics of the search, and
+    *save_db* must be the Database given to --save, or None.
+    Errors writing the file are printed to standard error.
+    """
+    stats = statistics.to_json_dict()
+    if save_db is not None:
+        stats["rows_saved"] = save_db.num_rows_written
+        stats["save_seconds"] = save_db.write_seconds
+
+    try:
+        with open(path, "w") as f:
+            json.dump(stats, f, indent=2)
+            f.write("\n")
+    except OSError as e:
+        print("ERROR: unable to write statistics: %s (%s)" % (path, e.strerror),
+            file=sys.stderr)
+
+################################################################################
+
+def get_format_size_units(settings):
+    """
+    Returns the unit table with which to format sizes for output, or None if
+    sizes are not to be formatted, according to the given parsed command-line
+    arguments.
+    """
+    if not settings.format_sizes:
+        return None
+    elif settings.binary_sizes:
+        return UNIT_TABLE_IEC_BINARY
+    else:
+        return UNIT_TABLE_SI_DECIMAL
+
+def diff_main(settings):
+    """
+    The main method for --diff.
+    The *settings* parameter must be the parsed command-line arguments.
+    Returns an integer whose value is the exit code: 0 on success, 1 on failure.
+    """
+    (old_path, new_path) = settings.diff_paths
+    dbs = []
+    try:
+        for path in (old_path, new_path):
+            try:
+                db = Database(path, read_only=True)
+                dbs.append(db)
+                db.initialize()
+            except sqlite3.Error as e:
+                print("ERROR: unable to initialize sqlite database: %s (%s)" %
+                    (path, e), file=sys.stderr)
+                return 1
+
+            # the comparisons probe each snapshot by its unique path index,
+            # which older versions did not create
+            if db.schema_version < Database.SCHEMA_VERSION:
+                print(("ERROR: unable to compare sqlite database saved by an " +
+                    "older version: %s (save it again with this version)") %
+                    path, file=sys.stderr)
+                return 1
+
+        try:
+            diff = SnapshotDiff(old_db=dbs[0], new_db=dbs[1])
+            print_diff(
+                diff=diff,
+                max_results=settings.num_results,
+                format_size_units=get_format_size_units(settings),
+                no_padding=settings.no_padding,
+                reverse_order=settings.reverse_order,
+            )
+        except sqlite3.Error as e:
+            print("ERROR: unable to compare sqlite databases: %s and %s (%s)" %
+                (old_path, new_path, e), file=sys.stderr)
+            return 1
+    finally:
+        for db in dbs:
+            db.close()
+
+    return 0
+
+################################################################################
+
 def main(args):
     """
     The main method for this application.
@@ -775,18 +3017,47 @@ def main(args):
     args_parser = BigFilesArgumentParser()
     settings = args_parser.parse_args(args=args)
 
+    if settings.diff_paths is not None:
+        return diff_main(settings)
+
     search_engines = []
 
-    # setup the search engine
-    search = BigFilesSearchEngine(
-        max_results=settings.num_results,
-        invert=settings.invert,
-    )
+    # setup the search engine; with --stream, the files are written as they are
+    # found instead of being searched
+    if settings.stream:
+        stream_writer = RESULT_WRITER_TYPES[settings.output_format](
+            sys.stdout, get_format_size_units(settings))
+        search = StreamingSearchEngine(stream_writer)
+    else:
+        stream_writer = None
+        search = create_search_engine(
+            max_results=settings.num_results,
+            invert=settings.invert,
+        )
     search_engines.append(search)
 
+    # setup the save database as a search engine, if specified; in incremental
+    # mode the size producers record the files in the database themselves
+    if settings.db_save_path is not None:
+        save_db = Database(
+            settings.db_save_path,
+            batch_size=max(settings.save_batch_size, 1),
+            commit_interval=(settings.save_commit_interval or None),
+        )
+        if settings.incremental:
+            snapshot = IncrementalSnapshot(save_db)
+        else:
+            snapshot = None
+            search_engines.append(save_db)
+    else:
+        save_db = None
+        snapshot = None
+
     # setup the size producers
     if settings.directories:
         size_producer_type = DirSizeProducer
+    elif snapshot is not None:
+        size_producer_type = IncrementalFileSizeProducer
     else:
         size_producer_type = FileSizeProducer
 
@@ -797,43 +3068,104 @@ def main(args):
         def size_producer_on_error(message):
             raise SizeProducerError(message)
 
+    # setup the statistics, if requested; with --processes only the results and
+    # the error counts of the workers are recorded
+    if settings.progress or settings.stats_json_path is not None:
+        statistics = ScanStatistics(
+            invert=settings.invert,
+            progress_interval=(settings.progress_interval
+                if settings.progress else None),
+            directories=settings.directories,
+            cumulative=settings.cumulative,
+        )
+    else:
+        statistics = None
+
+    now = time.time()
+    scan_filter = ScanFilter(
+        include=settings.include,
+        exclude=settings.exclude,
+        min_size=settings.min_size,
+        max_size=settings.max_size,
+        min_mtime=(now - settings.max_age * 86400
+            if settings.max_age is not None else None),
+        max_mtime=(now - settings.min_age * 86400
+            if settings.min_age is not None else None),
+        one_file_system=settings.one_file_system,
+    )
+
+    size_producer_kwargs = {
+        "statistics": statistics,
+        "scan_filter": scan_filter,
+        "num_jobs": settings.jobs,
+        "accounting": SizeAccounting(
+            allocated=(settings.size_mode == "allocated"),
+            dedup_hardlinks=settings.dedup_hardlinks,
+        ),
+    }
+    if settings.directories:
+        size_producer_kwargs["cumulative"] = settings.cumulative
+    if snapshot is not None:
+        size_producer_kwargs["snapshot"] = snapshot
+
     size_producers = []
-    for paths in settings.paths:
-        size_producer = size_producer_type(
-            paths=paths,
+    if settings.processes > 1:
+        size_producer = ShardedSizeProducer(
+            shards=create_shards(settings.paths, settings.shard_subdirs,
+                scan_filter),
+            num_processes=settings.processes,
+            search_shard_kwargs=dict(
+                directories=settings.directories,
+                cumulative=settings.cumulative,
+                num_jobs=settings.jobs,
+                size_mode=settings.size_mode,
+                dedup_hardlinks=settings.dedup_hardlinks,
+                scan_filter=scan_filter,
+                max_results=settings.num_results,
+                invert=settings.invert,
+                ignore_errors=settings.ignore_errors,
+            ),
             on_error=size_producer_on_error,
+            statistics=statistics,
         )
         size_producers.append(size_producer)
+    else:
+        for paths in settings.paths:
+            size_producer = size_producer_type(
+                paths=paths,
+                on_error=size_producer_on_error,
+                **size_producer_kwargs
+            )
+            size_producers.append(size_producer)
 
     # setup the load database as a size producer, if specified
     if settings.db_load_path is not None:
-        load_db = Database(settings.db_load_path)
         try:
+            load_db = Database(settings.db_load_path, read_only=True)
             load_db.initialize()
         except sqlite3.Error as e:
             print("ERROR: unable to initialize sqlite database: %s (%s)"
-                % (load_db.path, e))
+                % (settings.db_load_path, e))
             return 1
 
         load_db_size_producer = DatabaseSizeProducer(
             db=load_db,
+            max_results=settings.num_results,
+            invert=settings.invert,
+            directories=settings.directories,
             on_error=size_producer_on_error,
+            statistics=statistics,
         )
         size_producers.append(load_db_size_producer)
 
-    # setup the save database as a search engine, if specified
-    if settings.db_save_path is not None:
-        save_db = Database(settings.db_save_path)
-        search_engines.append(save_db)
-    else:
-        save_db = None
-
     # search the files specified by the user
     print_results_enabled = False
 
     # will be set below and used outside of the block to report the last-processed file
     path = None
 
+    save_db_initialized = False
+
     try:
         if save_db is not None:
             try:
@@ -842,6 +3174,18 @@ def main(args):
                 print("ERROR: unable to initialize sqlite database: %s (%s)" %
                     (save_db.path, e))
                 return 1
+            save_db_initialized = True
+
+        if snapshot is not None:
+            try:
+                snapshot.begin()
+            except sqlite3.Error as e:
+                print("ERROR: unable to load snapshot from database: %s (%s)" %
+                    (save_db.path, e))
+                return 1
+
+        if statistics is not None:
+            statistics.start()
 
         for size_producer in size_producers:
             try:
@@ -852,6 +3196,14 @@ def main(args):
                 print(str(e), file=sys.stderr)
                 return 1
 
+        if snapshot is not None:
+            try:
+                snapshot.finish()
+            except sqlite3.Error as e:
+                print("ERROR: unable to update database: %s (%s)" %
+                    (save_db.path, e))
+                return 1
+
         # we finished; enable printing of the results
         print_results_enabled = True
 
@@ -862,28 +3214,39 @@ def main(args):
         raise
 
     finally:
+        if statistics is not None:
+            statistics.stop()
+
         if save_db is not None:
             try:
-                save_db.commit()
+                if save_db_initialized:
+                    save_db.commit()
             finally:
                 save_db.close()
-
-        # print the results
-        if print_results_enabled:
-            if not settings.format_sizes:
-                format_size_units = None
-            elif settings.binary_sizes:
-                format_size_units = UNIT_TABLE_IEC_BINARY
-            else:
-                format_size_units = UNIT_TABLE_SI_DECIMAL
-
+            if save_db_initialized and print_results_enabled:
+                print_save_statistics(save_db)
+
+        # print the results; streamed results just need to be completed, even
+        # if the search failed, so that the rows already found are not lost
+        # and the output is well-formed
+        if stream_writer is not None:
+            stream_writer.close()
+        elif print_results_enabled:
             print_results(
                 search=search,
-                format_size_units=format_size_units,
+                format_size_units=get_format_size_units(settings),
                 no_padding=settings.no_padding,
                 reverse_order=(settings.invert == settings.reverse_order),
+                output_format=settings.output_format,
             )
 
+        if print_results_enabled and statistics is not None:
+            if settings.progress:
+                statistics.print_progress()
+            if settings.stats_json_path is not None:
+                write_statistics_json(settings.stats_json_path, statistics,
+                    save_db)
+
     return 0
 
 ################################################################################
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+################################################################################
+# bigfiles_benchmark.py
+#
+# Benchmarks for the scanning engines of bigfiles.py.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+
+"""
+Benchmarks the engines of bigfiles.py against their original implementations.
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import bigfiles
+
+################################################################################
+
+def create_synthetic_tree(root, num_files, files_per_dir, dirs_per_dir):
+    """
+    Creates a directory tree populated with small files.
+    The *root* parameter must be a string whose value is the path of an
+    existing, empty directory in which to create the tree.
+    The *num_files* parameter must be an integer whose value is the total number
+    of files to create; *files_per_dir* and *dirs_per_dir* are integers that
+    control the shape of the tree.
+    File sizes vary between 0 and 255 bytes so that the results are not all
+    ties.
+    """
+    pending_dirs = [root]
+    num_created = 0
+    while num_created < num_files:
+        dir_path = pending_dirs.pop(0)
+        for i in range(min(files_per_dir, num_files - num_created)):
+            file_path = os.path.join(dir_path, "f%i" % i)
+            with open(file_path, "wb") as f:
+                f.write(b"x" * (num_created % 256))
+            num_created += 1
+        for i in range(dirs_per_dir):
+            subdir_path = os.path.join(dir_path, "d%i" % i)
+            os.mkdir(subdir_path)
+            pending_dirs.append(subdir_path)
+
+################################################################################
+
+def scan_with_os_walk(root):
+    """
+    Scans a tree the way FileSizeProducer originally did: with os.walk()
+    followed by a separate os.stat() of each file.
+    Returns a tuple (num_files, total_size).
+    """
+    num_files = 0
+    total_size = 0
+    for (dirpath, dirnames, filenames) in os.walk(root):
+        for filename in filenames:
+            total_size += bigfiles.file_size(os.path.join(dirpath, filename))
+            num_files += 1
+    return (num_files, total_size)
+
+def scan_with_directory_walker(root, num_jobs):
+    """
+    Scans a tree using bigfiles.FileSizeProducer, which uses DirectoryWalker.
+    Returns a tuple (num_files, total_size).
+    """
+    def on_error(message):
+        raise bigfiles.SizeProducerError(message)
+
+    producer = bigfiles.FileSizeProducer(
+        paths=[root],
+        on_error=on_error,
+        num_jobs=num_jobs,
+    )
+
+    num_files = 0
+    total_size = 0
+    for (name, size) in producer:
+        total_size += size
+        num_files += 1
+    return (num_files, total_size)
+
+def timed(func, *args):
+    """
+    Invokes the given function with the given arguments.
+    Returns a tuple (elapsed_seconds, return_value).
+    """
+    start_time = time.perf_counter()
+    result = func(*args)
+    return (time.perf_counter() - start_time, result)
+
+def benchmark_walk(settings):
+    """
+    Compares the os.walk() scan to the DirectoryWalker scan.
+    """
+    if settings.tree is not None:
+        root = settings.tree
+        temp_dir = None
+    else:
+        temp_dir = tempfile.mkdtemp(prefix="bigfiles_benchmark_")
+        root = temp_dir
+        print("Creating %i files in %s" % (settings.num_files, root))
+        create_synthetic_tree(root, settings.num_files, 100, 10)
+
+    try:
+        (elapsed, (num_files, total_size)) = timed(scan_with_os_walk, root)
+        print("os.walk + os.stat:        %8.3fs  %12.0f files/sec" %
+            (elapsed, num_files / elapsed))
+
+        for num_jobs in settings.jobs:
+            (elapsed, result) = timed(scan_with_directory_walker, root,
+                num_jobs)
+            if result != (num_files, total_size):
+                raise AssertionError("results differ: %s != %s" %
+                    (result, (num_files, total_size)))
+            print("DirectoryWalker jobs=%-3i  %8.3fs  %12.0f files/sec" %
+                (num_jobs, elapsed, num_files / elapsed))
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir)
+
+################################################################################
+
+def run_search_engine(engine_type, sizes, max_results, invert):
+    """
+    Adds every size in *sizes* to a new instance of *engine_type*.
+    Returns the list of results of the search.
+    """
+    engine = engine_type(max_results=max_results, invert=invert)
+    add_file = engine.add_file
+    for size in sizes:
+        add_file("", size)
+    return list(engine.results())
+
+def benchmark_engine(settings):
+    """
+    Compares BigFilesSearchEngine to BigFilesHeapSearchEngine over a range of
+    result counts to find the crossover point.
+    """
+    print("Generating %i %s sizes" % (settings.num_sizes, settings.order))
+    rng = random.Random(settings.seed)
+    sizes = [int(rng.lognormvariate(10, 3)) for _ in range(settings.num_sizes)]
+    if settings.order == "worst-case":
+        # every size is admitted into the results, maximizing insertions
+        sizes.sort(reverse=settings.invert)
+
+    print("%10s  %10s  %10s  %s" % ("N", "list", "heap", "winner"))
+    for max_results in settings.num_results:
+        (list_elapsed, list_results) = timed(run_search_engine,
+            bigfiles.BigFilesSearchEngine, sizes, max_results, settings.invert)
+        (heap_elapsed, heap_results) = timed(run_search_engine,
+            bigfiles.BigFilesHeapSearchEngine, sizes, max_results,
+            settings.invert)
+        if list_results != heap_results:
+            raise AssertionError("results differ for N=%i" % max_results)
+        winner = "heap" if heap_elapsed < list_elapsed else "list"
+        print("%10i  %9.3fs  %9.3fs  %s" %
+            (max_results, list_elapsed, heap_elapsed, winner))
+
+################################################################################
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    walk_parser = subparsers.add_parser("walk",
+        help="Compare os.walk() to DirectoryWalker on a synthetic tree")
+    walk_parser.add_argument(
+        "--num-files",
+        type=int,
+        default=1000000,
+        help="The number of files in the synthetic tree (default %(default)i)"
+    )
+    walk_parser.add_argument(
+        "--tree",
+        help="Scan this existing directory instead of creating a synthetic " +
+            "tree"
+    )
+    walk_parser.add_argument(
+        "--jobs",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, 8, 16],
+        help="The numbers of threads with which to run DirectoryWalker"
+    )
+    walk_parser.set_defaults(func=benchmark_walk)
+
+    engine_parser = subparsers.add_parser("engine",
+        help="Compare BigFilesSearchEngine to BigFilesHeapSearchEngine")
+    engine_parser.add_argument(
+        "--num-sizes",
+        type=int,
+        default=10000000,
+        help="The number of synthetic sizes to add (default %(default)i)"
+    )
+    engine_parser.add_argument(
+        "--num-results",
+        type=int,
+        nargs="+",
+        default=[10, 100, 300, 1000, 3000, 10000, 100000],
+        help="The values of -n with which to run each engine"
+    )
+    engine_parser.add_argument(
+        "--invert",
+        action="store_true",
+        default=False,
+        help="Search for the smallest sizes instead of the largest"
+    )
+    engine_parser.add_argument(
+        "--order",
+        choices=("random", "worst-case"),
+        default="random",
+        help="The order of the sizes; \"worst-case\" sorts them so that " +
+            "every size is admitted into the results (default %(default)s)"
+    )
+    engine_parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="The seed of the random number generator (default %(default)i)"
+    )
+    engine_parser.set_defaults(func=benchmark_engine)
+
+    return parser.parse_args(args)
+
+def main(args):
+    settings = parse_args(args)
+    settings.func(settings)
+    return 0
+
+################################################################################
+# Main Entry Point
+################################################################################
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
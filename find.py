@@ -4,40 +4,854 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import argparse
+import concurrent.futures
 import fnmatch
+import json
+import math
+import operator
 import os
+import queue
 import re
+import sqlite3
 import sys
+import time
+from stat import S_ISDIR, S_ISLNK, S_ISREG
+
+DEFAULT_IGNORE_DIRS = (".bzr", ".git", ".hg", ".svn", "node_modules")
+
+WILDCARD_REGEX = re.compile(r"[*?[]")
+LITERAL_PREFIX_REGEX = re.compile(r"[^*?[]*")
+LITERAL_SUFFIX_REGEX = re.compile(r"[^*?[\]]*\Z")
+
+SIZE_UNITS = {"": 1, "c": 1, "k": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+SECONDS_PER_DAY = 24 * 60 * 60
 
 def main():
     config = parse_args()
 
-    pattern = config.pattern
-    pattern_normcase = os.path.normcase(pattern)
-    pattern_regex = fnmatch.translate(pattern_normcase)
-    match_expr = re.compile(pattern_regex)
+    matcher = PatternMatcher(config.patterns)
 
     dir_paths = config.dir_path
     if not dir_paths:
         dir_paths = [os.getcwd()]
 
-    run(match_expr, dir_paths)
+    ignore_dirs = set(config.ignore_dirs)
+    if config.ignore_common_dirs:
+        ignore_dirs.update(DEFAULT_IGNORE_DIRS)
+
+    if config.newer is None:
+        newer_mtime_ns = None
+    else:
+        try:
+            newer_mtime_ns = os.stat(config.newer).st_mtime_ns
+        except OSError as e:
+            print("ERROR: unable to stat file: %s (%s)" % (config.newer, e.strerror),
+                file=sys.stderr)
+            return 1
+
+    entry_filter = EntryFilter(
+        file_type=config.type,
+        size=config.size,
+        mtime_days=config.mtime,
+        newer_mtime_ns=newer_mtime_ns,
+        need_stat=(config.output_format == "ndjson"),
+    )
+
+    walker = DirectoryWalker(
+        num_jobs=config.jobs,
+        max_depth=config.max_depth,
+        ignore_dirs=ignore_dirs,
+        entry_filter=entry_filter,
+    )
+
+    if config.index_path is None:
+        index = None
+    else:
+        try:
+            index = FilenameIndex(config.index_path, update=config.update)
+        except sqlite3.Error as e:
+            print("ERROR: unable to open index: %s (%s)" % (config.index_path, e),
+                file=sys.stderr)
+            return 1
+
+    try:
+        run(matcher, dir_paths, walker, index, config.output_format)
+    except sqlite3.Error as e:
+        print("ERROR: unable to update index: %s (%s)" % (config.index_path, e),
+            file=sys.stderr)
+        return 1
+    finally:
+        if index is not None:
+            index.close()
+
+def run(matcher, dir_paths, walker=None, index=None, output_format="text"):
+    if walker is None:
+        walker = DirectoryWalker()
+    match_name = matcher.match
+    name_prefix = matcher.literal_prefix
+    entry_filter = walker.entry_filter
+
+    writer = BATCH_WRITER_TYPES[output_format](sys.stdout)
+    try:
+        for dir_path in dir_paths:
+            if index is None:
+                walk = walker.walk(dir_path, match_name)
+            else:
+                walk = index.search(dir_path, walker, match_name, name_prefix)
+                if entry_filter is not None:
+                    walk = entry_filter.filter_paths(walk)
+            for (cur_dir_path, matches) in walk:
+                writer.write_matches(cur_dir_path, matches)
+    finally:
+        writer.flush()
+
+class PatternMatcher(object):
+    """
+    Matches filenames against any number of fnmatch patterns at once.  Patterns
+    without wildcards are looked up in a set of names, and patterns that are
+    literals preceded or followed by a single "*", such as "*.py" or "README*",
+    are checked with a single str.endswith() or str.startswith() of all of
+    their literals; the remaining patterns are combined into a single regular
+    expression, which is only run on the names that start and end with the
+    literal characters of one of them.  The "match" attribute is the function
+    that returns whether a filename matches, composed of only the checks that
+    the patterns need.
+    """
+
+    def __init__(self, patterns):
+        names = set()
+        suffixes = set()
+        prefixes = set()
+        regex_patterns = []
+        match_all = False
+
+        patterns = [os.path.normcase(x) for x in patterns]
+        for pattern in patterns:
+            if pattern == "*":
+                match_all = True
+            elif not WILDCARD_REGEX.search(pattern):
+                names.add(pattern)
+            elif pattern.startswith("*") and \
+                    not WILDCARD_REGEX.search(pattern, 1):
+                suffixes.add(pattern[1:])
+            elif pattern.endswith("*") and \
+                    not WILDCARD_REGEX.search(pattern, 0, len(pattern) - 1):
+                prefixes.add(pattern[:-1])
+            else:
+                regex_patterns.append(pattern)
+
+        regex_check = None
+        if regex_patterns:
+            regex_check = self.create_regex_check(regex_patterns)
+            # every name reaches the regular expression anyway, so it may as
+            # well match the other patterns too
+            if regex_check is None:
+                (names, suffixes, prefixes) = ((), (), ())
+                regex_check = re.compile("|".join(fnmatch.translate(x)
+                    for x in patterns)).match
+
+        checks = []
+        if names:
+            checks.append(frozenset(names).__contains__)
+        if suffixes:
+            checks.append(operator.methodcaller("endswith", tuple(suffixes)))
+        if prefixes:
+            checks.append(operator.methodcaller("startswith", tuple(prefixes)))
+        if regex_check is not None:
+            checks.append(regex_check)
+
+        if match_all:
+            def match(name):
+                return True
+        elif len(checks) == 1:
+            match = checks[0]
+        else:
+            def match(name):
+                for check in checks:
+                    if check(name):
+                        return True
+                return False
+
+        # os.path.normcase() is the identity function except on Windows
+        if os.path.normcase("A") == "A":
+            self.match = match
+        else:
+            self.match = lambda name: match(os.path.normcase(name))
+
+        # the index can only narrow the names by prefix if they are as is
+        if match_all or os.path.normcase("A") != "A":
+            self.literal_prefix = ""
+        else:
+            self.literal_prefix = os.path.commonprefix(
+                [LITERAL_PREFIX_REGEX.match(x).group() for x in patterns])
+
+    @staticmethod
+    def create_regex_check(patterns):
+        """
+        Returns a function that matches names against a regular expression
+        combining the given patterns, which first rejects the names that do not
+        start or end with any of their literal characters; or None if the names
+        cannot be rejected without running the regular expression.
+        """
+        regex_match = re.compile("|".join(fnmatch.translate(x)
+            for x in patterns)).match
+        prefixes = tuple(set(LITERAL_PREFIX_REGEX.match(x).group()
+            for x in patterns))
+        suffixes = tuple(set(LITERAL_SUFFIX_REGEX.search(x).group()
+            for x in patterns))
+
+        # every name starts and ends with the empty string
+        if "" in prefixes and "" in suffixes:
+            return None
+        elif "" in prefixes:
+            return lambda name: name.endswith(suffixes) \
+                and regex_match(name) is not None
+        elif "" in suffixes:
+            return lambda name: name.startswith(prefixes) \
+                and regex_match(name) is not None
+        else:
+            return lambda name: name.startswith(prefixes) \
+                and name.endswith(suffixes) and regex_match(name) is not None
+
+class EntryFilter(object):
+    """
+    Filters the files found by a search by their type, size and modification
+    time, like the -type, -size, -mtime and -newer tests of find(1); the stat
+    of a file, which is only obtained if a test or the output needs it, is
+    obtained from its DirEntry, so that only one stat is made per file, and the
+    type of a file is usually known from its DirEntry without one.  Like
+    find(1), symbolic links are not followed.
+    """
+
+    def __init__(self, file_type=None, size=None, mtime_days=None,
+            newer_mtime_ns=None, need_stat=False):
+        """
+        The "file_type" parameter is "f" to only accept regular files, "d"
+        directories or "l" symbolic links, or None to accept any type.  The
+        "size" parameter is a tuple (sign, num_bytes) to only accept files
+        larger than "num_bytes" if "sign" is "+", smaller if "-" or equal to it
+        if "", or None.  The "mtime_days" parameter is a tuple (sign, num_days)
+        to accept files modified more than "num_days" whole days ago, less than
+        that, or that number of whole days ago, or None.  The "newer_mtime_ns"
+        parameter is the modification time in nanoseconds after which to only
+        accept files modified, or None.  If "need_stat" is true then files are
+        stat'ed even if none of the tests need them to be.
+        """
+        self.file_type = file_type
+        self.size = size
+        self.mtime_days = mtime_days
+        self.newer_mtime_ns = newer_mtime_ns
+        self.need_stat = need_stat or size is not None \
+            or mtime_days is not None or newer_mtime_ns is not None
+        self.now = time.time()
+
+    def is_empty(self):
+        return self.file_type is None and not self.need_stat
+
+    def matches_dirs(self):
+        """
+        Returns whether directories, including symbolic links to them, can be
+        accepted, which are otherwise not searched for, like os.walk().
+        """
+        return self.file_type in ("d", "l")
+
+    def filter_entry(self, entry):
+        """
+        Tests the file of the given DirEntry.  Returns the tuple (name, stat)
+        of the file if it is accepted, where "stat" is None if it is not needed,
+        otherwise None.
+        """
+        file_type = self.file_type
+        if file_type is not None:
+            if file_type == "f":
+                is_type = entry.is_file(follow_symlinks=False)
+            elif file_type == "d":
+                is_type = entry.is_dir(follow_symlinks=False)
+            else:
+                is_type = entry.is_symlink()
+            if not is_type:
+                return None
+
+        if not self.need_stat:
+            return (entry.name, None)
+        try:
+            stat = entry.stat(follow_symlinks=False)
+        except OSError:
+            return None
+        return (entry.name, stat) if self.accepts_stat(stat) else None
+
+    def filter_paths(self, walk):
+        """
+        A generator that tests the files of the (dir_path, matches) tuples
+        returned by FilenameIndex.search(), which has no stat of them, and
+        returns the tuples with only the matches that are accepted.
+        """
+        file_type = self.file_type
+        for (dir_path, matches) in walk:
+            accepted = []
+            for (name, stat) in matches:
+                if not self.need_stat and file_type is None:
+                    accepted.append((name, None))
+                    continue
+                try:
+                    stat = os.lstat(os.path.join(dir_path, name))
+                except OSError:
+                    continue
+                if file_type == "f" and not S_ISREG(stat.st_mode) \
+                        or file_type == "d" and not S_ISDIR(stat.st_mode) \
+                        or file_type == "l" and not S_ISLNK(stat.st_mode):
+                    continue
+                if self.accepts_stat(stat):
+                    accepted.append((name, stat if self.need_stat else None))
+            if accepted:
+                yield (dir_path, accepted)
+
+    def accepts_stat(self, stat):
+        if self.size is not None:
+            (sign, num_bytes) = self.size
+            if not compare(sign, stat.st_size, num_bytes):
+                return False
+        if self.mtime_days is not None:
+            (sign, num_days) = self.mtime_days
+            # like find(1), the fraction of a day is discarded, so that "+1"
+            # means at least 2 days ago
+            age_days = math.floor((self.now - stat.st_mtime) / SECONDS_PER_DAY)
+            if not compare(sign, age_days, num_days):
+                return False
+        if self.newer_mtime_ns is not None:
+            if stat.st_mtime_ns <= self.newer_mtime_ns:
+                return False
+        return True
+
+def compare(sign, value, limit):
+    """
+    Returns whether "value" is greater than "limit" if "sign" is "+", less than
+    it if "-", or equal to it if "".
+    """
+    if sign == "+":
+        return value > limit
+    elif sign == "-":
+        return value < limit
+    else:
+        return value == limit
+
+class DirectoryWalker(object):
+    """
+    Walks directory trees with os.scandir(), optionally scanning multiple
+    directories concurrently in a pool of threads.  Like os.walk(), symbolic
+    links to directories are not followed, and directories that cannot be
+    listed are silently skipped.
+    """
+
+    def __init__(self, num_jobs=1, max_depth=None, ignore_dirs=(),
+            entry_filter=None):
+        """
+        The "num_jobs" parameter is the number of threads with which to scan
+        directories; if 1 then directories are scanned in the calling thread,
+        in the same order as os.walk().  The "max_depth" parameter is the number
+        of levels of subdirectories to descend into, or None for no limit.  The
+        "ignore_dirs" parameter is a collection of names of directories whose
+        contents are not scanned.  The "entry_filter" parameter is an
+        EntryFilter with which to test the files whose names match, or None to
+        accept them all.
+        """
+        self.num_jobs = num_jobs
+        self.max_depth = max_depth
+        self.ignore_dirs = frozenset(ignore_dirs)
+        if entry_filter is not None and entry_filter.is_empty():
+            entry_filter = None
+        self.entry_filter = entry_filter
+
+    def walk(self, path, match_name=None):
+        """
+        Walks the directory tree rooted at the given path, returning an iterator
+        of (dir_path, matches) tuples, one for each directory, where the matches
+        are the (name, stat) tuples of the files in the directory for which
+        "match_name" returns a true value, or all of them if "match_name" is
+        None, and that the entry filter accepts; "stat" is None unless the entry
+        filter needed it.  When scanning concurrently the directories are
+        returned in the order in which their scans complete.
+        """
+        if self.num_jobs <= 1:
+            return self._walk_serial(path, match_name)
+        else:
+            return self._walk_concurrent(path, match_name)
+
+    def _walk_serial(self, path, match_name):
+        pending = [(path, 0)]
+        while pending:
+            (dir_path, depth) = pending.pop()
+            (matches, subdirs) = self.scan_directory(dir_path, depth,
+                match_name)
+            pending.extend(reversed(subdirs))
+            yield (dir_path, matches)
+
+    def _walk_concurrent(self, path, match_name):
+        executor = concurrent.futures.ThreadPoolExecutor(self.num_jobs)
+        completed = queue.Queue()
+
+        def submit(dir_path, depth):
+            future = executor.submit(self.scan_directory, dir_path, depth,
+                match_name)
+            future.dir_path = dir_path
+            future.add_done_callback(completed.put)
+
+        try:
+            submit(path, 0)
+            num_pending = 1
+            while num_pending > 0:
+                future = completed.get()
+                num_pending -= 1
+                (matches, subdirs) = future.result()
+                for (subdir_path, depth) in subdirs:
+                    submit(subdir_path, depth)
+                    num_pending += 1
+                yield (future.dir_path, matches)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def scan_directory(self, path, depth, match_name):
+        """
+        Scans the entries of the directory at the given path, which is "depth"
+        levels below the root of the walk.  Returns a tuple (matches, subdirs)
+        where "matches" are the (name, stat) tuples of the matching files and
+        "subdirs" are the (path, depth) tuples of the subdirectories to walk.
+        """
+        matches = []
+        subdirs = []
+        descend = self.max_depth is None or depth < self.max_depth
+        ignore_dirs = self.ignore_dirs
+        entry_filter = self.entry_filter
+        match_dirs = entry_filter is not None and entry_filter.matches_dirs()
+
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if is_dir:
+                        if descend and entry.name not in ignore_dirs \
+                                and not entry.is_symlink():
+                            subdirs.append((entry.path, depth + 1))
+                        if not match_dirs:
+                            continue
+                    if match_name is None or match_name(entry.name):
+                        if entry_filter is None:
+                            matches.append((entry.name, None))
+                        else:
+                            match = entry_filter.filter_entry(entry)
+                            if match is not None:
+                                matches.append(match)
+        except OSError:
+            pass
+
+        return (matches, subdirs)
+
+class FilenameIndex(object):
+    """
+    A persistent index of the files in directory trees, stored in an sqlite
+    database, from which filenames can be searched without listing every
+    directory again.  Each distinct filename is stored once in a table sorted
+    by name, so that a pattern is matched once per distinct name rather than
+    once per file, and a pattern that starts with literal characters only
+    considers the names with that prefix.  A directory is listed again only when
+    its modification time has changed, which it does when entries are added to,
+    removed from or renamed in it; so each search still stats every directory
+    unless "update" is False, in which case the index is searched as is, and
+    only the directories that it has never listed are walked.  Names are stored
+    as their bytes in the filesystem encoding, since they may not be valid in
+    it, and so are compared and sorted as bytes.
+    """
+
+    VERSION = 1
+    """
+    The version of the schema of the database, stored in its user_version; the
+    tables of an index with another version are recreated.
+    """
+
+    RACY_NS = 2 * 1000 * 1000 * 1000
+    """
+    A directory modified this recently before it was listed may be modified
+    again without changing its modification time, so its modification time is
+    not recorded, causing it to be listed again by the next search.
+    """
+
+    def __init__(self, path, update=True):
+        self.update = update
+        self.connection = sqlite3.connect(path)
+        (version,) = self.connection.execute("PRAGMA user_version").fetchone()
+        if version != self.VERSION:
+            self.connection.executescript("""
+                DROP TABLE IF EXISTS dirs;
+                DROP TABLE IF EXISTS names;
+                DROP TABLE IF EXISTS files;
+                PRAGMA user_version = %i;
+            """ % self.VERSION)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS dirs (
+                id INTEGER PRIMARY KEY,
+                parent_id INTEGER,
+                name BLOB NOT NULL,
+                mtime_ns INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS dirs_parent_id ON dirs (parent_id);
+            CREATE TABLE IF NOT EXISTS names (
+                id INTEGER PRIMARY KEY,
+                name BLOB NOT NULL UNIQUE
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                dir_id INTEGER NOT NULL,
+                name_id INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS files_dir_id ON files (dir_id);
+            CREATE INDEX IF NOT EXISTS files_name_id ON files (name_id);
+        """)
+
+        # the directories are few compared to the files, so keep them in memory
+        self.dirs = {}
+        self.children = {}
+        for (dir_id, parent_id, name, mtime_ns) in self.connection.execute(
+                "SELECT id, parent_id, name, mtime_ns FROM dirs"):
+            name = os.fsdecode(name)
+            self.dirs[dir_id] = [parent_id, name, mtime_ns]
+            self.children.setdefault(parent_id, {})[name] = dir_id
+
+    def close(self):
+        self.connection.close()
+
+    def search(self, path, walker, match_name, name_prefix=""):
+        """
+        Brings the index of the directory tree rooted at the given path up to
+        date, then searches it for the filenames for which "match_name" returns
+        a true value, all of which must start with "name_prefix".  Returns a
+        list of (dir_path, matches) tuples, like DirectoryWalker.walk() but
+        without stats, in breadth-first order; the "max_depth", "ignore_dirs"
+        and "num_jobs" of the given walker are honoured, but not its
+        "entry_filter".
+        """
+        root_name = os.path.abspath(path)
+        root_id = self.children.get(None, {}).get(root_name)
+        if root_id is None:
+            root_id = self.add_dir(None, root_name)
 
-def run(match_expr, dir_paths):
-    for dir_path in dir_paths:
-        for (cur_dir_path, dirnames, filenames) in os.walk(dir_path):
-            for filename in filenames:
-                filename_normcase = os.path.normcase(filename)
-                match = match_expr.match(filename_normcase)
-                if match is not None:
-                    cur_path = os.path.join(cur_dir_path, filename)
-                    print(cur_path)
+        if walker.num_jobs <= 1:
+            map_func = map
+            executor = None
+        else:
+            executor = concurrent.futures.ThreadPoolExecutor(walker.num_jobs)
+            map_func = executor.map
+
+        dir_paths = {}
+        try:
+            level = [(root_id, path)]
+            depth = 0
+            while level:
+                dir_paths.update(level)
+                scans = map_func(self.scan_directory,
+                    [(dir_path, self.dirs[dir_id][2]) for (dir_id, dir_path)
+                    in level])
+                descend = walker.max_depth is None or depth < walker.max_depth
+                next_level = []
+                for ((dir_id, dir_path), scan) in zip(level, scans):
+                    if scan is not None:
+                        self.store_dir(dir_id, *scan)
+                    if descend:
+                        for (name, child_id) in self.children.get(dir_id,
+                                {}).items():
+                            if name not in walker.ignore_dirs:
+                                next_level.append((child_id,
+                                    os.path.join(dir_path, name)))
+                level = next_level
+                depth += 1
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+            self.connection.commit()
+
+        return self.find_files(dir_paths, match_name, name_prefix)
+
+    def scan_directory(self, args):
+        """
+        Lists the directory with the given path, whose modification time was
+        recorded as the given value, if it may have changed since.  Returns None
+        if it is known not to have changed, otherwise the tuple
+        (mtime_ns, filenames, subdir_names), where "mtime_ns" is None if the
+        directory could not be listed or was modified too recently.  May be
+        invoked in a worker thread.
+        """
+        (path, mtime_ns) = args
+        if mtime_ns is not None and not self.update:
+            return None
+
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return (None, [], [])
+        if stat.st_mtime_ns == mtime_ns:
+            return None
+
+        listing_time_ns = time.time_ns()
+        filenames = []
+        subdir_names = []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if not is_dir:
+                        filenames.append(entry.name)
+                    elif not entry.is_symlink():
+                        subdir_names.append(entry.name)
+        except OSError:
+            return (None, [], [])
+
+        mtime_ns = stat.st_mtime_ns
+        if listing_time_ns - mtime_ns < self.RACY_NS:
+            mtime_ns = None
+        return (mtime_ns, filenames, subdir_names)
+
+    def add_dir(self, parent_id, name):
+        cursor = self.connection.execute(
+            "INSERT INTO dirs (parent_id, name) VALUES (?, ?)",
+            (parent_id, os.fsencode(name)))
+        dir_id = cursor.lastrowid
+        self.dirs[dir_id] = [parent_id, name, None]
+        self.children.setdefault(parent_id, {})[name] = dir_id
+        return dir_id
+
+    def delete_dir(self, dir_id):
+        """
+        Deletes the directory with the given id and its subdirectories from the
+        index.
+        """
+        pending = [dir_id]
+        dir_ids = []
+        while pending:
+            cur_id = pending.pop()
+            dir_ids.append((cur_id,))
+            pending.extend(self.children.pop(cur_id, {}).values())
+            (parent_id, name, mtime_ns) = self.dirs.pop(cur_id)
+            if cur_id == dir_id:
+                del self.children[parent_id][name]
+
+        self.connection.executemany("DELETE FROM files WHERE dir_id = ?",
+            dir_ids)
+        self.connection.executemany("DELETE FROM dirs WHERE id = ?", dir_ids)
+
+    def store_dir(self, dir_id, mtime_ns, filenames, subdir_names):
+        """
+        Replaces the files and subdirectories of the directory with the given
+        id in the index with those returned by scan_directory().
+        """
+        connection = self.connection
+        self.dirs[dir_id][2] = mtime_ns
+        connection.execute("UPDATE dirs SET mtime_ns = ? WHERE id = ?",
+            (mtime_ns, dir_id))
+
+        connection.execute("DELETE FROM files WHERE dir_id = ?", (dir_id,))
+        encoded_names = [os.fsencode(name) for name in filenames]
+        connection.executemany("INSERT OR IGNORE INTO names (name) VALUES (?)",
+            [(name,) for name in encoded_names])
+        connection.executemany("""
+            INSERT INTO files (dir_id, name_id)
+            SELECT ?, id FROM names WHERE name = ?
+        """, [(dir_id, name) for name in encoded_names])
+
+        children = self.children.get(dir_id, {})
+        subdir_names = set(subdir_names)
+        for (name, child_id) in list(children.items()):
+            if name not in subdir_names:
+                self.delete_dir(child_id)
+        for name in subdir_names:
+            if name not in children:
+                self.add_dir(dir_id, name)
+
+    def find_files(self, dir_paths, match_name, name_prefix):
+        """
+        Returns a list of (dir_path, matches) tuples of the files in the
+        directories whose ids are the keys of "dir_paths", in the order of that
+        dict, whose names match.
+        """
+        connection = self.connection
+        lower_bound = os.fsencode(name_prefix)
+        upper_bound = prefix_upper_bound(lower_bound)
+        if upper_bound is not None:
+            names = connection.execute(
+                "SELECT id, name FROM names WHERE name >= ? AND name < ?",
+                (lower_bound, upper_bound))
+        else:
+            names = connection.execute(
+                "SELECT id, name FROM names WHERE name >= ?", (lower_bound,))
+        name_ids = [(name_id,) for (name_id, name) in names
+            if match_name(os.fsdecode(name))]
+
+        connection.execute("""
+            CREATE TEMPORARY TABLE IF NOT EXISTS matched_names (
+                id INTEGER PRIMARY KEY
+            )
+        """)
+        connection.execute("DELETE FROM matched_names")
+        connection.executemany("INSERT INTO matched_names (id) VALUES (?)",
+            name_ids)
+
+        filenames = {}
+        for (dir_id, name) in connection.execute("""
+                SELECT files.dir_id, names.name
+                FROM matched_names
+                JOIN files ON files.name_id = matched_names.id
+                JOIN names ON names.id = files.name_id
+                ORDER BY files.rowid
+                """):
+            if dir_id in dir_paths:
+                filenames.setdefault(dir_id, []).append((os.fsdecode(name),
+                    None))
+
+        return [(dir_path, filenames[dir_id])
+            for (dir_id, dir_path) in dir_paths.items() if dir_id in filenames]
+
+def prefix_upper_bound(prefix):
+    """
+    Returns the smallest bytes greater than every bytes that starts with the
+    given bytes, or None if there is none, such as for the empty prefix.
+    """
+    prefix = prefix.rstrip(b"\xff")
+    if not prefix:
+        return None
+    return prefix[:-1] + bytes([prefix[-1] + 1])
+
+class BatchWriter(object):
+    """
+    Writes the files found by a search to a binary stream in batches, rather
+    than one write per file.  Subclasses implement format_match().
+    """
+
+    BATCH_SIZE = 1000
+
+    def __init__(self, stream):
+        self.stream = getattr(stream, "buffer", stream)
+        self.chunks = []
+
+    def write_matches(self, dir_path, matches):
+        """
+        Writes the (name, stat) tuples of the files in the directory with the
+        given path returned by DirectoryWalker.walk().
+        """
+        format_match = self.format_match
+        self.chunks.extend(format_match(os.path.join(dir_path, name), stat)
+            for (name, stat) in matches)
+        if len(self.chunks) >= self.BATCH_SIZE:
+            self.flush()
+
+    def format_match(self, path, stat):
+        raise NotImplementedError()
+
+    def flush(self):
+        if self.chunks:
+            self.stream.write(b"".join(self.chunks))
+            self.chunks = []
+        self.stream.flush()
+
+class TextBatchWriter(BatchWriter):
+    """
+    Writes the path of each file on its own line.  Paths that are not valid in
+    the filesystem encoding are written as their original bytes.
+    """
+
+    TERMINATOR = b"\n"
+
+    def format_match(self, path, stat):
+        return os.fsencode(path) + self.TERMINATOR
+
+class NullBatchWriter(TextBatchWriter):
+    """
+    Writes the path of each file followed by a NUL character, like the -print0
+    action of find(1), for xargs -0.
+    """
+
+    TERMINATOR = b"\0"
+
+class NdjsonBatchWriter(BatchWriter):
+    """
+    Writes each file as a JSON object on its own line, with its "path", "type"
+    (one of "file", "directory", "symlink" or "other"), "size" in bytes and
+    "mtime" in seconds since the epoch.
+    """
+
+    def format_match(self, path, stat):
+        # a file that was deleted since it was found is skipped
+        if stat is None:
+            try:
+                stat = os.lstat(path)
+            except OSError:
+                return b""
+        return json.dumps({
+            "path": path,
+            "type": file_type_name(stat.st_mode),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+        }).encode("ascii") + b"\n"
+
+def file_type_name(mode):
+    if S_ISREG(mode):
+        return "file"
+    elif S_ISDIR(mode):
+        return "directory"
+    elif S_ISLNK(mode):
+        return "symlink"
+    else:
+        return "other"
+
+BATCH_WRITER_TYPES = {
+    "text": TextBatchWriter,
+    "null": NullBatchWriter,
+    "ndjson": NdjsonBatchWriter,
+}
+
+def type_size(value):
+    match = re.match(r"([+-]?)([0-9]+)([ckMG]?)\Z", value)
+    if match is None:
+        raise argparse.ArgumentTypeError("invalid size: %s" % value)
+    (sign, number, unit) = match.groups()
+    return (sign, int(number) * SIZE_UNITS[unit])
+
+def type_days(value):
+    match = re.match(r"([+-]?)([0-9]+(?:\.[0-9]*)?)\Z", value)
+    if match is None:
+        raise argparse.ArgumentTypeError("invalid number of days: %s" % value)
+    (sign, number) = match.groups()
+    return (sign, float(number))
+
+def type_non_negative_integer(value):
+    try:
+        int_value = int(value)
+    except ValueError:
+        int_value = -1
+    if int_value < 0:
+        raise argparse.ArgumentTypeError("invalid non-negative integer: %s"
+            % value)
+    return int_value
+
+def type_positive_integer(value):
+    try:
+        int_value = int(value)
+    except ValueError:
+        int_value = 0
+    if int_value <= 0:
+        raise argparse.ArgumentTypeError("invalid positive integer: %s"
+            % value)
+    return int_value
 
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("pattern",
+        nargs="?",
         help="""The pattern of the filename to search for;
-        may contain wildcard characters * and ?"""
+        may contain wildcard characters * and ?; if --pattern is specified
+        then this is instead the first directory to search"""
     )
     parser.add_argument("dir_path",
         nargs="*",
@@ -46,7 +860,110 @@ def parse_args():
         be searched in turn; if not specified, the current directory will
         be searched"""
     )
+    parser.add_argument("-e", "--pattern",
+        dest="patterns",
+        action="append",
+        default=[],
+        metavar="PATTERN",
+        help="""A pattern of the filenames to search for; may be specified more
+        than once, in which case filenames matching any of the patterns are
+        found"""
+    )
+    parser.add_argument("-j", "--jobs",
+        type=type_positive_integer,
+        default=1,
+        help="""The number of threads with which to scan directories
+        concurrently; with more than one, the files in each directory are
+        printed in the order in which the directories' scans complete rather
+        than in the order of os.walk() (default: %(default)s)"""
+    )
+    parser.add_argument("-d", "--max-depth",
+        type=type_non_negative_integer,
+        help="""The maximum number of levels of subdirectories to descend into;
+        0 searches only the given directories themselves (default: no limit)"""
+    )
+    parser.add_argument("-i", "--ignore-dir",
+        dest="ignore_dirs",
+        action="append",
+        default=[],
+        metavar="NAME",
+        help="""The name of a directory whose contents will not be searched;
+        may be specified more than once"""
+    )
+    parser.add_argument("-I", "--ignore-common-dirs",
+        action="store_true",
+        default=False,
+        help="""Do not search the contents of version control and dependency
+        directories: %s""" % ", ".join(DEFAULT_IGNORE_DIRS)
+    )
+    parser.add_argument("-t", "--type",
+        choices=("f", "d", "l"),
+        help="""Only find regular files (f), directories (d) or symbolic links
+        (l); directories are otherwise never found"""
+    )
+    parser.add_argument("-s", "--size",
+        type=type_size,
+        help="""Only find files larger than the given size if it starts with +,
+        smaller than it if it starts with -, or exactly that size otherwise;
+        the size is in bytes, unless followed by k, M or G for KiB, MiB or
+        GiB"""
+    )
+    parser.add_argument("-m", "--mtime",
+        type=type_days,
+        metavar="DAYS",
+        help="""Only find files last modified more than the given number of
+        days ago if it starts with +, less than that if it starts with -, or
+        that number of days ago otherwise; like find(1), the fraction of a day
+        is discarded from the age of each file, so +1 means at least 2 days"""
+    )
+    parser.add_argument("-N", "--newer",
+        metavar="FILE",
+        help="""Only find files modified more recently than the given file"""
+    )
+    parser.add_argument("-o", "--output-format",
+        choices=sorted(BATCH_WRITER_TYPES),
+        default="text",
+        help="""The format in which to print the files found: "text" prints
+        each path on its own line, "null" prints each path followed by a NUL
+        character, for xargs -0, and "ndjson" prints a JSON object with the path,
+        type, size and modification time of each file on its own line (default:
+        %(default)s)"""
+    )
+    parser.add_argument("-Z", "--null",
+        dest="output_format",
+        action="store_const",
+        const="null",
+        help="""Equivalent to --output-format=null"""
+    )
+    parser.add_argument("-x", "--index",
+        dest="index_path",
+        metavar="PATH",
+        help="""The path of an sqlite database in which to index the files of the
+        searched directories, which is created if it does not exist; searches
+        with an index only list the directories that changed since they were
+        last indexed, and print the files of each directory in breadth-first
+        order"""
+    )
+    parser.add_argument("-n", "--no-update",
+        dest="update",
+        action="store_false",
+        default=True,
+        help="""Search the --index as it is, without checking for changes to the
+        directories that it has already indexed"""
+    )
     parsed_args = parser.parse_args()
+    if parsed_args.pattern is not None:
+        if parsed_args.patterns:
+            parsed_args.dir_path.insert(0, parsed_args.pattern)
+        else:
+            parsed_args.patterns.append(parsed_args.pattern)
+    elif not parsed_args.patterns:
+        parser.error("a pattern is required")
+    if not parsed_args.update and parsed_args.index_path is None:
+        parser.error("--no-update requires --index")
+    if parsed_args.index_path is not None and parsed_args.type in ("d", "l"):
+        parser.error("--type %s cannot be used with --index, which only "
+            "indexes the files of directories" % parsed_args.type)
     return parsed_args
 
 if __name__ == "__main__":
@@ -4,10 +4,30 @@ from __future__ import print_function
 
 import atexit
 import argparse
+import bz2
+import collections
+import concurrent.futures
+import functools
+import gzip
+import heapq
+import io
+import itertools
+import lzma
+import operator
 import os
+import pickle
+import queue
+import re
 import sqlite3
 import sys
 import tempfile
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 ####################################################################################################
 
@@ -49,6 +69,23 @@ def parse_args(args=None):
         def error(self, message):
             self.exit(status=2, message=message)
 
+    def fields_arg(value):
+        try:
+            return parse_fields(value)
+        except ValueError:
+            raise argparse.ArgumentTypeError("invalid list of fields: %s" % value)
+
+    def separator_arg(value):
+        if not value:
+            raise argparse.ArgumentTypeError("empty field separator")
+        return value
+
+    def regex_arg(value):
+        try:
+            return re.compile(value.encode("utf8", "surrogateescape"))
+        except re.error as e:
+            raise argparse.ArgumentTypeError("invalid regular expression: %s (%s)" % (value, e))
+
     def file_arg(path):
         if not os.path.exists(path):
             raise argparse.ArgumentTypeError("file not found: %s" % path)
@@ -66,7 +103,8 @@ def parse_args(args=None):
         type=file_arg,
         nargs="*",
         help="The list of files to read and whose frequency to print.  If none are specified " +
-            "the standard input is read.",
+            "the standard input is read.  Files compressed with gzip, bzip2, xz or zstd (which " +
+            "requires the zstandard module) are decompressed while they are read.",
     )
 
     parser.add_argument(
@@ -93,6 +131,64 @@ def parse_args(args=None):
         help="If specified, trim leading and trailing whitespace from lines",
     )
 
+    parser.add_argument(
+        "-f", "--fields",
+        type=fields_arg,
+        default=None,
+        metavar="LIST",
+        help="If specified, count only these fields of each line, like \"cut -f\" and \"awk\".  " +
+            "LIST is a comma-separated list of 1-based field numbers and ranges, such as 1,3-5 " +
+            "or 4-; the selected fields are joined by the field separator",
+    )
+
+    parser.add_argument(
+        "-F", "--field-separator",
+        type=separator_arg,
+        default=None,
+        metavar="SEP",
+        help="The string that separates the fields selected by --fields.  By default, fields " +
+            "are separated by runs of whitespace, like in awk, and are joined by a space",
+    )
+
+    parser.add_argument(
+        "-r", "--regex",
+        type=regex_arg,
+        default=None,
+        metavar="PATTERN",
+        help="If specified, count only the text matched by this regular expression in each " +
+            "line, or by its first group if it has any; lines that do not match are ignored",
+    )
+
+    parser.add_argument(
+        "--mask-timestamps",
+        action="store_true",
+        default=False,
+        help="If specified, replace dates and times, such as those in ISO 8601, syslog and " +
+            "common log formats, with \"<timestamp>\"",
+    )
+
+    parser.add_argument(
+        "--mask-uuids",
+        action="store_true",
+        default=False,
+        help="If specified, replace UUIDs with \"<uuid>\"",
+    )
+
+    parser.add_argument(
+        "--mask-numbers",
+        action="store_true",
+        default=False,
+        help="If specified, replace numbers, including decimal numbers and IP addresses, " +
+            "with \"<num>\"",
+    )
+
+    parser.add_argument(
+        "-l", "--lowercase",
+        action="store_true",
+        default=False,
+        help="If specified, convert lines to lowercase",
+    )
+
     parser.add_argument(
         "-d", "--disk",
         action="store_const",
@@ -103,6 +199,57 @@ def parse_args(args=None):
             "memory; this decreases performance but may fix out-of-memory errors",
     )
 
+    parser.add_argument(
+        "--db",
+        dest="persistent_db_path",
+        default=None,
+        metavar="PATH",
+        help="If specified, store the internal database in this file and keep it; if it already " +
+            "exists, the counts of the lines read are added to the counts already in it.  The " +
+            "database records how much of each file was counted, so that when a file is given " +
+            "again only the complete lines appended to it since are counted, even if it was " +
+            "renamed by log rotation.  The database is indexed by count, so that printing its " +
+            "top lines is fast",
+    )
+
+    parser.add_argument(
+        "-q", "--query",
+        action="store_true",
+        default=False,
+        help="If specified, print the counts already in the --db database without reading any " +
+            "files or the standard input",
+    )
+
+    parser.add_argument(
+        "-s", "--external-sort",
+        action="store_true",
+        default=False,
+        help="If specified, when the lines do not fit in --max-memory, write their counts to " +
+            "sorted temporary files and merge them, instead of moving them into the internal " +
+            "database; this is much faster when there are many more distinct lines than fit in " +
+            "memory",
+    )
+
+    parser.add_argument(
+        "-m", "--max-memory",
+        type=int,
+        default=512,
+        metavar="MB",
+        help="The approximate number of megabytes of memory in which to count lines; when it is " +
+            "exceeded the counts are moved into the internal database, which is much slower to " +
+            "update.  Default: %(default)i",
+    )
+
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=1,
+        help="The number of processes with which to count lines.  If greater than 1, large files " +
+            "are split into chunks, and the chunks of all files are counted concurrently; the " +
+            "standard input is read by this process and counted by the others in batches.  " +
+            "Default: %(default)i",
+    )
+
     parser.add_argument(
         "-a", "--all",
         action="store_const",
@@ -111,16 +258,138 @@ def parse_args(args=None):
         help="Shorthand for \"-n 0\"",
     )
 
-    return parser.parse_args(args)
+    parser.add_argument(
+        "-x", "--approximate",
+        type=int,
+        default=None,
+        metavar="COUNTERS",
+        help="If specified, count lines approximately with the Space-Saving algorithm in a fixed " +
+            "number of counters, instead of counting every distinct line.  Each printed count is " +
+            "followed by the maximum amount by which it may exceed the true count.  Only lines " +
+            "occurring more than 1/COUNTERS of the time are guaranteed to be found.  Requires a " +
+            "positive -n",
+    )
+
+    settings = parser.parse_args(args)
+    if settings.query and settings.persistent_db_path is None:
+        parser.error("--query requires --db")
+    elif settings.query and settings.files:
+        parser.error("--query cannot be used with files")
+    if settings.external_sort and (settings.persistent_db_path is not None or
+            settings.approximate is not None):
+        parser.error("--external-sort cannot be used with --db or --approximate")
+    if settings.approximate is not None and settings.persistent_db_path is not None:
+        parser.error("--approximate cannot be used with --db")
+    elif settings.approximate is not None:
+        if settings.approximate <= 0:
+            parser.error("invalid number of counters: %i" % settings.approximate)
+        elif settings.n <= 0:
+            parser.error("--approximate can only find the most frequent lines; -n must be positive")
+
+    return settings
 
 ####################################################################################################
 
+# the alternatives that start with two digits are factored so that the regular expression engine
+# only tries them once at each position, which makes this about twice as fast
+TIMESTAMP_REGEX = re.compile(
+    br"(?<!\w)(?:\d\d(?:"
+    # ISO 8601 and similar, such as 2024-05-01T12:34:56.789Z and 2024-05-01 12:34:56,789
+    br"\d\d-\d\d-\d\d(?:[T ]\d\d:\d\d(?::\d\d(?:[.,]\d+)?)?(?:Z|[+-]\d\d:?\d\d)?)?"
+    # common log format, such as 01/May/2024:12:34:56 +0000
+    br"|/[A-Z][a-z]{2}/\d{4}:\d\d:\d\d:\d\d(?: [+-]\d{4})?"
+    # a time alone, such as 12:34:56.789
+    br"|:\d\d:\d\d(?:[.,]\d+)?"
+    br")"
+    # syslog, such as May  1 12:34:56
+    br"|[A-Z][a-z]{2} [ \d]\d \d\d:\d\d:\d\d)"
+)
+
+UUID_REGEX = re.compile(
+    br"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}")
+
+# a number that is not part of a word or of a hexadecimal identifier, but may be followed by a unit
+NUMBER_REGEX = re.compile(br"(?<![\w-])\d+(?:\.\d+)*(?=[a-zA-Z]*(?:\W|$))")
+
+def parse_fields(value):
+    """
+    Parses a list of fields for LineFilter, such as "1,3-5,7-".  Returns a list of slice objects
+    of the 0-based indexes of the fields.  Raises ValueError if the given string is invalid.
+    """
+    fields = []
+    for item in value.split(","):
+        (start, dash, stop) = item.partition("-")
+        start = int(start) if start else 1
+        stop = int(stop) if stop else (None if dash else start)
+        if start < 1 or (stop is not None and stop < start):
+            raise ValueError("invalid field range: %s" % item)
+        fields.append(slice(start - 1, stop))
+    return fields
+
 class LineFilter(object):
-    def __init__(self, trim, include_empty):
+    """
+    Normalizes lines before they are counted.  The steps are applied in this order: select fields,
+    extract a regular expression's match, mask timestamps, UUIDs and numbers, convert to
+    lowercase, trim whitespace, and discard empty lines.  When any of the steps before trimming is
+    enabled, the end-of-line characters are removed first.  All regular expressions are compiled
+    once, by __init__() or by the caller.
+    """
+
+    def __init__(self, trim, include_empty, fields=None, field_separator=None, regex=None,
+            mask_timestamps=False, mask_uuids=False, mask_numbers=False, lowercase=False):
+        """
+        Initializes a new instance of LineFilter.  The "fields" parameter may be a list of slice
+        objects returned by parse_fields(), and "field_separator" the string that separates fields,
+        or None for runs of whitespace.  The "regex" parameter may be a compiled bytes regular
+        expression whose match, or first group, to keep.  The other parameters are booleans that
+        enable the corresponding steps.
+        """
         self.trim = trim
         self.include_empty = include_empty
+        self.fields = fields
+        if field_separator is not None:
+            self.field_separator = field_separator.encode("utf8", "surrogateescape")
+            self.field_joiner = self.field_separator
+        else:
+            self.field_separator = None
+            self.field_joiner = b" "
+        self.regex = regex
+        self.regex_group = 1 if regex is not None and regex.groups > 0 else 0
+
+        self.mask_regexes = []
+        if mask_timestamps:
+            self.mask_regexes.append((TIMESTAMP_REGEX, b"<timestamp>"))
+        if mask_uuids:
+            self.mask_regexes.append((UUID_REGEX, b"<uuid>"))
+        if mask_numbers:
+            self.mask_regexes.append((NUMBER_REGEX, b"<num>"))
+
+        self.lowercase = lowercase
+        self.normalize = (fields is not None or regex is not None or len(self.mask_regexes) > 0 or
+            lowercase)
 
     def __call__(self, s):
+        if self.normalize:
+            s = s.rstrip(b"\r\n")
+
+            if self.fields is not None:
+                parts = s.split(self.field_separator)
+                s = self.field_joiner.join(x for field in self.fields for x in parts[field])
+
+            if self.regex is not None:
+                match = self.regex.search(s)
+                if match is None:
+                    return None
+                s = match.group(self.regex_group)
+                if s is None:
+                    return None
+
+            for (regex, replacement) in self.mask_regexes:
+                s = regex.sub(replacement, s)
+
+            if self.lowercase:
+                s = s.lower()
+
         if self.trim:
             s = s.strip()
 
@@ -132,8 +401,21 @@ class LineFilter(object):
 ####################################################################################################
 
 class FreqDb(object):
-    def __init__(self, path):
+
+    FETCH_SIZE = 1000
+    """
+    The number of rows fetched at a time by top().
+    """
+
+    def __init__(self, path, persistent=False):
+        """
+        Initializes a new instance of FreqDb.  The "path" parameter must be a string whose value is
+        the path of the database file, or None to use an in-memory database.  If the "persistent"
+        parameter is True then the database is kept after this application exits, and so is opened
+        safely and maintains indexes of the counts, so that top() need not sort every line.
+        """
         self.path = path
+        self.persistent = persistent
 
     def open(self):
         if self.path is not None:
@@ -144,10 +426,11 @@ class FreqDb(object):
         self.db = sqlite3.connect(db_path)
         self.db.text_factory = str
 
-        # make it faster sine we don't really care about stability of the data
+        # make it faster sine we don't really care about stability of the data, unless it is kept
         cur = self.db.cursor()
-        cur.execute("PRAGMA journal_mode = OFF")
-        cur.execute("PRAGMA synchronous = OFF")
+        if not self.persistent:
+            cur.execute("PRAGMA journal_mode = OFF")
+            cur.execute("PRAGMA synchronous = OFF")
 
         cur.execute(
             """
@@ -158,6 +441,26 @@ class FreqDb(object):
             """
         )
 
+        # an index for each direction of top(), since ties are ordered by ascending rowid in both;
+        # and the manifest of the files counted, so that only the lines appended to them are counted
+        # by subsequent runs
+        if self.persistent:
+            cur.execute("CREATE INDEX IF NOT EXISTS freq_count ON freq (count)")
+            cur.execute("CREATE INDEX IF NOT EXISTS freq_count_desc ON freq (count DESC)")
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS inputs (
+                    device INTEGER NOT NULL,
+                    inode INTEGER NOT NULL,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    offset INTEGER NOT NULL,
+                    prefix BLOB NOT NULL,
+                    PRIMARY KEY (device, inode)
+                )
+                """
+            )
+
         self.db.commit()
 
     def commit(self):
@@ -192,6 +495,61 @@ class FreqDb(object):
                 (line, 1)
             )
 
+    def get_input(self, stat):
+        """
+        Returns the (offset, prefix) recorded by set_input() for the file with the given
+        os.stat_result, or None if there is none.
+        """
+        cur = self.db.cursor()
+        cur.execute(
+            """
+            SELECT offset, prefix
+            FROM inputs
+            WHERE device=? AND inode=?
+            """,
+            (stat.st_dev, stat.st_ino)
+        )
+        row = cur.fetchone()
+        if row is None:
+            return None
+        return (row[0], bytes(row[1]))
+
+    def set_input(self, stat, path, offset, prefix):
+        """
+        Records in the manifest that the lines of the file with the given os.stat_result and path
+        have been counted up to the given byte offset.  The "prefix" parameter must be the bytes at
+        the start of the file, with which to recognize it when its inode is reused.
+        """
+        cur = self.db.cursor()
+        cur.execute(
+            """
+            INSERT OR REPLACE INTO inputs
+            (device, inode, path, size, offset, prefix)
+            VALUES
+            (?, ?, ?, ?, ?, ?)
+            """,
+            (stat.st_dev, stat.st_ino, path, stat.st_size, offset, prefix)
+        )
+
+    def add_counts(self, counts):
+        """
+        Adds counts to the lines in the database.  The "counts" parameter must be an iterable of
+        (line, count) tuples; lines not yet in the database are inserted with the given count, in
+        the order given, and the counts of the others are incremented by the given count.  Using
+        one upsert statement per batch is much faster than calling inc() for each occurrence.
+        """
+        cur = self.db.cursor()
+        cur.executemany(
+            """
+            INSERT INTO freq
+            (line, count)
+            VALUES
+            (?, ?)
+            ON CONFLICT(line) DO UPDATE SET count=count+excluded.count
+            """,
+            counts
+        )
+
     def top(self, n):
         ordering = "DESC" if n >= 0 else "ASC"
         if n > 0:
@@ -203,22 +561,484 @@ class FreqDb(object):
             # there is no upper bound on the number of rows returned
             limit = -1
 
+        # ties are ordered by when the line was first counted, which the indexes of a persistent
+        # database already do
         cur = self.db.cursor()
         cur.execute(
             """
             SELECT line, count
             FROM freq
-            ORDER BY count %s
+            ORDER BY count %s, rowid ASC
             LIMIT %i
             """
             % (ordering, limit)
         )
 
         while True:
-            row = cur.fetchone()
-            if row is None:
+            rows = cur.fetchmany(self.FETCH_SIZE)
+            if not rows:
                 break
-            yield (row[0], row[1])
+            for row in rows:
+                yield (row[0], row[1])
+
+####################################################################################################
+
+class FreqCounter(object):
+    """
+    Counts lines in a dict, which is much faster than updating a FreqDb for each line, and moves the
+    counts into a FreqDb in batches whenever the approximate memory used by the dict exceeds a
+    budget.  This class has the same methods as FreqDb, so it may be used in place of one.  The
+    results are always read from the FreqDb, after moving the remaining counts into it, so that
+    they are ordered exactly as if every line had been counted by FreqDb.inc().
+    """
+
+    ENTRY_OVERHEAD = 100
+    """
+    The approximate number of bytes used by each entry of the dict, in addition to the length of
+    its line: the bytes object, the dict slot and the count.
+    """
+
+    def __init__(self, db, max_bytes):
+        """
+        Initializes a new instance of FreqCounter.  The "db" parameter must be the FreqDb into
+        which to move the counts.  The "max_bytes" parameter must be an int whose value is the
+        approximate number of bytes that the counts may use before they are moved into the FreqDb.
+        """
+        self.db = db
+        self.max_bytes = max_bytes
+        self.counts = {}
+        self.num_bytes = 0
+        self.num_spills = 0
+
+    def open(self):
+        self.db.open()
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def inc(self, line):
+        counts = self.counts
+        try:
+            counts[line] += 1
+        except KeyError:
+            counts[line] = 1
+            self.num_bytes += len(line) + self.ENTRY_OVERHEAD
+            if self.num_bytes > self.max_bytes:
+                self.spill()
+
+    def add_counts(self, counts):
+        counts_dict = self.counts
+        for (line, count) in counts:
+            try:
+                counts_dict[line] += count
+            except KeyError:
+                counts_dict[line] = count
+                self.num_bytes += len(line) + self.ENTRY_OVERHEAD
+                if self.num_bytes > self.max_bytes:
+                    self.spill()
+                    counts_dict = self.counts
+
+    def spill(self):
+        """
+        Moves the counts into the FreqDb.  Lines are inserted in the order in which they were first
+        counted, which keeps the ties in the results in the same order as FreqDb.inc() would.
+        """
+        if self.counts:
+            self.db.add_counts(self.counts.items())
+            self.counts = {}
+            self.num_bytes = 0
+            self.num_spills += 1
+
+    def top(self, n):
+        self.spill()
+        self.db.commit()
+        return self.db.top(n)
+
+####################################################################################################
+
+class ExternalSortCounter(FreqCounter):
+    """
+    Counts lines like FreqCounter, but moves the counts into sorted runs in temporary files rather
+    than into a FreqDb, and merges the runs to produce the results.  The runs are written and read
+    sequentially, which is much faster than updating a B-tree on disk once per distinct line when
+    the distinct lines do not fit in memory.
+    Each run holds (line, count, sequence) records sorted by line, where the sequence numbers
+    increase in the order in which lines were first counted; so merging the runs yields the exact
+    count and first occurrence of each line, and ties in the results are ordered exactly as by
+    FreqDb.top().
+    """
+
+    BLOCK_SIZE = 10000
+    """
+    The number of records pickled together in a run file.
+    """
+
+    MIN_RUN_BYTES = 16 * 1024 * 1024
+    """
+    The minimum approximate number of bytes of counts in each run, however small the memory budget,
+    so that the runs are not too many to merge efficiently.
+    """
+
+    MAX_MERGE_RUNS = 64
+    """
+    The maximum number of runs merged at once; when there are more, groups of them are first merged
+    into larger runs, so that the number of open files stays bounded.
+    """
+
+    def __init__(self, max_bytes):
+        """
+        Initializes a new instance of ExternalSortCounter.  The "max_bytes" parameter is the same as
+        for FreqCounter, except that it is at least MIN_RUN_BYTES.
+        """
+        FreqCounter.__init__(self, None, max(max_bytes, self.MIN_RUN_BYTES))
+        self.num_spilled_lines = 0
+        self.run_paths = []
+
+    def open(self):
+        pass
+
+    def commit(self):
+        pass
+
+    def close(self):
+        for path in self.run_paths:
+            safe_delete(path)
+        self.run_paths = []
+
+    def spill(self):
+        """
+        Writes the counts to a new run, sorted by line.
+        """
+        if self.counts:
+            base = self.num_spilled_lines
+            records = sorted((line, count, base + i)
+                for (i, (line, count)) in enumerate(self.counts.items()))
+            self.num_spilled_lines += len(self.counts)
+            self.counts = {}
+            self.num_bytes = 0
+            self.num_spills += 1
+            self.run_paths.append(self.write_run(records))
+
+    def write_run(self, records):
+        """
+        Writes records from an iterable, which must already be sorted, to a new temporary file.
+        Returns the path of the file, which is deleted by close(), or when this script exits.
+        """
+        path = create_temp_file()
+        try:
+            with open(path, "wb") as f:
+                records = iter(records)
+                while True:
+                    block = list(itertools.islice(records, self.BLOCK_SIZE))
+                    if not block:
+                        break
+                    pickle.dump(block, f, pickle.HIGHEST_PROTOCOL)
+        except IOError as e:
+            safe_delete(path)
+            raise GeneralException("unable to write temporary file: %s (%s)" % (path, e.strerror))
+        return path
+
+    @staticmethod
+    def read_run(path):
+        """
+        A generator that returns the records of a run written by write_run().
+        """
+        try:
+            with open(path, "rb") as f:
+                while True:
+                    try:
+                        block = pickle.load(f)
+                    except EOFError:
+                        break
+                    for record in block:
+                        yield record
+        except IOError as e:
+            raise GeneralException("unable to read temporary file: %s (%s)" % (path, e.strerror))
+
+    def merge_runs(self):
+        """
+        A generator that merges the runs and returns their records in sorted order.
+        """
+        while len(self.run_paths) > self.MAX_MERGE_RUNS:
+            paths = self.run_paths[:self.MAX_MERGE_RUNS]
+            merged_path = self.write_run(heapq.merge(*[self.read_run(x) for x in paths]))
+            self.run_paths = self.run_paths[self.MAX_MERGE_RUNS:] + [merged_path]
+            for path in paths:
+                safe_delete(path)
+
+        return heapq.merge(*[self.read_run(path) for path in self.run_paths])
+
+    def iter_lines(self):
+        """
+        Merges the runs of lines.  Returns a generator of the (line, count, sequence) of each
+        distinct line, in order of line, with its total count and the sequence of its first
+        occurrence.
+        """
+        return self.combine_lines(self.merge_runs())
+
+    @staticmethod
+    def combine_lines(records):
+        """
+        A generator that combines (line, count, sequence) records sorted by line into one record per
+        distinct line, as described for iter_lines().
+        """
+        for (line, records) in itertools.groupby(records, key=operator.itemgetter(0)):
+            count = 0
+            sequence = None
+            for (_, run_count, run_sequence) in records:
+                count += run_count
+                if sequence is None or run_sequence < sequence:
+                    sequence = run_sequence
+            yield (line, count, sequence)
+
+    def sort_by_count(self, records):
+        """
+        Sorts (line, count, sequence) records by descending count and then by sequence, in runs of
+        at most the memory budget that replace the runs of lines.  Returns a generator of the sorted
+        records.
+        """
+        line_run_paths = self.run_paths
+        self.run_paths = []
+        try:
+            batch = []
+            num_bytes = 0
+            for (line, count, sequence) in records:
+                batch.append((-count, sequence, line))
+                num_bytes += len(line) + self.ENTRY_OVERHEAD
+                if num_bytes > self.max_bytes:
+                    batch.sort()
+                    self.run_paths.append(self.write_run(batch))
+                    batch = []
+                    num_bytes = 0
+            if batch:
+                batch.sort()
+                self.run_paths.append(self.write_run(batch))
+        finally:
+            for path in line_run_paths:
+                safe_delete(path)
+
+        return ((line, -negative_count, sequence)
+            for (negative_count, sequence, line) in self.merge_runs())
+
+    def top(self, n):
+        # if no run was written then every count is still in memory and is sorted there; the
+        # sequence numbers are the order in which the lines were first counted, just as in a run
+        if self.run_paths:
+            self.spill()
+            lines = self.iter_lines()
+        else:
+            lines = ((line, count, sequence)
+                for (sequence, (line, count)) in enumerate(self.counts.items()))
+
+        if n > 0:
+            records = heapq.nsmallest(n, lines, key=lambda x: (-x[1], x[2]))
+        elif n < 0:
+            records = heapq.nsmallest(-n, lines, key=lambda x: (x[1], x[2]))
+        elif self.run_paths:
+            records = self.sort_by_count(lines)
+        else:
+            records = sorted(lines, key=lambda x: (-x[1], x[2]))
+        return ((line, count) for (line, count, sequence) in records)
+
+####################################################################################################
+
+InputRange = collections.namedtuple("InputRange", "path, stat, start, end, prefix, compression")
+"""
+The range of bytes of a file to count, as planned by InputManifest.plan().
+"""
+
+class InputManifest(object):
+    """
+    Makes the counting of files into a persistent FreqDb incremental, by recording in the database
+    how much of each file has been counted, so that only the lines appended to a file since are
+    counted again.  Files are identified by device and inode, so that a log file that is renamed by
+    rotation is still recognized, and by the bytes at their start, so that a new file reusing the
+    inode of a deleted one is counted from the start.  A file that shrank is assumed to have been
+    truncated and is also counted from the start.  Only complete lines are counted; a partial line
+    at the end of a file is counted once it is terminated.  Compressed files cannot be resumed, so
+    they are counted in full if they were not counted before; one whose size changed since it was
+    counted is skipped with a warning, since counting it again would count its old lines twice.
+    """
+
+    PREFIX_SIZE = 256
+    """
+    The maximum number of bytes at the start of a file with which to recognize it.
+    """
+
+    def __init__(self, results):
+        """
+        Initializes a new instance of InputManifest.  The "results" parameter must be the
+        FreqCounter of the persistent FreqDb in which the manifest is recorded.
+        """
+        self.results = results
+
+        # the (offset, prefix) of each file planned by this run, by device and inode, which with
+        # freq_parallel() may be planned again before it is finished and recorded in the database
+        self.planned = {}
+
+    def plan(self, path):
+        """
+        Returns the InputRange of a file to count, or None if it is not a regular file, such as
+        when "path" is None for the standard input, in which case all of it must be counted.
+        Raises GeneralException on error.
+        """
+        if path is None or not os.path.isfile(path):
+            return None
+
+        try:
+            with open(path, "rb") as f:
+                stat = os.fstat(f.fileno())
+                compression = detect_compression(f.read(MAGIC_SIZE))
+                f.seek(0)
+                start = 0
+                key = (stat.st_dev, stat.st_ino)
+                recorded = self.planned.get(key)
+                if recorded is None:
+                    recorded = self.results.db.get_input(stat)
+                if recorded is not None:
+                    (offset, prefix) = recorded
+                    if f.read(len(prefix)) != prefix:
+                        # a new file reusing the inode of a deleted one
+                        recorded = None
+                if compression is None:
+                    if recorded is not None and offset <= stat.st_size:
+                        start = offset
+                    end = find_last_line_end(f, start, stat.st_size)
+                elif recorded is None:
+                    end = stat.st_size
+                else:
+                    if offset != stat.st_size:
+                        print("WARNING: skipping compressed file that changed since it was " +
+                            "counted: %s" % path, file=sys.stderr)
+                    start = end = offset
+                f.seek(0)
+                prefix = f.read(min(end, self.PREFIX_SIZE))
+                self.planned[key] = (end, prefix)
+        except IOError as e:
+            raise GeneralException("unable to read file: %s (%s)" % (path, e.strerror))
+
+        return InputRange(os.path.abspath(path), stat, start, end, prefix, compression)
+
+    def finish(self, input_range):
+        """
+        Records that the given InputRange, returned by plan(), has been counted.  The counts are
+        moved into the database and committed along with the manifest, so that an interrupted run
+        never leaves a file partially counted.
+        """
+        self.results.spill()
+        self.results.db.set_input(input_range.stat, input_range.path, input_range.end,
+            input_range.prefix)
+        self.results.commit()
+
+def find_last_line_end(f, start, end):
+    """
+    Returns the offset of the byte after the last newline between the offsets "start" and "end" of
+    the given binary file, or "start" if there is none.
+    """
+    block_size = 65536
+    while end > start:
+        block_start = max(start, end - block_size)
+        f.seek(block_start)
+        block = f.read(end - block_start)
+        index = block.rfind(b"\n")
+        if index >= 0:
+            return block_start + index + 1
+        end = block_start
+    return start
+
+####################################################################################################
+
+class SpaceSavingCounter(object):
+    """
+    Counts lines approximately with the Space-Saving algorithm, in a fixed number of counters.  When
+    all counters are in use, an unmonitored line replaces the line with the smallest count and
+    inherits that count as its error.  Every count overestimates the true count by at most its
+    error, which is at most the total number of lines divided by the number of counters; so every
+    line that occurs more often than that is monitored.  This class has the same methods as FreqDb,
+    so it may be used in place of one, except that top() only supports a positive "n" and returns
+    the errors of the counts as well.
+    """
+
+    def __init__(self, capacity):
+        """
+        Initializes a new instance of SpaceSavingCounter.  The "capacity" parameter must be an int
+        whose value is the number of counters.
+        """
+        self.capacity = capacity
+        self.counts = {}
+        self.num_lines = 0
+
+        # the heap has one (count, sequence, line) entry per monitored line, whose count may be
+        # less than the current count; it is corrected when the entry reaches the top of the heap,
+        # which is much cheaper than updating the heap on every increment
+        self.heap = []
+        self.sequence = itertools.count()
+
+    def open(self):
+        pass
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+    def inc(self, line):
+        self.add(line, 1)
+
+    def add_counts(self, counts):
+        for (line, count) in counts:
+            self.add(line, count)
+
+    def add(self, line, count):
+        """
+        Adds the given count to a line.
+        """
+        self.num_lines += count
+        counts = self.counts
+        entry = counts.get(line)
+        if entry is not None:
+            entry[0] += count
+            return
+
+        heap = self.heap
+        if len(counts) < self.capacity:
+            error = 0
+        else:
+            while True:
+                (min_count, sequence, min_line) = heap[0]
+                actual_count = counts[min_line][0]
+                if actual_count == min_count:
+                    break
+                heapq.heapreplace(heap, (actual_count, sequence, min_line))
+            heapq.heappop(heap)
+            del counts[min_line]
+            error = min_count
+
+        counts[line] = [error + count, error]
+        heapq.heappush(heap, (error + count, next(self.sequence), line))
+
+    def max_error(self):
+        """
+        Returns the maximum error of any count, which is the smallest count if all counters are in
+        use and zero otherwise.
+        """
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(entry[0] for entry in self.counts.values())
+
+    def top(self, n):
+        """
+        Returns the (line, count, error) tuples of the "n" lines with the largest counts, which must
+        be positive, in descending order of count.
+        """
+        if n <= 0:
+            raise ValueError("only a positive n is supported: %i" % n)
+        items = heapq.nlargest(n, self.counts.items(), key=lambda x: x[1][0])
+        return [(line, count, error) for (line, (count, error)) in items]
 
 ####################################################################################################
 
@@ -241,14 +1061,16 @@ def iter_paths(paths):
 
 def open_file(path):
     """
-    Opens a file for reading in text mode.  The "path" parameter must be a string whose value is the
-    path of the file to open; if None then sys.stdin is returned as the file.  Returns the tuple
-    (f, close_enabled) where "f" is an open file object and "close_enabled" is a boolean that
-    indicates whether or not the caller is responsible for closing the file object.  Raises
-    GeneralException on error.
+    Opens a file for reading in binary mode.  The "path" parameter must be a string whose value is
+    the path of the file to open; if None then sys.stdin is returned as the file.  If the file is
+    compressed, as detected by detect_compression(), then the returned file object decompresses it
+    on a background thread.  Returns the tuple (f, close_enabled) where "f" is an open file object
+    and "close_enabled" is a boolean that indicates whether or not the caller is responsible for
+    closing the file object.  Raises GeneralException on error.
     """
     if path is None:
-        f = sys.stdin
+        # read bytes, like from the other files, rather than decoded text
+        f = getattr(sys.stdin, "buffer", sys.stdin)
         close_enabled = False
     else:
         close_enabled = True
@@ -258,10 +1080,179 @@ def open_file(path):
             raise GeneralException("unable to open file for reading: %s (%s)" %
                 (path, e.strerror))
 
+    try:
+        peek = getattr(f, "peek", None)
+        compression = detect_compression(peek(MAGIC_SIZE)) if peek is not None else None
+        if compression is not None:
+            name = path if path is not None else "<stdin>"
+            f = BackgroundReader(open_decompressor(f, compression, name), name,
+                source=(f if close_enabled else None))
+            f = io.BufferedReader(f, BackgroundReader.BLOCK_SIZE)
+            close_enabled = True
+    except BaseException:
+        if close_enabled:
+            f.close()
+        raise
+
     return (f, close_enabled)
 
 ####################################################################################################
 
+MAGIC_NUMBERS = (
+    (b"\x1f\x8b", "gzip"),
+    (b"BZh", "bz2"),
+    (b"\xfd7zXZ\x00", "xz"),
+    (b"\x28\xb5\x2f\xfd", "zstd"),
+)
+"""
+The magic numbers at the start of compressed files, and the names of their compression formats.
+"""
+
+MAGIC_SIZE = max(len(magic) for (magic, compression) in MAGIC_NUMBERS)
+
+DECOMPRESSION_ERRORS = (IOError, EOFError, lzma.LZMAError, zlib.error) + \
+    ((zstandard.ZstdError,) if zstandard is not None else ())
+"""
+The exceptions that reading a file, or decompressing it, may raise for a corrupt or truncated file.
+"""
+
+def detect_compression(data):
+    """
+    Returns the name of the compression format of a file from the bytes at its start, or None if it
+    is not compressed in a supported format.
+    """
+    for (magic, compression) in MAGIC_NUMBERS:
+        if data.startswith(magic):
+            return compression
+    return None
+
+def file_compression(path):
+    """
+    Returns the name of the compression format of the file with the given path, as detected by
+    detect_compression().  Raises GeneralException on error.
+    """
+    try:
+        with open(path, "rb") as f:
+            return detect_compression(f.read(MAGIC_SIZE))
+    except IOError as e:
+        raise GeneralException("unable to read file: %s (%s)" % (path, e.strerror))
+
+def open_decompressor(f, compression, name):
+    """
+    Returns a binary file object that reads the decompressed data of the given binary file object,
+    which is compressed in the format named by detect_compression().  Multi-member gzip files,
+    multi-stream bz2 and xz files, and zstd files of multiple frames are read in full.  Closing the
+    returned file object does not close "f".  Raises GeneralException on error.
+    """
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=f, mode="rb")
+    elif compression == "bz2":
+        return bz2.BZ2File(f, "rb")
+    elif compression == "xz":
+        return lzma.LZMAFile(f, "rb")
+    elif compression == "zstd":
+        if zstandard is None:
+            raise GeneralException("unable to decompress zstd file: %s (the zstandard module is "
+                "not installed)" % name)
+        return zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True,
+            closefd=False)
+    else:
+        raise ValueError("unknown compression: %s" % compression)
+
+class BackgroundReader(io.RawIOBase):
+    """
+    A binary file object that reads another one on a background thread, a block at a time, so that
+    decompressing a file, which releases the GIL, overlaps with counting its lines.  At most
+    MAX_PENDING_BLOCKS blocks are read ahead.
+    """
+
+    BLOCK_SIZE = 1024 * 1024
+    """
+    The number of bytes read from the other file object at a time.
+    """
+
+    MAX_PENDING_BLOCKS = 8
+    """
+    The maximum number of blocks read by the background thread that have not yet been consumed.
+    """
+
+    def __init__(self, f, name, source=None):
+        """
+        Initializes a new instance of BackgroundReader and starts its background thread.  The "f"
+        parameter must be the binary file object to read, and "name" the name of the file with
+        which to report errors.  The "source" parameter may be another file object to close along
+        with "f", such as the compressed file that it decompresses.
+        """
+        io.RawIOBase.__init__(self)
+        self.f = f
+        self.name = name
+        self.source = source
+        self.blocks = queue.Queue(self.MAX_PENDING_BLOCKS)
+        self.block = memoryview(b"")
+        self.eof = False
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="BackgroundReader")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        try:
+            while True:
+                block = self.f.read(self.BLOCK_SIZE)
+                if not self.put(block) or not block:
+                    break
+        except DECOMPRESSION_ERRORS as e:
+            self.put(GeneralException("unable to decompress file: %s (%s)" % (self.name, e)))
+        except Exception as e:
+            self.put(e)
+
+    def put(self, item):
+        """
+        Puts an item into the queue of blocks, waiting while it is full.  Returns False if close()
+        was invoked while waiting, in which case the item was discarded; otherwise, returns True.
+        """
+        while not self.stopping.is_set():
+            try:
+                self.blocks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while len(self.block) == 0:
+            if self.eof:
+                return 0
+            item = self.blocks.get()
+            if isinstance(item, Exception):
+                self.eof = True
+                raise item
+            elif not item:
+                self.eof = True
+                return 0
+            self.block = memoryview(item)
+
+        count = min(len(b), len(self.block))
+        b[:count] = self.block[:count]
+        self.block = self.block[count:]
+        return count
+
+    def close(self):
+        if not self.closed:
+            self.stopping.set()
+            self.thread.join()
+            try:
+                self.f.close()
+            finally:
+                if self.source is not None:
+                    self.source.close()
+        io.RawIOBase.close(self)
+
+####################################################################################################
+
 def safe_delete(path):
     """
     Attempts to delete a file, printing a warning message to stderr on failure.  The "path"
@@ -280,13 +1271,21 @@ def create_temp_file():
     string whose value is the path to the newly-created temporary file.
     """
     (handle, path) = tempfile.mkstemp()
-    atexit.register(safe_delete, path)
+    atexit.register(delete_temp_file, path)
     os.close(handle)
     return path
 
+def delete_temp_file(path):
+    """
+    Deletes a temporary file created by create_temp_file() when this script exits, unless it was
+    already deleted, such as by ExternalSortCounter.close().
+    """
+    if os.path.lexists(path):
+        safe_delete(path)
+
 ####################################################################################################
 
-def freq_path(path, results, line_filter):
+def freq_path(path, results, line_filter, manifest=None):
     """
     Reads a file for storing the frequency of line occurrences.  The "path" parameter must be a
     string whose value is the path of the file to open.  If an error occurs opening or reading from
@@ -296,19 +1295,156 @@ def freq_path(path, results, line_filter):
     that will be specified each line as a string; if it returns None then the line will be
     discarded; otherwise, the returned string will be used as the line's value; may be None to
     perform no filtering.
+    The lines are counted in chunks by the tasks from iter_count_tasks(), so that only the distinct
+    lines of each chunk are added to "results", rather than every line.  The "manifest" parameter
+    may be an InputManifest with which to count only the lines not already counted; may be None to
+    count all lines.
+    """
+    input_range = manifest.plan(path) if manifest is not None else None
+    for (func, args) in iter_count_tasks(path, line_filter, input_range):
+        results.add_counts(func(*args).items())
+
+    if input_range is not None:
+        manifest.finish(input_range)
+    results.commit()
+
+####################################################################################################
+
+CHUNK_SIZE = 32 * 1024 * 1024
+"""
+The approximate number of bytes of a regular file counted by each task from iter_count_tasks().
+"""
+
+STDIN_BATCH_SIZE = 65536
+"""
+The number of lines of the standard input, or of another file that is not a regular file, counted
+by each task from iter_count_tasks().
+"""
+
+def count_lines(lines, line_filter):
+    """
+    Counts the lines from the given iterable.  The "line_filter" parameter is the same as for
+    freq_path().  Returns a dict that maps each line to its count, whose keys are in the order in
+    which the lines first occurred.
+    """
+    if line_filter is not None:
+        lines = filter(functools.partial(operator.is_not, None), map(line_filter, lines))
+    return collections.Counter(lines)
+
+def count_chunk(path, start, end, line_filter):
+    """
+    Counts the lines in a byte range of a file.  The "start" and "end" parameters must be ints whose
+    values are the offsets of the first byte and of the byte after the last byte of the range,
+    which must both be at the start of a line.  Returns the same as count_lines().  Raises
+    GeneralException if reading the file fails.
     """
-    (f, close_enabled) = open_file(path)
     try:
-        for line in f:
-            if line_filter is not None:
-                line = line_filter(line)
+        with open(path, "rb") as f:
+            f.seek(start)
+            data = f.read(end - start)
+    except IOError as e:
+        raise GeneralException("unable to read file: %s (%s)" % (path, e.strerror))
+    return count_lines(io.BytesIO(data), line_filter)
+
+def iter_count_tasks(path, line_filter, input_range=None):
+    """
+    A generator that splits the counting of the lines of a file into tasks, each of which is a
+    tuple (func, args) where "func" is count_chunk() or count_lines() and "args" is the tuple of
+    arguments with which to invoke it.  Uncompressed regular files are split into chunks by
+    split_file() and read by the tasks themselves; other files, including compressed files and the
+    standard input if "path" is None, are read by this generator in batches of lines.  If
+    "input_range" is not None then it must be the InputRange of the regular file to count.  Raises
+    GeneralException on error.
+    """
+    if input_range is not None:
+        if input_range.compression is None:
+            ranges = split_file(path, CHUNK_SIZE, input_range.start, input_range.end)
+        elif input_range.start == input_range.end:
+            # the compressed file was already counted
+            return
+        else:
+            ranges = None
+    elif path is not None and os.path.isfile(path) and file_compression(path) is None:
+        ranges = split_file(path, CHUNK_SIZE)
+    else:
+        ranges = None
+
+    if ranges is not None:
+        for (start, end) in ranges:
+            yield (count_chunk, (path, start, end, line_filter))
+        return
 
-            if line is not None:
-                results.inc(line)
+    (f, close_enabled) = open_file(path)
+    try:
+        while True:
+            lines = list(itertools.islice(f, STDIN_BATCH_SIZE))
+            if not lines:
+                break
+            yield (count_lines, (lines, line_filter))
     finally:
         if close_enabled:
             f.close()
 
+def split_file(path, chunk_size, start=0, size=None):
+    """
+    Splits a file into byte ranges of about the given size that start and end on line boundaries.
+    The "start" and "size" parameters may be the offsets of the first byte and of the byte after the
+    last byte of the part of the file to split, which must both be at the start of a line; by
+    default the whole file is split.  Returns a list of (start, end) tuples.  Raises
+    GeneralException on error.
+    """
+    ranges = []
+    try:
+        with open(path, "rb") as f:
+            if size is None:
+                size = os.fstat(f.fileno()).st_size
+            while start < size:
+                # the range ends after the line containing its nominal end
+                f.seek(start + chunk_size)
+                f.readline()
+                end = min(f.tell(), size)
+                ranges.append((start, end))
+                start = end
+    except IOError as e:
+        raise GeneralException("unable to read file: %s (%s)" % (path, e.strerror))
+    return ranges
+
+def freq_parallel(paths, results, line_filter, num_jobs, manifest=None):
+    """
+    Does the same as invoking freq_path() for each of the given paths, but counts the lines in
+    "num_jobs" worker processes, which run the tasks from iter_count_tasks().  The counts of the
+    tasks are added to "results" in the order in which they occur in the input, so that ties in the
+    results are ordered exactly as with freq_path().
+    """
+    max_pending = 2 * num_jobs
+    with concurrent.futures.ProcessPoolExecutor(num_jobs) as executor:
+        # the futures of the tasks, and the functions with which to finish each file after the
+        # counts of its tasks are added
+        pending = collections.deque()
+
+        def finish_oldest():
+            item = pending.popleft()
+            if callable(item):
+                item()
+            else:
+                results.add_counts(item.result().items())
+
+        def submit(*args):
+            pending.append(executor.submit(*args))
+            while len(pending) > max_pending or \
+                    (pending and (callable(pending[0]) or pending[0].done())):
+                finish_oldest()
+
+        for path in paths:
+            input_range = manifest.plan(path) if manifest is not None else None
+            for (func, args) in iter_count_tasks(path, line_filter, input_range):
+                submit(func, *args)
+            if input_range is not None:
+                pending.append(functools.partial(manifest.finish, input_range))
+
+        while pending:
+            finish_oldest()
+
     results.commit()
 
 ####################################################################################################
@@ -333,14 +1469,16 @@ def print_freq(results, n):
     if encoding is None:
         encoding = sys.getdefaultencoding()
 
-    for (line, count) in results.top(n):
-        line = line.decode(encoding, errors="replace")
+    for row in results.top(n):
+        line = row[0].decode(encoding, errors="replace")
         line = strip_eol(line)
-        print("%i %s" % (count, line), file=f)
+        counts = " ".join("%i" % x for x in row[1:])
+        print("%s %s" % (counts, line), file=f)
 
 ####################################################################################################
 
-def freq(paths, db_path, n, line_filter):
+def freq(paths, db_path, n, line_filter, max_bytes, num_jobs=1, approximate=None,
+        persistent=False, external_sort=False):
     """
     Reads the paths from the given list of paths and prints the most-frequently-occuring lines.
     The "paths" parameter must be an iterable that returns strings.  For each string returned that
@@ -349,17 +1487,47 @@ def freq(paths, db_path, n, line_filter):
     printed; if less than zero then the bottom -n lines are printed; otherwise, all distinct lines
     are printed.  The "line_filter" parameter must be a function that will be specified each line
     as a string; if it returns None then the line will be discarded; otherwise, the returned string
-    will be used as the line's value; may be None to perform no filtering.  Raises GeneralException
-    on error.
+    will be used as the line's value; may be None to perform no filtering.  The "max_bytes"
+    parameter must be an int whose value is the approximate number of bytes of memory in which to
+    count lines before moving their counts into the database.  If the "num_jobs" parameter is
+    greater than 1 then the lines are counted by that many worker processes.  If the "approximate"
+    parameter is not None then it must be the number of counters of a SpaceSavingCounter with which
+    to count lines approximately, in which case "n" must be positive.  If the "persistent"
+    parameter is True then the database at "db_path" is kept, and the lines read are added to the
+    counts already in it; the lines of regular files that were already counted into it are not
+    counted again, as described by InputManifest.  If the "external_sort" parameter is True then the
+    lines are counted by an ExternalSortCounter instead of in the database.  Raises
+    GeneralException on error.
     """
-    results = FreqDb(db_path)
+    if approximate is not None:
+        results = SpaceSavingCounter(approximate)
+    elif external_sort:
+        results = ExternalSortCounter(max_bytes)
+    else:
+        results = FreqCounter(FreqDb(db_path, persistent), max_bytes)
 
-    results.open()
     try:
-        for path in paths:
-            freq_path(path, results, line_filter)
+        results.open()
+    except sqlite3.Error as e:
+        raise GeneralException("unable to open database: %s (%s)" % (db_path, e))
+    try:
+        if persistent and approximate is None:
+            manifest = InputManifest(results)
+        else:
+            manifest = None
+
+        if num_jobs > 1:
+            freq_parallel(paths, results, line_filter, num_jobs, manifest)
+        else:
+            for path in paths:
+                freq_path(path, results, line_filter, manifest)
         results.commit()
         print_freq(results, n)
+        if approximate is not None:
+            print(("Counted %i lines approximately; each count exceeds the true count by at " +
+                "most %i") % (results.num_lines, results.max_error()), file=sys.stderr)
+    except sqlite3.Error as e:
+        raise GeneralException("database error: %s (%s)" % (db_path, e))
     finally:
         results.close()
 
@@ -370,11 +1538,29 @@ def main():
     The main method for this application.
     """
     settings = parse_args()
-    paths = iter_paths(settings.files)
-    db_path = settings.db_path
+    if settings.query:
+        paths = ()
+    else:
+        paths = iter_paths(settings.files)
+    if settings.persistent_db_path is not None:
+        db_path = settings.persistent_db_path
+    else:
+        db_path = settings.db_path
     n = settings.n
-    line_filter = LineFilter(settings.trim, settings.include_empty_lines)
-    freq(paths, db_path, n, line_filter)
+    line_filter = LineFilter(
+        trim=settings.trim,
+        include_empty=settings.include_empty_lines,
+        fields=settings.fields,
+        field_separator=settings.field_separator,
+        regex=settings.regex,
+        mask_timestamps=settings.mask_timestamps,
+        mask_uuids=settings.mask_uuids,
+        mask_numbers=settings.mask_numbers,
+        lowercase=settings.lowercase,
+    )
+    max_bytes = settings.max_memory * 1024 * 1024
+    freq(paths, db_path, n, line_filter, max_bytes, settings.jobs, settings.approximate,
+        settings.persistent_db_path is not None, settings.external_sort)
 
 ####################################################################################################
 
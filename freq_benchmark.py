@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+
+####################################################################################################
+# freq_benchmark.py
+#
+# Benchmarks for the ways in which freq.py can read, normalize and count the lines of a file.
+#
+####################################################################################################
+
+"""
+Benchmarks the ways in which freq.py can read, normalize and count the lines of a file.
+"""
+
+import argparse
+import mmap
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+import freq
+
+####################################################################################################
+
+def create_synthetic_file(path, size, num_distinct, seed):
+    """
+    Creates a file of about "size" bytes of lines chosen from "num_distinct" distinct lines, with a
+    skewed distribution like that of a log file.
+    """
+    rng = random.Random(seed)
+    lines = [b"GET /path/%i/resource?id=%i HTTP/1.1\n" % (i, i * 7919) for i in range(num_distinct)]
+    weights = [1.0 / (i + 1) for i in range(num_distinct)]
+    with open(path, "wb") as f:
+        written = 0
+        while written < size:
+            block = b"".join(rng.choices(lines, weights, k=10000))
+            f.write(block)
+            written += len(block)
+
+def create_synthetic_log(path, size, seed):
+    """
+    Creates a log file of about "size" bytes whose lines differ only by timestamps, UUIDs and
+    numbers, so that normalizing them leaves few distinct lines.
+    """
+    rng = random.Random(seed)
+    levels = ("INFO", "INFO", "INFO", "WARN", "ERROR")
+    methods = ("GET", "GET", "POST", "DELETE")
+    resources = ("users", "orders", "items", "carts")
+    with open(path, "wb") as f:
+        written = 0
+        while written < size:
+            lines = []
+            for i in range(10000):
+                lines.append(b"2024-05-%02iT%02i:%02i:%02i.%03iZ %s %s /%s/%i id=%s took %ims from "
+                    b"10.0.%i.%i\n" % (rng.randint(1, 31), rng.randint(0, 23), rng.randint(0, 59),
+                    rng.randint(0, 59), rng.randint(0, 999), rng.choice(levels).encode(),
+                    rng.choice(methods).encode(), rng.choice(resources).encode(),
+                    rng.randint(1, 100000), str(uuid.UUID(int=rng.getrandbits(128))).encode(),
+                    rng.randint(1, 2000), rng.randint(0, 255), rng.randint(0, 255)))
+            block = b"".join(lines)
+            f.write(block)
+            written += len(block)
+
+####################################################################################################
+
+def count_with_lines(path):
+    """
+    Counts lines the way freq_path() originally read them: iterating the file, which allocates a
+    bytes object per line, and counting each one with FreqCounter.inc().
+    """
+    results = freq.FreqCounter(None, max_bytes=float("inf"))
+    with open(path, "rb") as f:
+        for line in f:
+            results.inc(line)
+    return results.counts
+
+def count_with_memoryview(path):
+    """
+    Counts lines by scanning a memory-mapped file for newlines and looking up each line as a
+    memoryview slice of the mapping, so that a bytes object is only created for distinct lines.
+    """
+    counts = {}
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            view = memoryview(m)
+            find = m.find
+            size = len(m)
+            start = 0
+            line = None
+            try:
+                while start < size:
+                    end = find(b"\n", start)
+                    end = size if end < 0 else end + 1
+                    line = view[start:end]
+                    try:
+                        counts[line] += 1
+                    except KeyError:
+                        counts[bytes(line)] = 1
+                    start = end
+            finally:
+                # the mapping cannot be closed while slices of it exist
+                del line
+                view.release()
+    return counts
+
+def count_with_chunks(path):
+    """
+    Counts lines the way freq_path() does, in chunks counted by collections.Counter.
+    """
+    results = freq.FreqCounter(None, max_bytes=float("inf"))
+    for (func, args) in freq.iter_count_tasks(path, None):
+        results.add_counts(func(*args).items())
+    return results.counts
+
+READERS = (
+    ("lines", count_with_lines),
+    ("memoryview", count_with_memoryview),
+    ("chunks", count_with_chunks),
+)
+
+####################################################################################################
+
+def create_input_file(settings, create_func, *args):
+    """
+    Returns the tuple (path, temp_path) of the file to benchmark: the file given by --file, in
+    which case "temp_path" is None, or a temporary file created by "create_func", in which case it
+    is also "temp_path", to be deleted by the caller.
+    """
+    if settings.file is not None:
+        return (settings.file, None)
+
+    (handle, temp_path) = tempfile.mkstemp(prefix="freq_benchmark_")
+    os.close(handle)
+    print("Creating a %i-byte file in %s" % (settings.size, temp_path))
+    create_func(temp_path, settings.size, *args)
+    return (temp_path, temp_path)
+
+def benchmark_read(settings):
+    """
+    Compares the READERS on the same file, checking that their counts agree.
+    """
+    (path, temp_path) = create_input_file(settings, create_synthetic_file, settings.num_distinct,
+        settings.seed)
+    try:
+        size = os.path.getsize(path)
+        expected = None
+        for (name, func) in READERS:
+            if settings.readers and name not in settings.readers:
+                continue
+
+            if settings.trace_memory:
+                tracemalloc.start()
+            start_time = time.perf_counter()
+            counts = func(path)
+            elapsed = time.perf_counter() - start_time
+            if settings.trace_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                peak_str = "  peak %8.1f MB" % (peak / 1024.0 / 1024.0)
+            else:
+                peak_str = ""
+
+            if expected is None:
+                expected = counts
+            elif counts != expected:
+                raise AssertionError("counts of %s differ" % name)
+
+            print("%-10s  %8.3fs  %8.1f MB/s  %12.0f lines/sec%s" % (name, elapsed,
+                size / elapsed / 1024.0 / 1024.0, sum(counts.values()) / elapsed, peak_str))
+    finally:
+        if temp_path is not None:
+            freq.safe_delete(temp_path)
+
+FILTERS = (
+    ("trim", dict(trim=True, include_empty=False)),
+    ("fields", dict(trim=False, include_empty=False, fields=freq.parse_fields("2-4"))),
+    ("regex", dict(trim=False, include_empty=False, regex=re.compile(br" (/[a-z]+)/"))),
+    ("masks", dict(trim=False, include_empty=False, mask_timestamps=True, mask_uuids=True,
+        mask_numbers=True)),
+    ("all", dict(trim=True, include_empty=False, fields=freq.parse_fields("2-"),
+        regex=re.compile(br"^(.*) took"), mask_uuids=True, mask_numbers=True,
+        lowercase=True)),
+)
+"""
+The LineFilter arguments to benchmark; "trim" was the only normalization that LineFilter originally
+supported.
+"""
+
+def benchmark_filter(settings):
+    """
+    Compares counting the lines of a file with each of FILTERS to counting them with no filter.
+    """
+    (path, temp_path) = create_input_file(settings, create_synthetic_log, settings.seed)
+    try:
+        size = os.path.getsize(path)
+        print("%-10s  %8s  %10s  %10s" % ("filter", "time", "MB/s", "distinct"))
+        for (name, kwargs) in (("none", None),) + FILTERS:
+            if settings.filters and name not in settings.filters:
+                continue
+            line_filter = freq.LineFilter(**kwargs) if kwargs is not None else None
+
+            start_time = time.perf_counter()
+            results = freq.FreqCounter(None, max_bytes=float("inf"))
+            for (func, args) in freq.iter_count_tasks(path, line_filter):
+                results.add_counts(func(*args).items())
+            elapsed = time.perf_counter() - start_time
+
+            print("%-10s  %7.3fs  %10.1f  %10i" % (name, elapsed, size / elapsed / 1024.0 / 1024.0,
+                len(results.counts)))
+    finally:
+        if temp_path is not None:
+            freq.safe_delete(temp_path)
+
+####################################################################################################
+
+def add_file_arguments(parser):
+    parser.add_argument(
+        "--file",
+        help="Count the lines of this existing file instead of creating a synthetic file",
+    )
+    parser.add_argument(
+        "--size",
+        type=int,
+        default=1024 * 1024 * 1024,
+        help="The approximate size, in bytes, of the synthetic file (default %(default)i)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="The seed of the random number generator (default %(default)i)",
+    )
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    read_parser = subparsers.add_parser("read",
+        help="Compare the ways of reading and counting the lines of a file")
+    add_file_arguments(read_parser)
+    read_parser.add_argument(
+        "--num-distinct",
+        type=int,
+        default=100000,
+        help="The number of distinct lines in the synthetic file (default %(default)i)",
+    )
+    read_parser.add_argument(
+        "--readers",
+        nargs="+",
+        choices=[name for (name, func) in READERS],
+        help="The readers to benchmark (default all)",
+    )
+    read_parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        default=False,
+        help="Report the peak memory allocated by each reader using tracemalloc, which makes " +
+            "them much slower",
+    )
+    read_parser.set_defaults(func=benchmark_read)
+
+    filter_parser = subparsers.add_parser("filter",
+        help="Compare the LineFilter normalizations on a synthetic log file")
+    add_file_arguments(filter_parser)
+    filter_parser.add_argument(
+        "--filters",
+        nargs="+",
+        choices=[name for (name, kwargs) in FILTERS],
+        help="The filters to benchmark, in addition to no filter (default all)",
+    )
+    filter_parser.set_defaults(func=benchmark_filter)
+
+    return parser.parse_args(args)
+
+def main(args):
+    settings = parse_args(args)
+    settings.func(settings)
+    return 0
+
+####################################################################################################
+# Main Entry Point
+####################################################################################################
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
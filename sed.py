@@ -23,23 +23,37 @@ Positional Arguments:
   Python's `glob.glob()` function (https://docs.python.org/3/library/glob.html#glob.glob). That is,
   * matches zero or more characters, ? matches a single character, and [seq] matches any character
   in `seq`. Additionally, ** performs a recursive match.
+
+Input compressed with gzip, bzip2, xz or zstd (which requires the `zstandard` module) is detected by
+its magic bytes and decompressed transparently. Files modified in-place are written back compressed
+in the same format.
 """
 
 from __future__ import annotations
 
+import bz2
 from collections.abc import Sequence
 import dataclasses
 import enum
 import glob
+import gzip
+import io
+import lzma
 import pathlib
 import re
 import sys
-from typing import Literal
+from typing import BinaryIO, Literal
+import zlib
 
 from absl import app
 from absl import flags
 from absl import logging
 
+try:
+  import zstandard
+except ImportError:
+  zstandard = None
+
 
 FLAG_IN_PLACE = flags.DEFINE_boolean(
     "i", False, "Modify files in-place rather than printing the results to standard output."
@@ -74,6 +88,20 @@ INPLACE = Symbol("INPLACE")
 STDOUT = Symbol("STDOUT")
 
 
+@dataclasses.dataclass(frozen=True)
+class CompressionFormat:
+  name: str
+  magic: bytes
+
+
+GZIP = CompressionFormat("gzip", b"\x1f\x8b")
+BZIP2 = CompressionFormat("bzip2", b"BZh")
+XZ = CompressionFormat("xz", b"\xfd7zXZ\x00")
+ZSTD = CompressionFormat("zstd", b"\x28\xb5\x2f\xfd")
+COMPRESSION_FORMATS = (GZIP, BZIP2, XZ, ZSTD)
+MAGIC_SIZE = max(len(compression.magic) for compression in COMPRESSION_FORMATS)
+
+
 def main(argv: Sequence[str]) -> None:
   try:
     args = parseCommandLineArguments(argv)
@@ -90,7 +118,16 @@ def main(argv: Sequence[str]) -> None:
 
   if len(args.input_file_patterns) == 0:
     logging.debug("Reading input from standard input")
-    input_text = sys.stdin.read()
+    stdin_buffer = sys.stdin.buffer
+    compression = detect_compression(stdin_buffer.peek(MAGIC_SIZE))
+    if compression is None:
+      input_text = sys.stdin.read()
+    else:
+      try:
+        input_text = read_text(stdin_buffer, compression)
+      except DecompressionError as e:
+        print(f"ERROR: decompression of standard input failed: {e}", file=sys.stderr)
+        return 1
     output_text = search_expr.sub(args.replacement_pattern, input_text)
     print_output_text(
         text=output_text,
@@ -106,9 +143,13 @@ def main(argv: Sequence[str]) -> None:
           continue
 
         logging.debug("Reading %s", input_file)
-        with input_file.open("rt", encoding="utf8") as f:
+        with input_file.open("rb") as f:
+          compression = detect_compression(f.peek(MAGIC_SIZE))
           try:
-            input_text = f.read()
+            input_text = read_text(f, compression)
+          except DecompressionError as e:
+            print(f"ERROR: decompression of {input_file} failed: {e}", file=sys.stderr)
+            return 1
           except UnicodeDecodeError as e:
             if args.utf8_decode_error_handle_strategy == Utf8DecodeErrorHandleStrategy.FAIL:
               print(f"ERROR: UTF-8 decoding of {input_file} failed: {e}")
@@ -131,6 +172,7 @@ def main(argv: Sequence[str]) -> None:
             text=output_text,
             src=input_file,
             dest=args.output_dest,
+            compression=compression,
         )
 
 
@@ -189,8 +231,77 @@ def parseCommandLineArguments(argv: Sequence[str]) -> CommandLineArguments:
   )
 
 
+class DecompressionError(Exception):
+  pass
+
+
+def detect_compression(data: bytes) -> CompressionFormat | None:
+  for compression in COMPRESSION_FORMATS:
+    if data.startswith(compression.magic):
+      return compression
+  return None
+
+
+def read_text(f: BinaryIO, compression: CompressionFormat | None) -> str:
+  """Reads all text from a binary file, decompressing it if it is compressed.
+
+  The text is decoded as UTF-8 with universal newlines, just like a file opened in "rt" mode.
+  Closing the file objects created to decompress and decode does not close `f`.
+  """
+  if compression is None:
+    binary_file = f
+  elif compression is ZSTD:
+    if zstandard is None:
+      raise DecompressionError("the zstandard module is not installed")
+    binary_file = zstandard.ZstdDecompressor().stream_reader(
+        f, read_across_frames=True, closefd=False
+    )
+  elif compression is GZIP:
+    binary_file = gzip.GzipFile(fileobj=f, mode="rb")
+  elif compression is BZIP2:
+    binary_file = bz2.BZ2File(f, "rb")
+  elif compression is XZ:
+    binary_file = lzma.LZMAFile(f, "rb")
+  else:
+    raise RuntimeError(f"INTERNAL ERROR: unknown compression: {compression}")
+
+  text_file = io.TextIOWrapper(binary_file, encoding="utf8")
+  try:
+    return text_file.read()
+  except (EOFError, OSError, lzma.LZMAError, zlib.error) as e:
+    if compression is None:
+      raise
+    raise DecompressionError(str(e)) from e
+  except Exception as e:
+    if zstandard is not None and isinstance(e, zstandard.ZstdError):
+      raise DecompressionError(str(e)) from e
+    raise
+  finally:
+    # prevent the wrapper from closing `f` when it is garbage collected
+    text_file.detach()
+    if binary_file is not f:
+      binary_file.close()
+
+
+def open_compressed_output(path: pathlib.Path, compression: CompressionFormat) -> BinaryIO:
+  if compression is ZSTD:
+    if zstandard is None:
+      raise DecompressionError("the zstandard module is not installed")
+    return zstandard.ZstdCompressor().stream_writer(path.open("wb"))
+  elif compression is GZIP:
+    return gzip.open(path, "wb")
+  elif compression is BZIP2:
+    return bz2.open(path, "wb")
+  elif compression is XZ:
+    return lzma.open(path, "wb")
+  raise RuntimeError(f"INTERNAL ERROR: unknown compression: {compression}")
+
+
 def print_output_text(
-    text: str, src: pathlib.Path | None, dest: pathlib.Path | Literal[INPLACE, STDOUT]
+    text: str,
+    src: pathlib.Path | None,
+    dest: pathlib.Path | Literal[INPLACE, STDOUT],
+    compression: CompressionFormat | None = None,
 ) -> None:
   if dest is STDOUT or (dest is INPLACE and src is None):
     logging.debug("Writing result to standard output")
@@ -198,6 +309,12 @@ def print_output_text(
     return
 
   dest_file = src if dest is INPLACE else dest
+  if dest is INPLACE and compression is not None:
+    logging.debug("Writing result to %s, compressed with %s", dest_file, compression.name)
+    with io.TextIOWrapper(open_compressed_output(dest_file, compression), encoding="utf8") as f:
+      f.write(text)
+    return
+
   logging.debug("Writing result to %s", dest_file)
   with dest_file.open("wt", encoding="utf8") as f:
     f.write(text)